@@ -1,8 +1,16 @@
 import os
 import sys
+import time
+import atexit
 import logging
+import threading
 import config
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 try:
     import maya.cmds.about
 
@@ -23,8 +31,11 @@ INFO = 20
 DEBUG = 10
 NOTSET = 0
 
+_ASYNC_HANDLERS = {}
+_ASYNC_HANDLERS_LOCK = threading.Lock()
+
 
-def get_logger(name, shell=False, maya=_in_maya, file=None, level=INFO):
+def get_logger(name, shell=False, maya=_in_maya, file=None, level=INFO, async_file=None):
     """
     Get logger - mimicing the usage of logging.getLogger()
         name(str) : logger name
@@ -33,7 +44,11 @@ def get_logger(name, shell=False, maya=_in_maya, file=None, level=INFO):
         nuke(bol) : output to nuke editor
         file(str) : output to given filename
         level(int): logger level
+        async_file(bol): write the file from a background thread, config.ASYNC_LOGGING if None
     """
+    if async_file is None:
+        async_file = config.ASYNC_LOGGING
+
     if not file:
         file = os.environ[config.LOG_PATH_ENV]
 
@@ -42,14 +57,14 @@ def get_logger(name, shell=False, maya=_in_maya, file=None, level=INFO):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-    return Logger(name, shell, maya, file, level)
+    return Logger(name, shell, maya, file, level, async_file)
 
 
 class Logger():
     """
     """
 
-    def __init__(self, name, shell=True, maya=False, file=None, level=INFO):
+    def __init__(self, name, shell=True, maya=False, file=None, level=INFO, async_file=False):
         """
         Init Logger
         """
@@ -71,7 +86,10 @@ class Logger():
             self.__logger.addHandler(stream_hdlr)
 
         # File:
-        if file:
+        if file and async_file:
+            self.__logger.addHandler(get_async_file_handler(file, format))
+
+        elif file:
             file_hdlr = logging.FileHandler(file)
             file_hdlr.setFormatter(format)
             self.__logger.addHandler(file_hdlr)
@@ -155,6 +173,136 @@ class MayaHandler(logging.Handler):
             sys.stdout.write(msg + "\n")
 
 
+def get_async_file_handler(file, format):
+    """
+    loggers writing to the same file share one AsyncFileHandler, so one thread writes each file.
+    """
+    key = os.path.normcase(os.path.abspath(file))
+    with _ASYNC_HANDLERS_LOCK:
+        if key not in _ASYNC_HANDLERS:
+            handler = AsyncFileHandler(file)
+            handler.setFormatter(format)
+            _ASYNC_HANDLERS[key] = handler
+
+        return _ASYNC_HANDLERS[key]
+
+
+@atexit.register
+def shutdown_async_handlers():
+    with _ASYNC_HANDLERS_LOCK:
+        handlers = list(_ASYNC_HANDLERS.values())
+        _ASYNC_HANDLERS.clear()
+
+    for handler in handlers:
+        handler.close()
+
+
+class AsyncFileHandler(logging.Handler):
+    """
+    File Handler - emit only puts the record in a queue, a background thread writes batches of records.
+    a batch is written when it reaches config.ASYNC_LOG_BATCH_SIZE records, when config.ASYNC_LOG_FLUSH_INTERVAL
+    seconds passed or right away for errors. records dropped on a full queue, failed or late writes
+    are reported on close.
+    """
+
+    _STOP = object()
+
+    def __init__(self, file,
+                 queue_size=config.ASYNC_LOG_QUEUE_SIZE,
+                 batch_size=config.ASYNC_LOG_BATCH_SIZE,
+                 flush_interval=config.ASYNC_LOG_FLUSH_INTERVAL):
+        logging.Handler.__init__(self)
+        self.file = file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.dropped = 0
+        self.failed = 0
+        self.late = 0
+        self.written = 0
+
+        self._queue = queue.Queue(queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="AsyncFileHandler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        if self._closed:
+            return
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        last_write = time.time()
+        is_running = True
+        while is_running:
+            timeout = max(0.0, self.flush_interval - (time.time() - last_write))
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is self._STOP:
+                is_running = False
+
+            elif record is not None:
+                batch.append(record)
+
+            if batch and (not is_running
+                          or len(batch) >= self.batch_size
+                          or time.time() - last_write >= self.flush_interval
+                          or batch[-1].levelno >= ERROR):
+                self._write(batch)
+                batch = []
+
+            if not batch:
+                last_write = time.time()
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.failed += 1
+
+        try:
+            with open(self.file, "a") as fw:
+                fw.write("\n".join(lines) + "\n")
+
+        except (IOError, OSError) as err:
+            self.failed += len(lines)
+            sys.__stderr__.write("unable to write {} log records to {}: {}\n".format(len(lines), self.file, err))
+            return
+
+        now = time.time()
+        self.written += len(lines)
+        self.late += len([record for record in records if now - record.created > config.ASYNC_LOG_LATE_THRESHOLD])
+
+    def flush(self):
+        """
+        async handler writes on its own thread, nothing to flush here.
+        """
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(self._STOP)
+            self._thread.join(config.ASYNC_LOG_FLUSH_INTERVAL + 30)
+
+            if self.dropped or self.failed or self.late:
+                sys.__stderr__.write("{}: {} log records written, {} dropped, {} failed, {} late (>{}s)\n".format(
+                    self.file, self.written, self.dropped, self.failed, self.late, config.ASYNC_LOG_LATE_THRESHOLD
+                ))
+
+        logging.Handler.close(self)
+
+
 if __name__ == '__main__':
     log = get_logger("logger_name", shell=True)
     log.setLevel(logging.DEBUG)
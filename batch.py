@@ -0,0 +1,188 @@
+"""
+headless cache run of a whole episode, for scheduled runs on machines without a display.
+
+    mayapy batch.py <project> <episode> [--shot Sh010 --shot Sh02*] [--asset-type Char] [--jobs 4] [--report report.json]
+
+with --submit the jobs are queued on the farm broker, see job_broker.py, instead of run on this machine.
+
+exits with 0 if every job is done, 1 if any job failed and 2 if nothing matched the filters.
+"""
+import os
+import sys
+import json
+import time
+import fnmatch
+import functools
+import argparse
+import datetime
+import config
+LOG_PATH = config.LOGGING_PATH.format(**{config.FormatterKeys.STAMP: datetime.datetime.now().strftime("%Y_%m_%d__%H_%M_%S")})
+os.environ.setdefault(config.LOG_PATH_ENV, LOG_PATH)
+import core
+import scanner
+import job_broker
+import job_store
+import scheduler
+import app_logger
+
+
+LOGGER = app_logger.get_logger(__name__, shell=True, file=os.environ[config.LOG_PATH_ENV])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="cache every shot file of an episode without the ui.")
+    parser.add_argument("project")
+    parser.add_argument("episode")
+    parser.add_argument("--shot", action="append", default=[],
+                        help="shot name or wildcard pattern, can be given more than once. all shots by default")
+    parser.add_argument("--asset-type", action="append", default=[], choices=["Char", "Prop", "Camera"],
+                        help="asset type to cache, can be given more than once. all cacheable types by default")
+    parser.add_argument("--jobs", type=int, default=config.JOB_POOL_SIZE,
+                        help="number of maya processes run at once, default: %(default)s")
+    parser.add_argument("--force", action="store_true", help="re-cache references with an up to date cache")
+    parser.add_argument("--sharded", action="store_true", help="split the references of a file across processes")
+    parser.add_argument("--all-versions", action="store_true", help="cache superseded _v?? versions too")
+    parser.add_argument("--report", help="json report path, next to the log file by default")
+    parser.add_argument("--dry-run", action="store_true", help="list the jobs without running them")
+    parser.add_argument("--submit", action="store_true", help="queue the jobs on the farm broker instead of running them")
+    return parser.parse_args(argv)
+
+
+def matches_shot(maya_file, shot_patterns):
+    if not shot_patterns:
+        return True
+
+    return any(fnmatch.fnmatch(maya_file.shot.lower(), pattern.lower()) for pattern in shot_patterns)
+
+
+def create_jobs(project, episode, maya_files, asset_types, force=False, sharded=False):
+    """
+    one job per maya file, limited to the references of given asset types.
+
+    :rtype: list[core.Job]
+    """
+    # headers are parsed in parallel, the jobs below read the references of every file
+    list(scanner.parallel_imap(lambda maya_file: maya_file.references, maya_files, config.SCAN_WORKERS))
+
+    jobs = core.JobQueue()
+    for maya_file in maya_files:
+        if asset_types:
+            selected_reference = [ref for ref in maya_file.references if ref.is_cacheable and ref.asset_type in asset_types]
+            if not selected_reference:
+                continue
+
+        else:
+            selected_reference = core.Job.ALL_REFERENCE
+
+        job = core.Job(project, episode, maya_file, selected_reference, force, sharded)
+        if job.reference_to_cache:
+            jobs.add(job)
+
+    return list(jobs)
+
+
+def build_report(args, jobs, started, duration):
+    """
+    :rtype: dict
+    """
+    job_reports = []
+    for job in jobs:
+        job_reports.append({
+            "file": job.maya_file_instance.file_path,
+            "status": job.status,
+            "references": [ref.reference_node for ref in job.reference_to_cache],
+            "failed_references": [ref.reference_node for ref in job.failed_references],
+            "results": job.result.references if job.result else {},
+        })
+
+    statuses = [job.status for job in jobs]
+    return {
+        "project": args.project,
+        "episode": args.episode,
+        "started": started,
+        "duration": round(duration, 3),
+        "log": os.environ[config.LOG_PATH_ENV],
+        "summary": {
+            "total": len(jobs),
+            "done": statuses.count(core.Job.DONE),
+            "error": statuses.count(core.Job.ERROR),
+            "not_run": statuses.count(core.Job.IN_QUEUE),
+        },
+        "jobs": job_reports,
+    }
+
+
+def write_report(report, report_path):
+    dirname = os.path.dirname(report_path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    with open(report_path, "w") as fw:
+        json.dump(report, fw, indent=4, sort_keys=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = datetime.datetime.now().isoformat()
+    start = time.time()
+
+    LOGGER.info("scanning project: {}, episode: {}".format(args.project, args.episode))
+    maya_files = [maya_file for maya_file in core.get_maya_files(args.project, args.episode, all_versions=args.all_versions)
+                  if matches_shot(maya_file, args.shot)]
+    jobs = create_jobs(args.project, args.episode, maya_files, args.asset_type, args.force, args.sharded)
+    LOGGER.info("{} maya files matched, {} jobs created".format(len(maya_files), len(jobs)))
+
+    if not jobs:
+        LOGGER.warning("nothing to cache for given filters")
+        return 2
+
+    if args.dry_run:
+        for job in jobs:
+            LOGGER.info(job.display_name)
+        return 0
+
+    if args.submit:
+        broker = job_broker.Broker()
+        job_ids = [broker.submit(job) for job in jobs]
+        LOGGER.info("submitted {} jobs to {}: {}".format(len(job_ids), broker.path, ", ".join(map(str, job_ids))))
+        return 0
+
+    def on_count_change(running, waiting):
+        LOGGER.info("running: {}, waiting: {}".format(running, waiting))
+
+    def on_eta_change(queue_eta):
+        LOGGER.info("queue ETA: {}".format(datetime.timedelta(seconds=int(queue_eta))))
+
+    # run times are kept in the job store, they improve the estimates of later runs
+    store = job_store.JobStore()
+    run_starts = {}
+
+    def on_status_change(job, status):
+        if status == core.Job.IP:
+            run_starts[job] = time.time()
+        elif status in (core.Job.DONE, core.Job.ERROR) and job in run_starts:
+            store.add_timing(job, status, run_starts.pop(job), time.time())
+
+    for job in jobs:
+        job.SIGNAL.connect(functools.partial(on_status_change, job))
+
+    core.JobPool(args.jobs, on_count_change, scheduler.Scheduler(store), on_eta_change).run(jobs)
+
+    report = build_report(args, jobs, started, time.time() - start)
+    report_path = args.report or os.path.splitext(os.environ[config.LOG_PATH_ENV])[0] + "_report.json"
+    write_report(report, report_path)
+
+    summary = report["summary"]
+    LOGGER.info("finished in {:.0f} seconds, {} jobs: {} done, {} failed, {} not run. report: {}".format(
+        report["duration"], summary["total"], summary["done"], summary["error"], summary["not_run"], report_path
+    ))
+    for job in jobs:
+        if job.status == core.Job.ERROR:
+            LOGGER.warning("failed: {} {}".format(job.maya_file_instance.file_name,
+                                                  ", ".join([ref.reference_node for ref in job.failed_references])))
+
+    return 0 if summary["done"] == summary["total"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
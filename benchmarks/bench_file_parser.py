@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of the streaming .ma header parser against the previous regex parser.
+
+    python benchmarks/bench_file_parser.py --references 10 100 1000 --flags 10 20 30
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import file_parser
+
+
+LEGACY_PATTERN = re.compile(r'file -rd.+-ns "(?P<namespace>.+)"(.+|.+\n\s.+)-rfn(.+|.+\n\s.+)"(?P<refnode>.+)"(.+|.+\n\s.+)-typ(.+|.+\n\s.+)"(?P<path>{}.+)"'.format(config.REFERENCE_DRIVE))
+
+
+def legacy_get_reference_info_from_file(maya_file_path, limit=10000):
+    with open(maya_file_path, "r") as fr:
+        file_upper_chunk = fr.read(limit) if limit else fr.read()
+
+    return [match.groupdict() for match in LEGACY_PATTERN.finditer(file_upper_chunk)]
+
+
+def write_synthetic_header(path, reference_count, body_nodes=2000):
+    """
+    .ma file with given number of references, half of the file commands spread over two lines
+    the way maya writes long commands, followed by a body which must never be read.
+    """
+    with open(path, "w") as fw:
+        fw.write("//Maya ASCII 2020 scene\n//Name: {}\n//Codeset: 1252\n".format(os.path.basename(path)))
+        for index in range(reference_count):
+            asset_type = "char" if index % 2 else "prop"
+            separator = "\n\t\t" if index % 2 else " "
+            fw.write('file -rdi 1 -ns "asset{0:04d}" -rfn "asset{0:04d}RN" -op "v=0;"{1}-typ "mayaAscii" '
+                     '"{2}/workspsace/assets/{3}/asset{0:04d}/rig/asset{0:04d}_rig.ma";\n'.format(
+                         index, separator, config.REFERENCE_DRIVE, asset_type))
+
+        for index in range(reference_count):
+            fw.write('file -r -ns "asset{0:04d}" -dr 1 -rfn "asset{0:04d}RN" -op "v=0;" -typ "mayaAscii" '
+                     '"{1}/workspsace/assets/char/asset{0:04d}/rig/asset{0:04d}_rig.ma";\n'.format(index, config.REFERENCE_DRIVE))
+
+        fw.write('requires maya "2020";\ncurrentUnit -l centimeter -a degree -t film;\n')
+        for index in range(body_nodes):
+            fw.write('createNode transform -n "node{0}";\n\tsetAttr ".t" -type "double3" 0 0 {0} ;\n'.format(index))
+
+
+def write_backtracking_header(path, flag_count):
+    """
+    single reference outside the reference drive with a long option string,
+    the previous regex backtracks polynomially over such a line before rejecting it.
+    """
+    options = " ".join('-rfn \\"node{}\\"'.format(index) for index in range(flag_count))
+    with open(path, "w") as fw:
+        fw.write('file -rdi 1 -ns "local" -rfn "localRN" -op "{}" -typ "mayaAscii" "C:/local/local_rig.ma";\n'.format(options))
+        fw.write('requires maya "2020";\n')
+
+
+def best_of(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        timings.append(time.time() - start)
+
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--references", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--flags", type=int, nargs="+", default=[10, 20, 30],
+                        help="option string length of the backtracking case, legacy time grows polynomially")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="cache_manager_bench_")
+    try:
+        print("{:>10} | {:>22} | {:>22} | {:>22}".format("references", "streaming (found, ms)", "legacy 10k (found, ms)", "legacy full (found, ms)"))
+        for reference_count in args.references:
+            path = os.path.join(temp_dir, "bench_{}.ma".format(reference_count))
+            write_synthetic_header(path, reference_count)
+
+            row = []
+            for function in (lambda: file_parser.get_reference_info_from_file(path),
+                             lambda: legacy_get_reference_info_from_file(path),
+                             lambda: legacy_get_reference_info_from_file(path, limit=None)):
+                seconds, result = best_of(function, args.repeat)
+                row.append("{:>8} {:>13.2f}".format(len(result), seconds * 1000))
+
+            print("{:>10} | {} | {} | {}".format(reference_count, *row))
+
+        print("")
+        print("{:>10} | {:>22} | {:>22}".format("flags", "streaming (found, ms)", "legacy 10k (found, ms)"))
+        for flag_count in args.flags:
+            path = os.path.join(temp_dir, "backtracking_{}.ma".format(flag_count))
+            write_backtracking_header(path, flag_count)
+
+            row = []
+            for function in (lambda: file_parser.get_reference_info_from_file(path),
+                             lambda: legacy_get_reference_info_from_file(path)):
+                seconds, result = best_of(function, 1)
+                row.append("{:>8} {:>13.2f}".format(len(result), seconds * 1000))
+
+            print("{:>10} | {} | {}".format(flag_count, *row))
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Stand-in for mayabatch.exe, installed by synthetic_episode.install_fake_mayabatch.
+
+takes the same "-log <path> -command <mel>" arguments maya_launcher passes and runs the called
+maya_operations function, main() for one job or serve() for a persistent worker, without maya:
+startup latency, export time per frame and reference, cache files of a fixed size, failed references
+and crashes are simulated from the CACHE_MANAGER_FAKE_* environment variables.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import synthetic_episode
+
+if os.environ.get(synthetic_episode.ROOT_ENV):
+    synthetic_episode.configure_paths(os.environ[synthetic_episode.ROOT_ENV])
+
+import file_parser
+import cache_manifest
+import publisher
+
+
+COMMAND_PATTERN = re.compile(r"maya_operations\.(?P<function>\w+)\((?P<arguments>.*)\)")
+ARGUMENT_PATTERN = re.compile(r'\\*"([^"\\]*)\\*"')
+
+STARTUP = float(os.environ.get("CACHE_MANAGER_FAKE_STARTUP", 1.0))
+FRAME_TIME = float(os.environ.get("CACHE_MANAGER_FAKE_FRAME_TIME", 0.0005))
+OUTPUT_SIZE = int(float(os.environ.get("CACHE_MANAGER_FAKE_OUTPUT_KB", 64)) * 1024)
+FAILURE_RATE = float(os.environ.get("CACHE_MANAGER_FAKE_FAILURE_RATE", 0.0))
+CRASH_RATE = float(os.environ.get("CACHE_MANAGER_FAKE_CRASH_RATE", 0.0))
+
+RANDOM = random.Random(int(os.environ.get("CACHE_MANAGER_FAKE_SEED", 0)) + os.getpid())
+
+
+def parse_arguments(argv):
+    """
+    :rtype: (str, str, list[str])
+    """
+    log_path = argv[argv.index("-log") + 1] if "-log" in argv else None
+    command = argv[argv.index("-command") + 1]
+    match = COMMAND_PATTERN.search(command)
+    if not match:
+        raise ValueError("unknown command: {}".format(command))
+
+    return log_path, match.group("function"), ARGUMENT_PATTERN.findall(match.group("arguments"))
+
+
+def log(message):
+    sys.stdout.write("{}\n".format(message))
+    sys.stdout.flush()
+
+
+def get_output_path(maya_file_path, episode, reference):
+    shot = os.path.basename(maya_file_path).split("_")[2]
+    asset_type = "Char" if "/char/" in reference["path"] else "Prop"
+    return config.CACHE_OUTPUT.format(**{
+        config.FormatterKeys.EPI: episode,
+        config.FormatterKeys.SHOT: shot,
+        config.FormatterKeys.ASSET_TYPE: asset_type,
+        config.FormatterKeys.NAME: "{}.abc".format(reference["namespace"]),
+    })
+
+
+def export(episode, maya_file_path, reference_nodes, is_camera_cache):
+    """
+    simulated CacheExporter.doit(), returns the same result record as maya_operations.
+
+    :rtype: dict
+    """
+    started_at = time.time()
+    start_frame, end_frame = file_parser.get_frame_range_from_file(maya_file_path) or (1001, 1100)
+    frame_count = int(end_frame - start_frame) + 1
+    references = dict((reference["refnode"], reference) for reference in file_parser.get_reference_info_from_file(maya_file_path))
+
+    results = {}
+    opened = time.time()
+    total = len(reference_nodes) * frame_count
+    for index, reference_node in enumerate(reference_nodes):
+        start = time.time()
+        for frame in range(frame_count):
+            time.sleep(FRAME_TIME)
+            if frame % 10 == 0 or frame == frame_count - 1:
+                log("{}{}".format(config.PROGRESS_TRACKER, json.dumps({
+                    "reference": reference_node, "frame": start_frame + frame,
+                    "done": index * frame_count + frame + 1, "total": total,
+                })))
+
+        if reference_node not in references:
+            results[reference_node] = {"status": "error", "output_path": "", "size": 0, "duration": 0.0,
+                                       "error": "reference not found"}
+            continue
+
+        output_path = get_output_path(maya_file_path, episode, references[reference_node])
+        write_path = publisher.get_scratch_path(output_path) if config.USE_LOCAL_SCRATCH else output_path
+        scratch_path = write_path if write_path != output_path else ""
+        if RANDOM.random() < FAILURE_RATE:
+            results[reference_node] = {"status": "error", "output_path": output_path, "scratch_path": "", "size": 0,
+                                       "duration": round(time.time() - start, 3), "error": "simulated export failure"}
+            continue
+
+        if not os.path.exists(os.path.dirname(write_path)):
+            os.makedirs(os.path.dirname(write_path))
+        with open(write_path, "wb") as fw:
+            fw.write(b"\0" * OUTPUT_SIZE)
+        cache_manifest.write_manifest(write_path, [maya_file_path, references[reference_node]["path"]])
+
+        results[reference_node] = {"status": "done", "output_path": output_path, "scratch_path": scratch_path,
+                                   "size": OUTPUT_SIZE, "duration": round(time.time() - start, 3), "error": ""}
+
+    if is_camera_cache:
+        results["Camera"] = {"status": "done", "output_path": "", "size": 0, "duration": 0.0, "error": ""}
+
+    return {
+        "success": all(result["status"] == "done" for result in results.values()),
+        "expected_error": False,
+        "error": "",
+        "maya_file_path": maya_file_path,
+        "references": results,
+        "timings": {
+            "started_at": started_at,
+            "phases": {"open_maya_file": round(opened - started_at, 3), "export_caches": round(time.time() - opened, 3)},
+            "output_bytes": sum(result["size"] for result in results.values()),
+            "open_mode": "deferred" if config.DEFERRED_REFERENCE_LOADING else "full",
+            "skipped_references": len(set(references) - set(reference_nodes)) if config.DEFERRED_REFERENCE_LOADING else 0,
+        },
+    }
+
+
+def crash_maybe():
+    if RANDOM.random() < CRASH_RATE:
+        log("Fatal Error. Attempting to save in fake_mayabatch")
+        sys.stdout.flush()
+        os._exit(3)
+
+
+def main(project, episode, maya_file_path, reference_nodes, is_camera_cache, result_path=""):
+    result = export(episode, maya_file_path, [node for node in reference_nodes.split(",") if node], is_camera_cache == "1")
+    crash_maybe()
+
+    if result_path:
+        with open(result_path, "w") as fw:
+            json.dump(result, fw)
+
+    if result["success"]:
+        log(config.SUCCESS_CODE)
+
+
+def serve(port, max_jobs):
+    connection = socket.create_connection(("127.0.0.1", int(port)))
+    reader = connection.makefile("r")
+    jobs_done = 0
+    while jobs_done < int(max_jobs):
+        line = reader.readline()
+        if not line:
+            break
+
+        request = json.loads(line)
+        if request.get("command") == "quit":
+            break
+
+        result = export(request["episode"], request["maya_file_path"], request["reference_nodes"], request["is_camera_cache"])
+        crash_maybe()
+        jobs_done += 1
+        connection.sendall((json.dumps({"status": result["success"], "error": "", "result": result}) + "\n").encode("utf-8"))
+
+    reader.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    log_path, function, arguments = parse_arguments(sys.argv[1:])
+    if log_path:
+        if not os.path.exists(os.path.dirname(log_path)):
+            os.makedirs(os.path.dirname(log_path))
+        with open(log_path, "a") as fw:
+            fw.write("fake mayabatch {}{}\n".format(function, tuple(arguments)))
+
+    time.sleep(STARTUP)
+    {"main": main, "serve": serve}[function](*arguments)
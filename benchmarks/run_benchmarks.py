@@ -0,0 +1,214 @@
+"""
+End to end benchmarks of the scan and job paths on a synthetic episode, maya is replaced by fake_mayabatch.py.
+
+    python benchmarks/run_benchmarks.py --shots 50 --references 40 --json before.json
+    python benchmarks/run_benchmarks.py --shots 50 --references 40 --compare before.json
+
+sections: parse (file_parser), scan (core.get_maya_files and reference loading, cold and warm),
+dedupe (JobQueue against a list scan) and pool (core.JobPool throughput, the engine of view.JobRunner).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_episode
+
+
+SECTIONS = ["parse", "scan", "dedupe", "pool"]
+
+
+class Report(object):
+    """
+    Ordered benchmark measurements, written as json and compared against an earlier run.
+    """
+
+    def __init__(self):
+        self.values = collections.OrderedDict()
+
+    def add(self, name, value, unit, lower_is_better=True):
+        self.values[name] = {"value": value, "unit": unit, "lower_is_better": lower_is_better}
+
+    def write(self, path):
+        with open(path, "w") as fw:
+            json.dump(self.values, fw, indent=4)
+
+    def print_table(self, baseline=None):
+        baseline = baseline or {}
+        print("{:<40} {:>12} {:<10} {:>12} {:>8}".format("benchmark", "value", "unit", "baseline", "change"))
+        for name, entry in self.values.items():
+            row = "{:<40} {:>12.3f} {:<10}".format(name, entry["value"], entry["unit"])
+            if name in baseline and baseline[name]["value"]:
+                change = (entry["value"] - baseline[name]["value"]) / baseline[name]["value"] * 100
+                is_regression = change > 0 if entry["lower_is_better"] else change < 0
+                row += " {:>12.3f} {:>+7.1f}%{}".format(baseline[name]["value"], change, " !" if is_regression and abs(change) > 10 else "")
+            print(row)
+
+
+def best_of(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        timings.append(time.time() - start)
+
+    return min(timings), result
+
+
+def bench_parse(report, files, repeat):
+    import file_parser
+
+    seconds, found = best_of(lambda: sum(len(file_parser.get_reference_info_from_file(path)) for path in files), repeat)
+    report.add("parse: ms per file", seconds * 1000 / len(files), "ms")
+    report.add("parse: references per second", found / seconds, "refs/s", lower_is_better=False)
+
+
+def bench_scan(report, args, root):
+    import config
+    import core
+    import scanner
+    import reference_cache
+
+    def load_references(maya_files):
+        return sum(len(references) for references in
+                   scanner.parallel_imap(lambda maya_file: maya_file.references, maya_files, config.SCAN_WORKERS))
+
+    if os.path.exists(config.REFERENCE_CACHE_PATH):
+        os.remove(config.REFERENCE_CACHE_PATH)
+    reference_cache.REFERENCE_CACHE = reference_cache.ReferenceCache(config.REFERENCE_CACHE_PATH)
+
+    start = time.time()
+    maya_files = core.get_maya_files("Bench", args.episode)
+    report.add("scan: get_maya_files cold", time.time() - start, "s")
+
+    start = time.time()
+    load_references(maya_files)
+    report.add("scan: load references cold", time.time() - start, "s")
+
+    episode = core.Episode("Bench", args.episode)
+    seconds, maya_files = best_of(episode.scan, args.repeat)
+    report.add("scan: Episode.scan warm", seconds, "s")
+
+    seconds, _ = best_of(lambda: load_references(core.Episode("Bench", args.episode).scan()), args.repeat)
+    report.add("scan: scan + load references warm", seconds, "s")
+
+    seconds, _ = best_of(episode.refresh, args.repeat)
+    report.add("scan: refresh without changes", seconds, "s")
+
+
+def bench_dedupe(report, args):
+    import core
+
+    maya_files = core.get_maya_files("Bench", args.episode)
+    jobs = [core.Job("Bench", args.episode, maya_file, core.Job.ALL_REFERENCE)
+            for maya_file in maya_files for _ in range(2)]
+
+    def list_scan():
+        queued = []
+        for job in jobs:
+            if not any(queued_job == job for queued_job in queued):
+                queued.append(job)
+        return len(queued)
+
+    def job_queue():
+        queue = core.JobQueue()
+        for job in jobs:
+            queue.add(job)
+        return len(queue)
+
+    seconds, _ = best_of(list_scan, args.repeat)
+    report.add("dedupe: list scan, {} jobs".format(len(jobs)), seconds * 1000, "ms")
+    seconds, _ = best_of(job_queue, args.repeat)
+    report.add("dedupe: JobQueue, {} jobs".format(len(jobs)), seconds * 1000, "ms")
+
+
+def bench_pool(report, args):
+    import config
+    import core
+    import maya_launcher
+
+    maya_files = core.get_maya_files("Bench", args.episode)[:args.jobs]
+    for use_workers in (False, True):
+        config.USE_PERSISTENT_WORKERS = use_workers
+        for pool_size in args.pool_sizes:
+            jobs = [core.Job("Bench", args.episode, maya_file, core.Job.ALL_REFERENCE, force=True) for maya_file in maya_files]
+            start = time.time()
+            core.JobPool(pool_size).run(jobs)
+            seconds = time.time() - start
+            maya_launcher.shutdown_workers()
+
+            name = "pool: {} x{}".format("workers" if use_workers else "process per job", pool_size)
+            report.add(name + " jobs per minute", len(jobs) / seconds * 60, "jobs/min", lower_is_better=False)
+            report.add(name + " done", len([job for job in jobs if job.status == core.Job.DONE]), "jobs",
+                       lower_is_better=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--episode", default="Ep101")
+    parser.add_argument("--shots", type=int, default=50)
+    parser.add_argument("--versions", type=int, default=2)
+    parser.add_argument("--references", type=int, default=40)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=12, help="maya files run through the pool")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--startup", type=float, default=1.0, help="fake maya startup seconds")
+    parser.add_argument("--frame-time", type=float, default=0.0002, help="fake export seconds per frame and reference")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--crash-rate", type=float, default=0.0)
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=SECTIONS)
+    parser.add_argument("--root", help="keep the synthetic episode in given folder instead of a temporary one")
+    parser.add_argument("--json", help="write the measurements to given json file")
+    parser.add_argument("--compare", help="json file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix="cache_manager_bench_")
+    root = os.path.abspath(root).replace("\\", "/")
+    # config paths have to point at the synthetic tree before core is imported
+    synthetic_episode.configure_paths(root)
+    synthetic_episode.install_fake_mayabatch(root, args.startup, args.frame_time,
+                                             failure_rate=args.failure_rate, crash_rate=args.crash_rate)
+
+    report = Report()
+    try:
+        start = time.time()
+        files = synthetic_episode.generate_episode(root, args.episode, args.shots, args.versions, args.references,
+                                                   frames=args.frames)
+        print("generated {} shots x {} versions with {} references in {:.1f}s: {}".format(
+            args.shots, args.versions, args.references, time.time() - start, root))
+
+        if "parse" in args.sections:
+            bench_parse(report, files, args.repeat)
+        if "scan" in args.sections:
+            bench_scan(report, args, root)
+        if "dedupe" in args.sections:
+            bench_dedupe(report, args)
+        if "pool" in args.sections:
+            bench_pool(report, args)
+
+    finally:
+        if not args.root:
+            import app_logger
+            app_logger.shutdown_async_handlers()
+            shutil.rmtree(root, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fr:
+            baseline = json.load(fr)
+
+    report.print_table(baseline)
+    if args.json:
+        report.write(args.json)
+
+
+if __name__ == '__main__':
+    main()
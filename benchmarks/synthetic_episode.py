@@ -0,0 +1,141 @@
+"""
+Synthetic episode trees for the benchmarks, laid out like the network share the tool scans:
+
+    <root>/W/workspsace/unreal/EPISODES/<episode>/IFD/<shot>/pta_<episode>_<shot>_anim_v??.ma
+    <root>/W/workspsace/assets/<char|prop>/<asset>/rig/<asset>_rig.ma
+
+configure_paths(root) points config at such a tree, it has to run before core is imported.
+"""
+import os
+import sys
+import stat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+ROOT_ENV = "CACHE_MANAGER_BENCH_ROOT"
+FAKE_MAYABATCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_mayabatch.py")
+
+
+def get_drive(root):
+    return os.path.join(root, "W").replace("\\", "/")
+
+
+def configure_paths(root):
+    """
+    point config paths of the tool at the synthetic tree in root, caches and logs are kept in root too.
+    """
+    drive = get_drive(root)
+    config.REFERENCE_DRIVE = drive
+    config.EPISODE_ROOT = drive + "/workspsace/unreal/EPISODES/"
+    config.SOURCE_MAYA_ROOT = drive + "/workspsace/unreal/EPISODES/{epi}/IFD"
+    config.SOURCE_MAYA_FILES = config.SOURCE_MAYA_ROOT + "/*/" + config.SOURCE_MAYA_FILE_PATTERN
+    config.CACHE_OUTPUT = drive + "/workspsace/unreal/EPISODES/{epi}/Alembic/{shot}/{asset_type}/{name}"
+    config.LOGGING_PATH = root + "/logs/cache_manager_{stamp}.log"
+    config.MAYA_LOG_PATH = root + "/logs/{epi}/{name}_maya_log.log"
+    config.MAYA_WORKER_LOG_PATH = root + "/logs/workers/{name}_maya_log.log"
+    config.REFERENCE_CACHE_PATH = os.path.join(root, "reference_cache.db")
+    config.JOB_STORE_PATH = os.path.join(root, "job_store.db")
+    config.BROKER_PATH = os.path.join(root, "job_broker.db")
+    config.METRICS_PATH = os.path.join(root, "metrics.db")
+    config.LOCAL_SCRATCH = os.path.join(root, "scratch").replace("\\", "/")
+    os.environ[ROOT_ENV] = root
+    os.environ.setdefault(config.LOG_PATH_ENV, root + "/logs/bench.log")
+
+
+def install_fake_mayabatch(root, startup=1.0, frame_time=0.0005, output_kb=64, failure_rate=0.0, crash_rate=0.0, seed=0):
+    """
+    use fake_mayabatch.py as config.MAYA_BATCH, options reach the fake processes through the environment.
+
+    :param startup: seconds until the fake maya accepts work
+    :param frame_time: seconds per exported frame of one reference
+    :param output_kb: size of every written cache file
+    :param failure_rate: chance of a reference export failing
+    :param crash_rate: chance of the process exiting without a result
+    """
+    os.environ.update({
+        "CACHE_MANAGER_FAKE_STARTUP": str(startup),
+        "CACHE_MANAGER_FAKE_FRAME_TIME": str(frame_time),
+        "CACHE_MANAGER_FAKE_OUTPUT_KB": str(output_kb),
+        "CACHE_MANAGER_FAKE_FAILURE_RATE": str(failure_rate),
+        "CACHE_MANAGER_FAKE_CRASH_RATE": str(crash_rate),
+        "CACHE_MANAGER_FAKE_SEED": str(seed),
+    })
+
+    # commands run through the shell, the executable has to be a single path
+    if os.name == "nt":
+        executable = os.path.join(root, "fake_mayabatch.bat")
+        with open(executable, "w") as fw:
+            fw.write('@"{}" "{}" %*\n'.format(sys.executable, FAKE_MAYABATCH))
+    else:
+        executable = os.path.join(root, "fake_mayabatch")
+        with open(executable, "w") as fw:
+            fw.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, FAKE_MAYABATCH))
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+
+    config.MAYA_BATCH = executable
+    return executable
+
+
+def write_maya_file(path, drive, reference_count, body_nodes=2000, start_frame=1001, end_frame=1120):
+    """
+    .ma file with given number of references, half of the file commands spread over several lines
+    the way maya writes long commands, a body which is never parsed and the playbackOptions at the end.
+    """
+    with open(path, "w") as fw:
+        fw.write("//Maya ASCII 2020 scene\n//Name: {}\n//Codeset: 1252\n".format(os.path.basename(path)))
+        for index in range(reference_count):
+            separator = "\n\t\t" if index % 2 else " "
+            fw.write('file -rdi 1 -ns "asset{0:04d}" -rfn "asset{0:04d}RN" -op "v=0;"{1}-typ "mayaAscii" '
+                     '"{2}";\n'.format(index, separator, get_asset_path(drive, index)))
+
+        for index in range(reference_count):
+            separator = "\n\t\t" if index % 2 else " "
+            fw.write('file -r -ns "asset{0:04d}" -dr 1{1}-rfn "asset{0:04d}RN" -op "v=0;" -typ "mayaAscii" '
+                     '"{2}";\n'.format(index, separator, get_asset_path(drive, index)))
+
+        fw.write('requires maya "2020";\ncurrentUnit -l centimeter -a degree -t film;\n')
+        for index in range(body_nodes):
+            fw.write('createNode transform -n "node{0}";\n\tsetAttr ".t" -type "double3" 0 0 {0} ;\n'.format(index))
+
+        fw.write('createNode script -n "sceneConfigurationScriptNode";\n'
+                 '\tsetAttr ".b" -type "string" "playbackOptions -min {0} -max {1} -ast {0} -aet {1} ";\n'
+                 '\tsetAttr ".st" 6;\n// End of {2}\n'.format(start_frame, end_frame, os.path.basename(path)))
+
+
+def get_asset_path(drive, index):
+    asset_type = "char" if index % 2 else "prop"
+    return "{0}/workspsace/assets/{1}/asset{2:04d}/rig/asset{2:04d}_rig.ma".format(drive, asset_type, index)
+
+
+def generate_episode(root, episode="Ep101", shots=50, versions=2, references=40, body_nodes=2000, frames=120):
+    """
+    write a synthetic episode, every shot has one file in given number of versions.
+
+    :return: latest version of every shot file
+    :rtype: list[str]
+    """
+    drive = get_drive(root)
+    for index in range(references):
+        asset_path = get_asset_path(drive, index)
+        if not os.path.exists(asset_path):
+            os.makedirs(os.path.dirname(asset_path))
+            with open(asset_path, "w") as fw:
+                fw.write("//Maya ASCII 2020 scene\n")
+
+    latest_files = []
+    for shot_index in range(shots):
+        shot = "Sh{:03d}".format((shot_index + 1) * 10)
+        shot_dir = "{}/workspsace/unreal/EPISODES/{}/IFD/{}".format(drive, episode, shot)
+        if not os.path.exists(shot_dir):
+            os.makedirs(shot_dir)
+
+        for version in range(1, versions + 1):
+            path = "{}/pta_{}_{}_anim_v{:02d}.ma".format(shot_dir, episode.lower(), shot.lower(), version)
+            write_maya_file(path, drive, references, body_nodes, 1001, 1000 + frames)
+
+        latest_files.append(path)
+
+    return latest_files
@@ -0,0 +1,72 @@
+import os
+import re
+import json
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# maya appends {1}, {2}.. to paths of an asset referenced more than once
+COPY_NUMBER_PATTERN = re.compile(r"\{\d+\}$")
+
+
+def normalize_path(path):
+    return COPY_NUMBER_PATTERN.sub("", path).replace("\\", "/")
+
+
+def get_manifest_path(output_path):
+    return output_path + MANIFEST_SUFFIX
+
+
+def get_fingerprint(path):
+    """
+    modification time and size of given file, None if it does not exist.
+
+    :rtype: dict
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def write_manifest(output_path, input_paths):
+    """
+    record fingerprints of the cache and the files it was made from in a sidecar next to the cache.
+    """
+    manifest = {
+        "output": get_fingerprint(output_path),
+        "inputs": dict((normalize_path(path), get_fingerprint(normalize_path(path))) for path in input_paths),
+    }
+    write_manifest_data(get_manifest_path(output_path), manifest)
+
+
+def write_manifest_data(manifest_path, manifest):
+    with open(manifest_path, "w") as fw:
+        json.dump(manifest, fw, indent=4, sort_keys=True)
+
+
+def read_manifest(output_path):
+    try:
+        with open(get_manifest_path(output_path), "r") as fr:
+            return json.load(fr)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_up_to_date(output_path, input_paths):
+    """
+    True if the cache exists, is unchanged since its manifest was written
+    and was made from the current version of every input file.
+    """
+    manifest = read_manifest(output_path)
+    if not manifest:
+        return False
+
+    output = get_fingerprint(output_path)
+    if output is None or output != manifest.get("output"):
+        return False
+
+    inputs = dict((normalize_path(path), get_fingerprint(normalize_path(path))) for path in input_paths)
+    return inputs == manifest.get("inputs")
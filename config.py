@@ -1,3 +1,5 @@
+import os
+
 
 class FormatterKeys(object):
     PROJ = "proj"
@@ -19,16 +21,108 @@ class __FormatterKeys(object):
 
 REFERENCE_DRIVE = "W:"
 EPISODE_ROOT = "W:/workspsace/unreal/EPISODES/"
-SOURCE_MAYA_FILES = "W:/workspsace/unreal/EPISODES/{f.EPI}/IFD/*/*_*_*_v??.ma".format(f=__FormatterKeys)
+SOURCE_MAYA_ROOT = "W:/workspsace/unreal/EPISODES/{f.EPI}/IFD".format(f=__FormatterKeys)
+SOURCE_MAYA_FILE_PATTERN = "*_*_*_v??.ma"
+SOURCE_MAYA_FILES = SOURCE_MAYA_ROOT + "/*/" + SOURCE_MAYA_FILE_PATTERN
 CACHE_OUTPUT = "W:/workspsace/unreal/EPISODES/{f.EPI}/Alembic/{f.SHOT}/{f.ASSET_TYPE}/{f.NAME}".format(f=__FormatterKeys)
-MAYA_BATCH = "C:/Program Files/Autodesk/Maya2020/bin/mayabatch.exe"
+MAYA_BATCH = os.environ.get("CACHE_MANAGER_MAYA_BATCH", "C:/Program Files/Autodesk/Maya2020/bin/mayabatch.exe")
 
 LOGGING_PATH = "W:/workspsace/cache_manager_logs/cache_manager_{f.STAMP}.log".format(f=__FormatterKeys)
 MAYA_LOG_PATH = "W:/workspsace/cache_manager_logs/{f.EPI}/{f.NAME}_maya_log.log".format(f=__FormatterKeys)
+MAYA_WORKER_LOG_PATH = "W:/workspsace/cache_manager_logs/workers/{f.NAME}_maya_log.log".format(f=__FormatterKeys)
 
 SUCCESS_CODE = "CACHE_JOB_IS_SUCCESSFUL_BY_CACHE_MANAGER"
 TRACEBACK_TRACKER = "~~~TRACE-TRACEBACK~~~"
+# maya output lines after which the process is stopped and the job failed right away
+FATAL_OUTPUT_MARKERS = ["Fatal Error. Attempting to save"]
+PROGRESS_TRACKER = "~~~CACHE-PROGRESS~~~"
+# maya output lines naming a cache written to scratch, what a crashed maya process left there is published or removed
+SCRATCH_TRACKER = "~~~CACHE-SCRATCH~~~"
+# seconds between progress updates of a job in the ui
+PROGRESS_UPDATE_INTERVAL = 1.0
 LOG_PATH_ENV = "CACHE_MANAGER_TOOL_LOG_PATH"
 
+# log files are written by a background thread in batches, the log drive is on the network
+ASYNC_LOGGING = True
+ASYNC_LOG_QUEUE_SIZE = 10000
+ASYNC_LOG_BATCH_SIZE = 200
+ASYNC_LOG_FLUSH_INTERVAL = 0.5
+# records written later than this many seconds after they were logged are counted as late
+ASYNC_LOG_LATE_THRESHOLD = 5.0
+
+# number of mayabatch processes run at once by the job runner
+JOB_POOL_SIZE = 4
+
+# parsed reference headers are kept on the local disk, set path to None to always parse the files
+REFERENCE_CACHE_PATH = os.path.join(os.path.expanduser("~"), "cache_manager", "reference_cache.db")
+REFERENCE_CACHE_MAX_ENTRIES = 50000
+
+# queued jobs, their status changes and run times are kept on the local disk, the queue is restored on start
+JOB_STORE_PATH = os.path.join(os.path.expanduser("~"), "cache_manager", "job_store.db")
+# "Clear History" removes transitions and timings older than this
+JOB_HISTORY_MAX_AGE_DAYS = 30
+
+# phase timings of every maya process, "python metrics.py report" prints p50/p95 per phase and the slowest phases
+METRICS_ENABLED = True
+METRICS_PATH = os.path.join(os.path.expanduser("~"), "cache_manager", "metrics.db")
+
+# cost model of the shortest job first scheduler, used until finished jobs calibrate seconds per reference frame
+SCHEDULER_LAUNCH_OVERHEAD = 60.0
+SCHEDULER_SECONDS_PER_MEGABYTE = 0.5
+SCHEDULER_SECONDS_PER_REFERENCE_FRAME = 0.05
+# frame count of files without playbackOptions
+SCHEDULER_DEFAULT_FRAME_COUNT = 100
+SCHEDULER_RATE_SAMPLES = 200
+
+# threads listing shot folders and parsing headers on the network share
+SCAN_WORKERS = 16
+
+# poll the episode folders for new versions, interval in seconds - keep it long on the network drive
+AUTO_RESCAN = False
+RESCAN_INTERVAL = 120
+
+# list superseded _v?? versions too, only the latest version of every shot file is listed and parsed by default
+SHOW_ALL_VERSIONS = False
+
+# reuse long lived mayabatch sessions between jobs instead of starting maya for every file. workers log to
+# MAYA_WORKER_LOG_PATH instead of the maya log of every file and idle sessions live until the cache manager exits
+USE_PERSISTENT_WORKERS = False
+WORKER_MAX_JOBS = 10
+WORKER_START_TIMEOUT = 300
+
+# sharded jobs split the references of one file across several maya processes
+SHARD_REFERENCES_PER_PROCESS = 15
+MAX_SHARDS = 4
+
+# export all references of a launch in one AbcExport call instead of evaluating the timeline per reference
+SINGLE_PASS_ALEMBIC = True
+
+# open shot files with every reference unloaded, then load only the cached references and the references they are
+# connected from, such like constraint targets. references matching the allow-list, by namespace or file path, are
+# always loaded, e.g. ["*vehicle*", "*/prop/*_ctrl_rig.ma"]. references saved unloaded stay unloaded as with a full open
+DEFERRED_REFERENCE_LOADING = False
+DEFERRED_REFERENCE_ALLOW_LIST = []
+
+# maya writes caches to a local scratch folder, publisher.py copies them to CACHE_OUTPUT with large sequential writes
+# and a checksum check, a job is done only once its caches are published
+USE_LOCAL_SCRATCH = True
+LOCAL_SCRATCH = os.environ.get("CACHE_MANAGER_LOCAL_SCRATCH", os.path.join(os.path.expanduser("~"), "cache_manager", "scratch"))
+# files written to the network share at the same time
+PUBLISH_WORKERS = 2
+PUBLISH_BUFFER_SIZE = 8 * 1024 * 1024
+PUBLISH_VERIFY_CHECKSUM = True
+PUBLISH_RETRIES = 2
+# scratch files left behind by crashed maya processes are removed after this
+SCRATCH_MAX_AGE_HOURS = 24
+
+# shared job queue polled by farm workers, keep it on a drive every worker machine can reach
+BROKER_PATH = os.environ.get("CACHE_MANAGER_BROKER_PATH", "W:/workspsace/cache_manager/job_broker.db")
+# seconds a leased job stays with its worker without a heartbeat before it is given to another worker
+BROKER_LEASE_TIMEOUT = 180
+BROKER_HEARTBEAT_INTERVAL = 30
+BROKER_POLL_INTERVAL = 5
+# leases a job may lose before it is failed
+BROKER_MAX_ATTEMPTS = 3
+
 # LOG_VIEWER = "explorer"
 LOG_VIEWER = "C:/Program Files (x86)/Google/Chrome/Application/chrome.exe"
@@ -1,15 +1,24 @@
 import os
-import file_parser
+import re
+import math
+import collections
+import reference_cache
+import cache_manifest
 import random
 import time
 import maya_launcher
 import app_logger
 import config
-import glob
+import scanner
+import threading
+import traceback
+from functools import partial, reduce
 from PySide2.QtCore import QObject, Signal
 
 LOGGER = app_logger.get_logger(__name__)
 
+VERSION_PATTERN = re.compile(r"^(?P<name>.+)_v(?P<version>\d+)\.ma$", re.IGNORECASE)
+
 
 class MayaFile(object):
 
@@ -20,13 +29,49 @@ class MayaFile(object):
         self.file_name = os.path.basename(self.file_path)
         self.shot = self.file_name.split("_")[2]
 
-        self.references = []
-        self._get_reference_info()
-        self.display = "{} | {} references".format(self.file_name, len(self.references))
+        match = VERSION_PATTERN.match(self.file_name)
+        self.name = match.group("name") if match else os.path.splitext(self.file_name)[0]
+        self.version = int(match.group("version")) if match else 0
+
+        self._references = None
+        self._lock = threading.Lock()
+
+    @property
+    def references(self):
+        """
+        references are parsed from the file header on first access only.
+
+        :rtype: list[Reference]
+        """
+        if self._references is None:
+            with self._lock:
+                if self._references is None:
+                    self._references = self._get_reference_info()
+
+        return self._references
+
+    @property
+    def is_loaded(self):
+        return self._references is not None
+
+    @property
+    def version_key(self):
+        """
+        versions of the same shot file share this key.
+        """
+        return self.episode, self.shot, self.name
+
+    @property
+    def display(self):
+        if not self.is_loaded:
+            return "{} | ... references".format(self.file_name)
+
+        return "{} | {} references".format(self.file_name, len(self.references))
 
     def _get_reference_info(self):
-        reference_data = file_parser.get_reference_info_from_file(self.file_path)
+        reference_data = reference_cache.get_reference_info(self.file_path)
 
+        references = []
         for reference in reference_data:
             instance = Reference(
                 self.project,
@@ -35,32 +80,58 @@ class MayaFile(object):
                 reference["namespace"],
                 reference["refnode"],
                 reference["path"],
+                self.file_path,
             )
-            self.references.append(instance)
+            references.append(instance)
 
-        self.references.append(Reference(self.project, self.episode, self.shot, "Camera", "Camera", ""))
+        references.append(Reference(self.project, self.episode, self.shot, "Camera", "Camera", "", self.file_path))
+        return references
 
 
 class Reference(object):
-    def __init__(self, project, episode, shot, ns, rn, path):
+    def __init__(self, project, episode, shot, ns, rn, path, maya_file_path=""):
         self.project = project
         self.episode = episode
         self.shot = shot
         self.namespace = ns
         self.reference_node = rn
         self.reference_path = path
+        self.maya_file_path = maya_file_path
         self.display = "{} | {}".format(self.reference_node, self.namespace)
 
-    def check_for_cache(self):
+    @property
+    def output_path(self):
+        """
+        cache path written by maya_operations for this reference.
+        """
+        if self.asset_type == "Camera":
+            asset_type, name = "Cam", "{}_{}.fbx".format(self.episode, self.shot)
+
+        else:
+            asset_type, name = self.asset_type, self.namespace + ".abc"
+
         formatter = {
             config.FormatterKeys.PROJ: self.project,
             config.FormatterKeys.EPI: self.episode,
             config.FormatterKeys.SHOT: self.shot,
-            config.FormatterKeys.ASSET_TYPE: self.asset_type,
-            config.FormatterKeys.NAME: self.namespace + ".abc",
+            config.FormatterKeys.ASSET_TYPE: asset_type,
+            config.FormatterKeys.NAME: name,
             config.FormatterKeys.STAMP: "",
         }
-        output_path = config.CACHE_OUTPUT.format(**formatter).replace("\\", "/")
+        return config.CACHE_OUTPUT.format(**formatter).replace("\\", "/")
+
+    @property
+    def input_paths(self):
+        """
+        files the cache is made from, the shot and the referenced asset.
+        """
+        return [path for path in [self.maya_file_path, self.reference_path] if path]
+
+    def check_for_cache(self):
+        """
+        True if the cache of this reference is up to date with the shot file and the referenced asset.
+        """
+        return cache_manifest.is_up_to_date(self.output_path, self.input_paths)
 
     @property
     def asset_type(self):
@@ -88,24 +159,44 @@ class Job(QObject):
     ALL_REFERENCE = "ALL"
     DONE = "done"
     IP = "ip"
+    # maya is done, the caches are still copied from the local scratch folder
+    PUBLISHING = "publishing"
     ERROR = "error"
     IN_QUEUE = "queue"
     SIGNAL = Signal(str)
+    PROGRESS_SIGNAL = Signal(float, float)
+    ESTIMATE_SIGNAL = Signal(float, float)
 
-    def __init__(self, project, epsoide, maya_file_instance, selected_reference):
+    def __init__(self, project, epsoide, maya_file_instance, selected_reference, force=False, sharded=False):
         super(Job, self).__init__()
         self.project = project
         self.epsoide = epsoide
         self.maya_file_instance = maya_file_instance  # type: MayaFile
         self.selected_reference = selected_reference  # type: list[Reference]
+        self.force = force
+        self.sharded = sharded
+        self.key = self.make_key(self.maya_file_instance.file_path, self.reference_to_cache)
         self.reference_to_cache_count = "All cacheable" if len(self.reference_to_cache) == len(self.maya_file_instance.references) else len(self.reference_to_cache)
         # self.status = random.choice([self.IN_QUEUE, self.IP, self.ERROR, self.DONE])
         self.status = self.IN_QUEUE
-
-        self.display_name = "{} | reference for cache: {}".format(self.maya_file_instance.file_name, self.reference_to_cache_count)
-        self.tool_tip = "status: {} | reference to cache: {}".format(self.status, ", ".join([
-            i.reference_node for i in self.reference_to_cache
-        ]))
+        self.progress = 0.0
+        self.eta = -1.0
+        # pinned jobs have a priority over 0 and run first
+        self.priority = 0
+        self.estimate = -1.0
+        self.queue_eta = -1.0
+        self.retry_references = None  # type: list[Reference]
+        self.failed_references = []  # type: list[Reference]
+        self.result = None  # type: maya_launcher.CacheResult
+
+        self.sent_references = []
+        self._progress_start = None
+        self._progress_emitted = 0.0
+
+        self.display_name = "{} | reference for cache: {}{}{}".format(self.maya_file_instance.file_name,
+                                                                      self.reference_to_cache_count,
+                                                                      " | force" if self.force else "",
+                                                                      " | sharded" if self.sharded else "")
 
     @property
     def reference_to_cache(self):
@@ -115,70 +206,787 @@ class Job(QObject):
         else:
             return [i for i in self.maya_file_instance.references if i.is_cacheable]
 
+    @property
+    def tool_tip(self):
+        tool_tip = "status: {} | reference to cache: {}".format(self.status, ", ".join([
+            i.reference_node for i in self.reference_to_cache
+        ]))
+        if self.failed_references:
+            tool_tip += "\nfailed: {}".format(", ".join([i.reference_node for i in self.failed_references]))
+
+        return tool_tip
+
+    def get_outdated_references(self):
+        """
+        references to cache whose cache is missing or older than its inputs, all of them if forced.
+        a re-queued job only looks at the references that failed last time.
+
+        :rtype: list[Reference]
+        """
+        references = self.reference_to_cache if self.retry_references is None else self.retry_references
+        if self.force:
+            return references
+
+        return [ref for ref in references if not ref.check_for_cache()]
+
+    def get_cache_arguments(self):
+        """
+        reference nodes and camera flag passed to maya_launcher.execute_cache_job,
+        references with an up to date cache are left out.
+
+        :rtype: (list[str], bool)
+        """
+        reference_to_cache = self.get_outdated_references()
+        self.sent_references = reference_to_cache
+        skipped = len(self.reference_to_cache) - len(reference_to_cache)
+        if skipped:
+            LOGGER.info("{}: skipping {} references with up to date cache".format(self.maya_file_instance.file_name, skipped))
+
+        reference_nodes = [i.reference_node for i in reference_to_cache if not i.asset_type == "Camera"]
+        is_camera_cache = any(ref.asset_type == "Camera" for ref in reference_to_cache)
+        return reference_nodes, is_camera_cache
+
+    def set_status(self, status):
+        if status == self.IP:
+            self.progress, self.eta = 0.0, -1.0
+            self._progress_start = None
+
+        self.status = status
+        self.SIGNAL.emit(self.status)
+
+    def update_progress(self, progress):
+        """
+        set export progress (0 - 1) and estimate remaining seconds from the time taken so far,
+        PROGRESS_SIGNAL(progress, eta) is throttled to config.PROGRESS_UPDATE_INTERVAL.
+        """
+        now = time.time()
+        if self._progress_start is None:
+            self._progress_start = now
+
+        self.progress = min(max(progress, 0.0), 1.0)
+        elapsed = now - self._progress_start
+        self.eta = elapsed * (1.0 - self.progress) / self.progress if self.progress > 0 and elapsed > 0 else -1.0
+
+        if self.progress >= 1.0 or now - self._progress_emitted >= config.PROGRESS_UPDATE_INTERVAL:
+            self._progress_emitted = now
+            self.PROGRESS_SIGNAL.emit(self.progress, self.eta)
+
+    def set_result(self, result, references=None):
+        """
+        DONE if every reference sent to maya was exported, ERROR with failed_references otherwise.
+        references are the ones sent to maya by this process if not given, such like results of a farm worker.
+
+        :type result: maya_launcher.CacheResult
+        :type references: list[Reference]
+        """
+        self.result = result
+        if references is None:
+            references = self.sent_references
+
+        failed_nodes = set(result.failed_references)
+        self.failed_references = [ref for ref in references
+                                  if get_result_key(ref) in failed_nodes
+                                  or (not result.success and get_result_key(ref) not in result.references)]
+
+        if self.failed_references:
+            LOGGER.warning("{}: {} of {} references failed".format(self.maya_file_instance.file_name,
+                                                                   len(self.failed_references),
+                                                                   len(self.sent_references)))
+            self.set_status(self.ERROR)
+
+        else:
+            self.retry_references = None
+            self.set_status(self.DONE)
+
+    def requeue(self):
+        """
+        put a failed job back in the queue, only its failed references are exported again.
+        """
+        if self.failed_references:
+            self.retry_references = self.failed_references
+            self.failed_references = []
+
+        self.set_status(self.IN_QUEUE)
+
+    def set_estimate(self, estimate, queue_eta):
+        """
+        estimated seconds of the launch running this job and seconds until it is done, see scheduler.Scheduler.
+        ESTIMATE_SIGNAL is only emitted when the shown whole seconds change.
+        """
+        is_changed = (int(estimate), int(queue_eta)) != (int(self.estimate), int(self.queue_eta))
+        self.estimate = estimate
+        self.queue_eta = queue_eta
+        if is_changed:
+            self.ESTIMATE_SIGNAL.emit(self.estimate, self.queue_eta)
+
     def execute(self):
         if self.status == self.IN_QUEUE:
-            self.status = self.IP
-            self.SIGNAL.emit(self.status)
-            reference_to_cache = [i.reference_node for i in self.reference_to_cache if not i.asset_type == "Camera"]
-            is_camera_cache = False
-            for ref in self.reference_to_cache:
-                if ref.asset_type == "Camera":
-                    is_camera_cache = True
-            status = maya_launcher.execute_cache_job(self.project,
-                                                     self.epsoide,
-                                                     self.maya_file_instance.file_path,
-                                                     reference_to_cache,
-                                                     is_camera_cache)
-            if status:
-                self.status = self.DONE
-
-            else:
-                self.status = self.ERROR
-            self.SIGNAL.emit(self.status)
+            JobGroup([self]).execute()
 
         else:
             LOGGER.warning("skipping {} status is {}".format(self, self.status))
 
+    @staticmethod
+    def make_key(maya_file_path, references):
+        """
+        canonical hashable identity of a job, maya file path plus the set of (reference node, reference path).
+
+        :rtype: tuple
+        """
+        return maya_file_path, frozenset((ref.reference_node, ref.reference_path) for ref in references)
+
     def __eq__(self, other):
-        is_reference_to_cache_match = self.reference_to_cache_count == other.reference_to_cache_count
-        if is_reference_to_cache_match:
-            for ref in self.reference_to_cache:  # type: Reference
-                match_found = False
-                for otherRef in other.reference_to_cache:  # type: Reference
-                    if all([ref.reference_path == otherRef.reference_path,
-                            ref.reference_node == otherRef.reference_node]):
-                        match_found = True
-                if not match_found:
-                    is_reference_to_cache_match = False
-                    break
-
-        return all([
-            self.maya_file_instance.file_name == other.maya_file_instance.file_name,
-            is_reference_to_cache_match,
-        ])
+        return isinstance(other, Job) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
 
     def __repr__(self):
         return "Job(file={}, reference_nodes={})".format(self.maya_file_instance.file_name, self.reference_to_cache)
 
 
-def get_maya_files(project, episode):
+class JobQueue(object):
+    """
+    Jobs in insertion order with an index on Job.key,
+    duplicate checks, lookup and removal are constant time.
+    """
+
+    def __init__(self, jobs=None):
+        self._jobs = collections.OrderedDict()
+        for job in jobs or []:
+            self.add(job)
+
+    def add(self, job):
+        """
+        :return: False if an equal job is already queued
+        :rtype: bool
+        """
+        if job.key in self._jobs:
+            return False
+
+        self._jobs[job.key] = job
+        return True
+
+    def remove(self, job):
+        return self._jobs.pop(job.key, None)
+
+    def get(self, key):
+        """
+        :rtype: Job
+        """
+        return self._jobs.get(key)
+
+    def __contains__(self, job):
+        return job.key in self._jobs
+
+    def __iter__(self):
+        return iter(list(self._jobs.values()))
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+class JobGroup(object):
+    """
+    Pending jobs targeting the same maya file, dispatched as one execute_cache_job call
+    with the union of their reference nodes and camera flag.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs  # type: list[Job]
+        self._shard_progress = [0.0]
+
+        self._on_published = None
+        self._published = []
+        self._is_exported = False
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self):
+        return self.jobs[0].maya_file_instance.file_path
+
+    def get_cache_arguments(self):
+        reference_nodes = []
+        is_camera_cache = False
+        for job in self.jobs:
+            job_reference_nodes, job_camera_cache = job.get_cache_arguments()
+            reference_nodes.extend([node for node in job_reference_nodes if node not in reference_nodes])
+            is_camera_cache = is_camera_cache or job_camera_cache
+
+        return reference_nodes, is_camera_cache
+
+    def execute(self, slots=None, on_published=None):
+        """
+        :param slots: maya processes the launch may use, it holds one of them and its shards borrow the free ones.
+                      without slots a sharded launch runs up to config.MAX_SHARDS processes.
+        :type slots: ProcessSlots
+        :param on_published: without it the call returns once the caches are published. with it the call returns once
+                             maya is done, the jobs are PUBLISHING until the caches are published, then their results
+                             are set and on_published(group) is called from a publisher thread.
+        """
+        reference_nodes, is_camera_cache = self.get_cache_arguments()
+        if not reference_nodes and not is_camera_cache:
+            LOGGER.info("cache of {} is up to date, nothing to export".format(self.file_path))
+            for each_job in self.jobs:
+                each_job.set_status(Job.DONE)
+            if on_published:
+                on_published(self)
+            return
+
+        if len(self.jobs) > 1:
+            LOGGER.info("coalesced {} jobs for {} into one launch".format(len(self.jobs), self.file_path))
+
+        for each_job in self.jobs:
+            each_job.set_status(Job.IP)
+
+        shard_count = 1
+        if any(each_job.sharded for each_job in self.jobs):
+            shard_count = get_shard_count(len(reference_nodes))
+
+        borrowed = 0
+        if shard_count > 1 and slots is not None:
+            borrowed = slots.borrow(shard_count - 1)
+            if borrowed < shard_count - 1:
+                LOGGER.info("{} free process slots, {} shards for {} instead of {}".format(
+                    borrowed, borrowed + 1, self.file_path, shard_count))
+            shard_count = borrowed + 1
+
+        self._on_published = on_published
+        self._published = [None] * shard_count
+        self._is_exported = False
+        try:
+            result = self._execute_shards(split_into_shards(reference_nodes, shard_count), is_camera_cache)
+        finally:
+            if borrowed:
+                slots.release(borrowed)
+
+        if not on_published:
+            for each_job in self.jobs:
+                each_job.set_result(result)
+            return
+
+        with self._lock:
+            self._is_exported = True
+            if None in self._published:
+                for each_job in self.jobs:
+                    each_job.set_status(Job.PUBLISHING)
+                return
+
+        self._finish_publishing()
+
+    def _on_shard_published(self, shard_index, result):
+        with self._lock:
+            self._published[shard_index] = result
+            if not self._is_exported or None in self._published:
+                return
+
+        self._finish_publishing()
+
+    def _finish_publishing(self):
+        """
+        set the published results once maya is done and every shard is published, whichever comes last.
+        """
+        result = reduce(lambda first, second: first.merge(second), self._published)
+        for each_job in self.jobs:
+            each_job.set_result(result)
+        self._on_published(self)
+
+    def _execute_shards(self, shards, is_camera_cache):
+        """
+        :rtype: maya_launcher.CacheResult
+        """
+        if len(shards) > 1:
+            LOGGER.info("splitting {} references of {} into {} shards".format(sum(len(shard) for shard in shards),
+                                                                             self.file_path, len(shards)))
+            results = [None] * len(shards)
+            self._shard_progress = [0.0] * len(shards)
+            threads = []
+            for index, shard in enumerate(shards):
+                # only the first shard exports the camera
+                thread = threading.Thread(target=self._launch_shard,
+                                          args=(results, index, shard, is_camera_cache and index == 0))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+
+            return reduce(lambda first, second: first.merge(second), results)
+
+        self._shard_progress = [0.0]
+        return self._launch(shards[0], is_camera_cache)
+
+    def _launch(self, reference_nodes, is_camera_cache, log_suffix="", shard_index=0):
+        """
+        :rtype: maya_launcher.CacheResult
+        """
+        job = self.jobs[0]
+        on_published = partial(self._on_shard_published, shard_index) if self._on_published else None
+        try:
+            return maya_launcher.execute_cache_job(job.project,
+                                                   job.epsoide,
+                                                   self.file_path,
+                                                   reference_nodes,
+                                                   is_camera_cache,
+                                                   log_suffix,
+                                                   partial(self._on_progress, shard_index),
+                                                   on_published)
+        except Exception:
+            LOGGER.critical("Traceback:\n{}".format(traceback.format_exc()))
+            result = maya_launcher.CacheResult.failed(reference_nodes, is_camera_cache, "unable to launch maya")
+            if on_published:
+                on_published(result)
+            return result
+
+    def _launch_shard(self, results, index, reference_nodes, is_camera_cache):
+        results[index] = self._launch(reference_nodes, is_camera_cache, "_shard{}".format(index + 1), index)
+
+    def _on_progress(self, shard_index, event):
+        """
+        frame progress event of one maya process, the jobs get the average progress of all shards.
+        """
+        if not event.get("total"):
+            return
+
+        self._shard_progress[shard_index] = float(event["done"]) / event["total"]
+        progress = sum(self._shard_progress) / len(self._shard_progress)
+        for job in self.jobs:
+            job.update_progress(progress)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __repr__(self):
+        return "JobGroup(file={}, jobs={})".format(os.path.basename(self.file_path), len(self.jobs))
+
+
+def get_result_key(reference):
+    """
+    key of given reference in maya_launcher.CacheResult.references, the camera is reported as "Camera".
+    """
+    return "Camera" if reference.asset_type == "Camera" else reference.reference_node
+
+
+def get_shard_count(reference_count):
+    """
+    number of maya processes to split a file with given reference count into.
+    """
+    shard_count = int(math.ceil(float(reference_count) / config.SHARD_REFERENCES_PER_PROCESS))
+    return max(1, min(config.MAX_SHARDS, shard_count))
+
+
+def split_into_shards(reference_nodes, shard_count):
+    """
+    deal reference nodes round robin into shard_count groups, so characters and props are spread evenly.
+
+    :rtype: list[list[str]]
+    """
+    shards = [reference_nodes[index::shard_count] for index in range(shard_count)]
+    return [shard for shard in shards if shard] or [[]]
+
+
+def coalesce_jobs(jobs):
+    """
+    group queued jobs by maya file path, keeping the order in which each file first appears.
+
+    :param jobs:
+    :type jobs: list[Job]
+    :rtype: list[JobGroup]
+    """
+    groups = {}
+    ordered_groups = []
+    for job in jobs:
+        if job.status != Job.IN_QUEUE:
+            continue
+
+        file_path = job.maya_file_instance.file_path
+        if file_path not in groups:
+            groups[file_path] = JobGroup([])
+            ordered_groups.append(groups[file_path])
+
+        groups[file_path].jobs.append(job)
+
+    return ordered_groups
+
+
+class ProcessSlots(object):
+    """
+    Number of maya processes allowed to run at once. every launch holds a slot while it runs,
+    the shards of a launch borrow slots which are free at that moment instead of waiting for them.
+    """
+
+    def __init__(self, size):
+        self.free = max(1, int(size))
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.free < 1:
+                self._condition.wait()
+            self.free -= 1
+
+    def borrow(self, count):
+        """
+        take up to count free slots without waiting.
+
+        :return: number of slots taken
+        :rtype: int
+        """
+        with self._condition:
+            taken = max(0, min(count, self.free))
+            self.free -= taken
+            return taken
+
+    def release(self, count=1):
+        with self._condition:
+            self.free += count
+            self._condition.notify_all()
+
+
+class JobPool(object):
+    """
+    Runs queued jobs on a fixed number of worker threads, each job blocking on its own mayabatch process.
+    size limits the maya processes, shards of a sharded launch only use the slots other launches leave free.
+    on_count_change(running, waiting) is called whenever the queue counts move.
+    with a scheduler.Scheduler launches run shortest first and on_eta_change(seconds) receives the queue ETA,
+    recalibrated when a launch starts or finishes, at most once per config.PROGRESS_UPDATE_INTERVAL.
+    a launch frees its slot once maya is done, its caches are published in the background.
+    """
+
+    def __init__(self, size=config.JOB_POOL_SIZE, on_count_change=None, scheduler=None, on_eta_change=None):
+        self.size = max(1, int(size))
+        self.on_count_change = on_count_change
+        self.scheduler = scheduler
+        self.on_eta_change = on_eta_change
+        self.running = 0
+        self.waiting = 0
+
+        self.slots = ProcessSlots(self.size)
+
+        self._pending = []
+        self._started = {}
+        self._publishing = set()
+        # launches maya is done with, waiting for their caches before the scheduler records them
+        self._durations = {}
+        self._lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+        self._etas_updated = 0.0
+        self._eta_timer = None
+
+    def run(self, jobs):
+        """
+        execute given jobs and block until all of them are finished and published.
+        queued jobs of the same maya file are coalesced into one launch.
+
+        :param jobs:
+        :type jobs: list[Job]
+        """
+        groups = coalesce_jobs(jobs)
+        if self.scheduler:
+            self.scheduler.pool_size = self.size
+            groups = self.scheduler.order(groups)
+
+        with self._lock:
+            self._pending.extend(groups)
+            self.waiting += sum(len(group) for group in groups)
+        self._report()
+
+        workers = [threading.Thread(target=self._work) for _ in range(min(self.size, len(groups)))]
+        LOGGER.info("running {} launches on {} workers".format(len(groups), len(workers)))
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        with self._published:
+            while self._publishing:
+                self._published.wait()
+
+    def _work(self):
+        while True:
+            self.slots.acquire()
+            with self._lock:
+                if not self._pending:
+                    self.slots.release()
+                    return
+
+                group = self._pending.pop(0)
+                self._started[group] = time.time()
+                self.waiting -= len(group)
+                self.running += len(group)
+                self._publishing.add(group)
+            self._report()
+
+            try:
+                group.execute(self.slots, self._on_published)
+            except Exception:
+                self._on_published(group)
+                raise
+            finally:
+                self.slots.release()
+                with self._lock:
+                    # the launch is timed until maya returns, it is recorded once its results are set
+                    duration = time.time() - self._started.pop(group)
+                    self.running -= len(group)
+                    is_published = group not in self._publishing
+                    if not is_published:
+                        self._durations[group] = duration
+
+                if is_published:
+                    self._record(group, duration)
+                self._report()
+
+    def _on_published(self, group):
+        with self._published:
+            self._publishing.discard(group)
+            duration = self._durations.pop(group, None)
+            self._published.notify_all()
+
+        if duration is not None:
+            self._record(group, duration)
+
+    def _record(self, group, duration):
+        if self.scheduler:
+            self.scheduler.record(group, duration)
+
+    def _report(self):
+        if self.on_count_change:
+            self.on_count_change(self.running, self.waiting)
+
+        if self.scheduler:
+            with self._lock:
+                if self._eta_timer is not None:
+                    return
+
+                # launches starting and finishing together are folded into one update, which runs later
+                wait = self._etas_updated + config.PROGRESS_UPDATE_INTERVAL - time.time()
+                if wait > 0:
+                    self._eta_timer = threading.Timer(wait, self._update_etas)
+                    self._eta_timer.daemon = True
+                    self._eta_timer.start()
+                    return
+
+            self._update_etas()
+
+    def _update_etas(self):
+        with self._lock:
+            self._eta_timer = None
+            self._etas_updated = time.time()
+            pending = list(self._pending)
+            started = dict(self._started)
+
+        queue_eta = self.scheduler.update_etas(pending, started)
+        if self.on_eta_change:
+            self.on_eta_change(queue_eta)
+
+
+def get_maya_files(project, episode, workers=config.SCAN_WORKERS, all_versions=False):
     """
 
     :param project:
     :type project: str
     :param episode:
     :type episode: str
+    :param all_versions: include superseded versions, only the latest one of every shot file by default
+    :type all_versions: bool
     :return:
     :rtype: list[MayaFile]
     """
-    formatter = {
-        config.FormatterKeys.PROJ: project,
-        config.FormatterKeys.EPI: episode,
-    }
+    return Episode(project, episode, workers).scan(all_versions)
+
+
+class Episode(object):
+    """
+    Maya files of one episode, kept in sync with the shot folders by incremental rescans.
+    a rescan lists again only the shot folders whose modification time changed since the last one.
+    """
+
+    def __init__(self, project, episode, workers=config.SCAN_WORKERS):
+        self.project = project
+        self.episode = episode
+        self.workers = workers
+        self.root = config.SOURCE_MAYA_ROOT.format(**{
+            config.FormatterKeys.PROJ: project,
+            config.FormatterKeys.EPI: episode,
+        })
+
+        self.maya_files = {}  # type: dict[str, MayaFile]
+        self._snapshot = {}  # shot folder: (folder mtime, {file path: (mtime, size)})
+        self._lock = threading.Lock()
+        # one refresh lists the folders at a time, _lock is only held to read and swap in the state
+        self._refresh_lock = threading.Lock()
+
+    def get_maya_files(self, all_versions=False):
+        """
+        latest version of every shot file, or all of them.
+
+        :rtype: list[MayaFile]
+        """
+        if all_versions:
+            with self._lock:
+                maya_files = list(self.maya_files.values())
+
+        else:
+            maya_files = [versions[0] for versions in self.get_version_index().values()]
+
+        return sorted(maya_files, key=lambda maya_file: maya_file.file_path)
+
+    def get_version_index(self):
+        """
+        maya files grouped by episode, shot and name, newest version first.
+
+        :rtype: dict[tuple, list[MayaFile]]
+        """
+        with self._lock:
+            maya_files = list(self.maya_files.values())
+
+        index = {}
+        for maya_file in maya_files:
+            index.setdefault(maya_file.version_key, []).append(maya_file)
+
+        for versions in index.values():
+            versions.sort(key=lambda maya_file: maya_file.version, reverse=True)
+
+        return index
+
+    def get_versions(self, maya_file):
+        """
+        all versions of given maya file, newest first.
+
+        :rtype: list[MayaFile]
+        """
+        return self.get_version_index().get(maya_file.version_key, [maya_file])
+
+    def scan(self, all_versions=False):
+        """
+        full scan of the episode.
+
+        :rtype: list[MayaFile]
+        """
+        with self._lock:
+            self.maya_files = {}
+            self._snapshot = {}
+
+        self.refresh(deep=True)
+        return self.get_maya_files(all_versions)
+
+    def refresh(self, deep=False):
+        """
+        bring maya files in sync with the episode folders.
+        new versions and deleted files change the folder mtime, a file saved over in place
+        only does so on some file servers - use deep to list every folder again.
+
+        :return: added, removed and updated maya files
+        :rtype: (list[MayaFile], list[MayaFile], list[MayaFile])
+        """
+        added, removed, updated = [], [], []
+        if not os.path.isdir(self.root):
+            LOGGER.warning("episode folder not found: {}".format(self.root))
+            return added, removed, updated
+
+        start = time.time()
+        with self._refresh_lock:
+            with self._lock:
+                folder_mtimes = dict((shot_dir, snapshot[0]) for shot_dir, snapshot in self._snapshot.items())
+
+            shot_dirs = dict((entry.path, entry.stat().st_mtime) for entry in scanner.iter_dir(self.root) if entry.is_dir())
+            changed_dirs = [shot_dir for shot_dir, mtime in shot_dirs.items()
+                            if deep or folder_mtimes.get(shot_dir) != mtime]
+            listings = list(scanner.parallel_imap(self._list_shot_dir, changed_dirs, self.workers))
+
+            with self._lock:
+                self._apply_listings(shot_dirs, listings, added, removed, updated)
+
+        LOGGER.info("rescanned {} of {} shot folders of {} in {:.2f} seconds, added: {}, removed: {}, updated: {}".format(
+            len(changed_dirs), len(shot_dirs), self.episode, time.time() - start, len(added), len(removed), len(updated)
+        ))
+        return added, removed, updated
+
+    def _apply_listings(self, shot_dirs, listings, added, removed, updated):
+        """
+        swap the listed shot folders into maya files and the snapshot, called with _lock held.
+        """
+        for shot_dir in [shot_dir for shot_dir in self._snapshot if shot_dir not in shot_dirs]:
+            for file_path in self._snapshot.pop(shot_dir)[1]:
+                removed.append(self.maya_files.pop(file_path))
+
+        for shot_dir, files in listings:
+            old_files = self._snapshot[shot_dir][1] if shot_dir in self._snapshot else {}
+            for file_path, stat in files.items():
+                if file_path not in old_files:
+                    self.maya_files[file_path] = MayaFile(self.project, self.episode, file_path)
+                    added.append(self.maya_files[file_path])
+
+                elif old_files[file_path] != stat:
+                    self.maya_files[file_path] = MayaFile(self.project, self.episode, file_path)
+                    updated.append(self.maya_files[file_path])
+
+            for file_path in old_files:
+                if file_path not in files:
+                    removed.append(self.maya_files.pop(file_path))
+
+            self._snapshot[shot_dir] = (shot_dirs[shot_dir], files)
+
+    def _list_shot_dir(self, shot_dir):
+        return shot_dir, scanner.stat_matching_files(shot_dir, config.SOURCE_MAYA_FILE_PATTERN)
+
+
+class ReferencePrefetcher(threading.Thread):
+    """
+    Parses references of given maya files in background, on_loaded(maya_file) is called for each loaded file
+    and on_finished() once all of them are done, unless cancelled.
+    """
 
-    pattern = config.SOURCE_MAYA_FILES.format(**formatter)
-    maya_files = glob.glob(pattern) or []
-    return [MayaFile(project, episode, f) for f in maya_files]
+    def __init__(self, maya_files, on_loaded=None, workers=config.SCAN_WORKERS, on_finished=None):
+        super(ReferencePrefetcher, self).__init__()
+        self.daemon = True
+        self.maya_files = maya_files  # type: list[MayaFile]
+        self.on_loaded = on_loaded
+        self.on_finished = on_finished
+        self.workers = workers
+
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _load(self, maya_file):
+        if self._cancelled.is_set():
+            return None
+
+        try:
+            maya_file.references
+        except Exception as err:
+            LOGGER.critical("unable to read references of {}: {}".format(maya_file.file_path, err))
+            return None
+
+        return maya_file
+
+    def run(self):
+        start = time.time()
+        count = 0
+        for maya_file in scanner.parallel_imap(self._load, self.maya_files, self.workers):
+            if maya_file is None:
+                continue
+
+            count += 1
+            if self.on_loaded and not self._cancelled.is_set():
+                self.on_loaded(maya_file)
+
+        LOGGER.info("prefetched references of {} maya files in {:.2f} seconds{}".format(
+            count, time.time() - start, " (cancelled)" if self._cancelled.is_set() else ""
+        ))
+        if config.REFERENCE_CACHE_PATH:
+            reference_cache.REFERENCE_CACHE.log_stats()
+
+        if self.on_finished and not self._cancelled.is_set():
+            self.on_finished()
 
 
 def get_project_list():
@@ -2,18 +2,131 @@ import re
 import config
 
 
+# bytes read from the network share per request, the header is only a small part of the file.
+CHUNK_SIZE = 65536
+
+# first statements after the reference header, nothing after them is read.
+HEADER_END_COMMANDS = ("requires", "createNode")
+
+# bytes read from the end of the file for the playbackOptions of the scene configuration script node.
+TAIL_SIZE = 262144
+
+PLAYBACK_OPTIONS_PATTERN = re.compile(r"playbackOptions[^;]*?-ast\s+(-?[\d.]+)[^;]*?-aet\s+(-?[\d.]+)")
+
+# strings, comments and statement terminators - every alternative starts with a different
+# character so a line is tokenized in a single pass without backtracking.
+TOKEN_PATTERN = re.compile(r'"(?:[^"\\\n]|\\.)*"|//[^\n]*|;|[^\s";]+|\S')
+
+
 def get_reference_info_from_file(maya_file_path):
-    ref_pattern = re.compile(r'file -rd.+-ns "(?P<namespace>.+)"(.+|.+\n\s.+)-rfn(.+|.+\n\s.+)"(?P<refnode>.+)"(.+|.+\n\s.+)-typ(.+|.+\n\s.+)"(?P<path>{}.+)"'.format(config.REFERENCE_DRIVE))
+    """
+    reference namespace, reference node, path and saved load state of every "file -rd*" command in the .ma header.
 
-    file_upper_chunk = open_file(maya_file_path)
+    :param maya_file_path:
+    :type maya_file_path: str
+    :return:
+    :rtype: list[dict]
+    """
     references = []
-    for match in ref_pattern.finditer(file_upper_chunk):
-        references.append(match.groupdict())
+    with open(maya_file_path, "r", CHUNK_SIZE) as fr:
+        for statement in iter_header_statements(fr):
+            if statement[0] != "file":
+                continue
+
+            reference = parse_file_command(statement)
+            if reference:
+                references.append(reference)
 
     return references
 
 
-def open_file(file_path):
-    with open(file_path, "r") as fr:
-        return fr.read(10000)
+def iter_header_statements(lines):
+    """
+    yield header statements as token lists, statements can spread over multiple lines.
+    stops at the first requires or createNode statement.
+
+    :param lines: iterable of .ma lines, such like an open file
+    :rtype: list[str]
+    """
+    statement = []
+    for line in lines:
+        for token in TOKEN_PATTERN.findall(line):
+            if token.startswith("//"):
+                continue
+
+            if token != ";":
+                if not statement and token in HEADER_END_COMMANDS:
+                    return
+
+                statement.append(token)
+
+            elif statement:
+                yield statement
+                statement = []
+
+
+def parse_file_command(tokens):
+    """
+    reference data from a tokenized file command, None if it is not a reference declaration.
+
+    :param tokens:
+    :type tokens: list[str]
+    :rtype: dict
+    """
+    flags = {}
+    is_reference = False
+    path = None
+
+    index = 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token.startswith("-") and not token.startswith('"'):
+            if token.startswith("-rd"):
+                is_reference = True
+
+            if index + 1 < len(tokens) and not tokens[index + 1].startswith("-"):
+                flags[token] = tokens[index + 1]
+                index += 1
+
+        else:
+            path = token
+
+        index += 1
+
+    if not is_reference or not path:
+        return None
+
+    namespace = flags.get("-ns")
+    refnode = flags.get("-rfn")
+    path = path.strip('"')
+    if not namespace or not refnode or "-typ" not in flags or not path.startswith(config.REFERENCE_DRIVE):
+        return None
+
+    return {
+        "namespace": namespace.strip('"'),
+        "refnode": refnode.strip('"'),
+        "path": path,
+        # -dr 1 marks a reference saved unloaded
+        "loaded": flags.get("-dr") != "1",
+    }
+
+
+def get_frame_range_from_file(maya_file_path):
+    """
+    animation start and end frame of the playbackOptions saved at the end of the .ma file, None if not found.
+
+    :param maya_file_path:
+    :type maya_file_path: str
+    :rtype: (float, float)
+    """
+    with open(maya_file_path, "rb") as fr:
+        fr.seek(0, 2)
+        fr.seek(max(0, fr.tell() - TAIL_SIZE))
+        tail = fr.read().decode("utf-8", "replace")
+
+    matches = PLAYBACK_OPTIONS_PATTERN.findall(tail)
+    if not matches:
+        return None
 
+    start_frame, end_frame = matches[-1]
+    return float(start_frame), float(end_frame)
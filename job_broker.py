@@ -0,0 +1,396 @@
+"""
+shared job queue for cache jobs run on several machines.
+
+the queue is a sqlite database on a shared drive. the ui or batch.py submits jobs, any number of workers lease them:
+
+    mayapy job_broker.py worker --jobs 2
+    mayapy job_broker.py status
+
+a worker sends heartbeats while its job runs, a job whose lease expires is handed to the next worker.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import datetime
+import threading
+import config
+if config.LOG_PATH_ENV not in os.environ:
+    os.environ[config.LOG_PATH_ENV] = config.LOGGING_PATH.format(**{
+        config.FormatterKeys.STAMP: "worker_{}".format(datetime.datetime.now().strftime("%Y_%m_%d__%H_%M_%S"))
+    })
+import core
+import app_logger
+import utils
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+QUEUED = core.Job.IN_QUEUE
+LEASED = core.Job.IP
+DONE = core.Job.DONE
+ERROR = core.Job.ERROR
+
+COLUMNS = ["id", "job_key", "project", "episode", "maya_file_path", "reference_nodes", "force", "sharded", "status",
+           "worker", "lease_expires", "attempts", "progress", "submitted", "started", "finished", "result"]
+
+
+class Broker(object):
+    """
+    Jobs table in a sqlite database shared by the submitting ui and the workers.
+    every state change runs in its own immediate transaction, so a job is leased by one worker only.
+    """
+
+    def __init__(self, path=config.BROKER_PATH, lease_timeout=config.BROKER_LEASE_TIMEOUT,
+                 max_attempts=config.BROKER_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            # the database is reached over the network, write-ahead logging does not work there
+            self._connection = utils.connect_sqlite(self.path, journal_mode="DELETE")
+            self._connection.isolation_level = None
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_key TEXT, project TEXT, episode TEXT, maya_file_path TEXT, "
+                "reference_nodes TEXT, force INTEGER, sharded INTEGER, status TEXT, worker TEXT, lease_expires REAL, "
+                "attempts INTEGER, progress REAL, submitted REAL, started REAL, finished REAL, result TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+        return self._connection
+
+    def _transaction(self, function, *args):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                value = function(connection, *args)
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+            return value
+
+    def submit(self, job):
+        """
+        queue given job, returns the id of the queued or running job with the same key if there is one.
+
+        :type job: core.Job
+        :rtype: int
+        """
+        job_key = make_job_key(job)
+        if job.selected_reference == core.Job.ALL_REFERENCE and job.retry_references is None:
+            reference_nodes = None
+        else:
+            references = job.reference_to_cache if job.retry_references is None else job.retry_references
+            reference_nodes = [ref.reference_node for ref in references]
+
+        def insert(connection):
+            row = connection.execute("SELECT id FROM jobs WHERE job_key=? AND status IN (?, ?)",
+                                     (job_key, QUEUED, LEASED)).fetchone()
+            if row:
+                return row[0]
+
+            cursor = connection.execute(
+                "INSERT INTO jobs (job_key, project, episode, maya_file_path, reference_nodes, force, sharded, status, "
+                "attempts, progress, submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0, ?)",
+                (job_key, job.project, job.epsoide, job.maya_file_instance.file_path, json.dumps(reference_nodes),
+                 int(job.force), int(job.sharded), QUEUED, time.time())
+            )
+            return cursor.lastrowid
+
+        return self._transaction(insert)
+
+    def lease(self, worker):
+        """
+        oldest queued job for given worker, None if the queue is empty.
+
+        :rtype: dict
+        """
+        def take(connection):
+            self._requeue_expired(connection)
+            row = connection.execute("SELECT * FROM jobs WHERE status=? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+            if not row:
+                return None
+
+            now = time.time()
+            connection.execute("UPDATE jobs SET status=?, worker=?, lease_expires=?, attempts=attempts+1, progress=0, "
+                               "started=? WHERE id=?", (LEASED, worker, now + self.lease_timeout, now, row[0]))
+            job = dict(zip(COLUMNS, row), status=LEASED, worker=worker, attempts=row[COLUMNS.index("attempts")] + 1)
+            job["reference_nodes"] = json.loads(job["reference_nodes"])
+            return job
+
+        return self._transaction(take)
+
+    def heartbeat(self, job_id, worker, progress=0.0):
+        """
+        extend the lease of a running job, False if the lease was lost to another worker.
+
+        :rtype: bool
+        """
+        def extend(connection):
+            cursor = connection.execute("UPDATE jobs SET lease_expires=?, progress=? WHERE id=? AND worker=? AND status=?",
+                                        (time.time() + self.lease_timeout, progress, job_id, worker, LEASED))
+            return cursor.rowcount == 1
+
+        return self._transaction(extend)
+
+    def complete(self, job_id, worker, status, result=None):
+        """
+        store the outcome of a leased job, ignored if the lease was lost in the meantime.
+
+        :rtype: bool
+        """
+        def finish(connection):
+            cursor = connection.execute("UPDATE jobs SET status=?, progress=?, finished=?, result=? "
+                                        "WHERE id=? AND worker=? AND status=?",
+                                        (status, 1.0 if status == DONE else 0.0, time.time(), json.dumps(result),
+                                         job_id, worker, LEASED))
+            return cursor.rowcount == 1
+
+        return self._transaction(finish)
+
+    def _requeue_expired(self, connection):
+        now = time.time()
+        expired = connection.execute("SELECT id, worker, attempts FROM jobs WHERE status=? AND lease_expires<?",
+                                     (LEASED, now)).fetchall()
+        for job_id, worker, attempts in expired:
+            if attempts >= self.max_attempts:
+                LOGGER.warning("job {} lost its lease {} times, last worker: {}, failing it".format(job_id, attempts, worker))
+                connection.execute("UPDATE jobs SET status=?, finished=?, result=? WHERE id=?",
+                                   (ERROR, now, json.dumps({"success": False, "error": "lease expired", "references": {}}),
+                                    job_id))
+            else:
+                LOGGER.warning("lease of job {} on {} expired, queueing it again".format(job_id, worker))
+                connection.execute("UPDATE jobs SET status=?, worker=NULL, lease_expires=NULL WHERE id=?", (QUEUED, job_id))
+
+        return len(expired)
+
+    def requeue_expired(self):
+        return self._transaction(self._requeue_expired)
+
+    def get_status(self, job_ids=None):
+        """
+        {job id: row} of given jobs or every job.
+
+        :rtype: dict
+        """
+        with self._lock:
+            connection = self._connect()
+            if job_ids is None:
+                rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            else:
+                job_ids = list(job_ids)
+                rows = []
+                # sqlite allows 999 variables per statement
+                for index in range(0, len(job_ids), 500):
+                    chunk = job_ids[index:index + 500]
+                    rows.extend(connection.execute("SELECT * FROM jobs WHERE id IN ({})".format(
+                        ", ".join("?" * len(chunk))), chunk).fetchall())
+
+        jobs = {}
+        for row in rows:
+            job = dict(zip(COLUMNS, row))
+            job["reference_nodes"] = json.loads(job["reference_nodes"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            jobs[job["id"]] = job
+
+        return jobs
+
+    def clear_finished(self):
+        return self._transaction(
+            lambda connection: connection.execute("DELETE FROM jobs WHERE status IN (?, ?)", (DONE, ERROR)).rowcount
+        )
+
+
+def make_job_key(job):
+    """
+    :type job: core.Job
+    :rtype: str
+    """
+    file_path, references = job.key
+    return json.dumps([file_path, sorted(references), bool(job.force)])
+
+
+def create_job(leased):
+    """
+    core.Job of a leased broker row, the maya file header is parsed again on the worker.
+
+    :type leased: dict
+    :rtype: core.Job
+    """
+    maya_file = core.MayaFile(leased["project"], leased["episode"], leased["maya_file_path"])
+    if leased["reference_nodes"] is None:
+        selected_reference = core.Job.ALL_REFERENCE
+    else:
+        selected_reference = [ref for ref in maya_file.references if ref.reference_node in leased["reference_nodes"]]
+
+    return core.Job(leased["project"], leased["episode"], maya_file, selected_reference,
+                    bool(leased["force"]), bool(leased["sharded"]))
+
+
+class BrokerWorker(threading.Thread):
+    """
+    Leases jobs from the broker one after another and runs them with core.JobGroup,
+    a heartbeat thread keeps the lease alive and reports progress while maya runs.
+    workers of one machine share their core.ProcessSlots, so shards only use the slots of idle workers.
+    """
+
+    def __init__(self, broker, name, poll_interval=config.BROKER_POLL_INTERVAL, once=False, slots=None):
+        super(BrokerWorker, self).__init__(name=name)
+        self.broker = broker
+        self.slots = slots or core.ProcessSlots(1)
+        self.poll_interval = poll_interval
+        self.once = once
+        self.jobs_done = 0
+
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        LOGGER.info("{} polling {}".format(self.name, self.broker.path))
+        while not self._stop_event.is_set():
+            # a lease is only taken once a process slot is free, so it does not expire while waiting
+            self.slots.acquire()
+            try:
+                try:
+                    leased = self.broker.lease(self.name)
+                except sqlite3.Error as err:
+                    LOGGER.warning("{}: broker unavailable: {}".format(self.name, err))
+                    leased = None
+
+                if leased is not None:
+                    self.run_job(leased)
+                    self.jobs_done += 1
+            finally:
+                self.slots.release()
+
+            if leased is None:
+                if self.once:
+                    break
+
+                self._stop_event.wait(self.poll_interval)
+
+        LOGGER.info("{} stopped after {} jobs".format(self.name, self.jobs_done))
+
+    def run_job(self, leased):
+        LOGGER.info("{} leased job {}: {}".format(self.name, leased["id"], leased["maya_file_path"]))
+        job = None
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(config.BROKER_HEARTBEAT_INTERVAL):
+                try:
+                    if not self.broker.heartbeat(leased["id"], self.name, job.progress if job else 0.0):
+                        LOGGER.warning("{} lost the lease of job {}".format(self.name, leased["id"]))
+                except sqlite3.Error as err:
+                    LOGGER.warning("{}: heartbeat failed: {}".format(self.name, err))
+
+        heartbeat_thread = threading.Thread(target=heartbeat)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+        try:
+            job = create_job(leased)
+            core.JobGroup([job]).execute(self.slots)
+            status = job.status
+            result = job.result.to_dict() if job.result is not None else {"success": True, "error": "", "references": {}}
+
+        except Exception as err:
+            LOGGER.critical("{}: job {} failed: {}".format(self.name, leased["id"], err))
+            status = ERROR
+            result = {"success": False, "error": str(err), "references": {}}
+
+        finally:
+            finished.set()
+            heartbeat_thread.join()
+
+        try:
+            if not self.broker.complete(leased["id"], self.name, status, result):
+                LOGGER.warning("{}: result of job {} ignored, lease was lost".format(self.name, leased["id"]))
+        except sqlite3.Error as err:
+            # the lease expires and the job is queued again
+            LOGGER.warning("{}: unable to complete job {}: {}".format(self.name, leased["id"], err))
+            return
+
+        LOGGER.info("{} finished job {}: {}".format(self.name, leased["id"], status))
+
+
+def run_workers(broker, count, name=None, once=False):
+    name = name or "{}-{}".format(socket.gethostname(), os.getpid())
+    slots = core.ProcessSlots(count)
+    workers = [BrokerWorker(broker, "{}-{}".format(name, index + 1), once=once, slots=slots) for index in range(count)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+
+    except KeyboardInterrupt:
+        LOGGER.info("stopping workers after their current job")
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+
+
+def print_status(broker):
+    jobs = broker.get_status()
+    for job in jobs.values():
+        sys.stdout.write("{id:>6} {status:<6} {progress:>4.0%} {worker:<24} {maya_file_path}\n".format(
+            **dict(job, worker=job["worker"] or "", progress=job["progress"] or 0.0)
+        ))
+
+    statuses = [job["status"] for job in jobs.values()]
+    sys.stdout.write("{} jobs: {} queued, {} running, {} done, {} failed\n".format(
+        len(statuses), statuses.count(QUEUED), statuses.count(LEASED), statuses.count(DONE), statuses.count(ERROR)
+    ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="cache job broker")
+    parser.add_argument("--broker", default=config.BROKER_PATH, help="broker database, default: %(default)s")
+    commands = parser.add_subparsers(dest="command")
+
+    worker_parser = commands.add_parser("worker", help="lease and run jobs until stopped")
+    worker_parser.add_argument("--jobs", type=int, default=1, help="jobs run at once on this machine")
+    worker_parser.add_argument("--name", help="worker name prefix, host name and process id by default")
+    worker_parser.add_argument("--maya-batch", help="mayabatch executable, default: {}".format(config.MAYA_BATCH))
+    worker_parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+
+    commands.add_parser("status", help="print every job of the broker")
+    commands.add_parser("clear", help="remove finished jobs")
+
+    args = parser.parse_args(argv)
+    broker = Broker(args.broker)
+
+    if args.command == "worker":
+        if args.maya_batch:
+            config.MAYA_BATCH = args.maya_batch
+        run_workers(broker, max(1, args.jobs), args.name, args.once)
+
+    elif args.command == "status":
+        print_status(broker)
+
+    elif args.command == "clear":
+        LOGGER.info("removed {} finished jobs".format(broker.clear_finished()))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import json
+import time
+import sqlite3
+import threading
+import config
+import app_logger
+import core
+import utils
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+# bump when the tables change, older stores are dropped.
+SCHEMA_VERSION = 1
+
+
+class JobStore(object):
+    """
+    Local record of the job queue, so the queue survives a crash or reboot of the ui.
+    jobs hold the latest state of every queued job, transitions every status change
+    and timings the duration of every finished run.
+    """
+
+    def __init__(self, path=config.JOB_STORE_PATH):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = utils.connect_sqlite(self.path)
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                for table in ("jobs", "transitions", "timings"):
+                    self._connection.execute("DROP TABLE IF EXISTS {}".format(table))
+                self._connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_key TEXT PRIMARY KEY, project TEXT, episode TEXT, "
+                "maya_file_path TEXT, reference_nodes TEXT, force INTEGER, sharded INTEGER, status TEXT, "
+                "failed_nodes TEXT, retry_nodes TEXT, created REAL, updated REAL, started REAL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS transitions (job_key TEXT, status TEXT, time REAL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS timings (job_key TEXT, maya_file_path TEXT, reference_count INTEGER, "
+                "status TEXT, started REAL, finished REAL, duration REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS transitions_time ON transitions (time)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS timings_file ON timings (maya_file_path)")
+            self._connection.commit()
+
+        return self._connection
+
+    def _execute(self, statements):
+        """
+        run (sql, parameters) pairs in one transaction, the store is optional so errors are only logged.
+        """
+        try:
+            with self._lock:
+                connection = self._connect()
+                for sql, parameters in statements:
+                    connection.execute(sql, parameters)
+                connection.commit()
+
+        except sqlite3.Error as err:
+            LOGGER.warning("job store unavailable: {}".format(err))
+
+    def save(self, job):
+        """
+        :type job: core.Job
+        """
+        now = time.time()
+        if job.selected_reference == core.Job.ALL_REFERENCE:
+            reference_nodes = None
+        else:
+            reference_nodes = [ref.reference_node for ref in job.selected_reference]
+
+        self._execute([
+            ("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+             (make_key(job), job.project, job.epsoide, job.maya_file_instance.file_path, json.dumps(reference_nodes),
+              int(job.force), int(job.sharded), job.status, json.dumps(get_nodes(job.failed_references)),
+              json.dumps(get_nodes(job.retry_references)), now, now)),
+            ("INSERT INTO transitions VALUES (?, ?, ?)", (make_key(job), job.status, now)),
+        ])
+
+    def record_transition(self, job, status):
+        """
+        status change of a stored job, a finished run adds a timings row.
+
+        :type job: core.Job
+        """
+        now = time.time()
+        key = make_key(job)
+        statements = [
+            ("UPDATE jobs SET status=?, failed_nodes=?, retry_nodes=?, updated=? WHERE job_key=?",
+             (status, json.dumps(get_nodes(job.failed_references)), json.dumps(get_nodes(job.retry_references)), now, key)),
+            ("INSERT INTO transitions VALUES (?, ?, ?)", (key, status, now)),
+        ]
+        if status == core.Job.IP:
+            statements.append(("UPDATE jobs SET started=? WHERE job_key=?", (now, key)))
+
+        elif status in (core.Job.DONE, core.Job.ERROR):
+            statements.append((
+                "INSERT INTO timings SELECT job_key, maya_file_path, ?, ?, started, ?, ? - started "
+                "FROM jobs WHERE job_key=? AND started IS NOT NULL",
+                (len(job.reference_to_cache), status, now, now, key)
+            ))
+
+        self._execute(statements)
+
+    def add_timing(self, job, status, started, finished):
+        """
+        timings row of a run not kept in the jobs table, such like runs of batch.py.
+
+        :type job: core.Job
+        """
+        self._execute([("INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (make_key(job), job.maya_file_instance.file_path, len(job.reference_to_cache), status,
+                         started, finished, finished - started))])
+
+    def remove(self, job):
+        self.remove_key(make_key(job))
+
+    def remove_key(self, job_key):
+        self._execute([("DELETE FROM jobs WHERE job_key=?", (job_key,))])
+
+    def load(self):
+        """
+        stored jobs in the order they were queued, jobs interrupted while running or publishing are queued again.
+
+        :rtype: list[dict]
+        """
+        try:
+            with self._lock:
+                connection = self._connect()
+                interrupted = connection.execute("UPDATE jobs SET status=?, updated=? WHERE status IN (?, ?)",
+                                                 (core.Job.IN_QUEUE, time.time(), core.Job.IP,
+                                                  core.Job.PUBLISHING)).rowcount
+                connection.commit()
+                rows = connection.execute(
+                    "SELECT job_key, project, episode, maya_file_path, reference_nodes, force, sharded, status, "
+                    "failed_nodes, retry_nodes FROM jobs ORDER BY created"
+                ).fetchall()
+
+        except sqlite3.Error as err:
+            LOGGER.warning("job store unavailable, starting with an empty queue: {}".format(err))
+            return []
+
+        if interrupted:
+            LOGGER.info("{} jobs were interrupted while running, queued again".format(interrupted))
+
+        columns = ["job_key", "project", "episode", "maya_file_path", "reference_nodes", "force", "sharded", "status",
+                   "failed_nodes", "retry_nodes"]
+        jobs = []
+        for row in rows:
+            job = dict(zip(columns, row))
+            for column in ("reference_nodes", "failed_nodes", "retry_nodes"):
+                job[column] = json.loads(job[column]) if job[column] else None
+            jobs.append(job)
+
+        return jobs
+
+    def get_timings(self, maya_file_path=None):
+        """
+        finished runs, of given maya file or all of them.
+
+        :rtype: list[dict]
+        """
+        sql = "SELECT maya_file_path, reference_count, status, started, finished, duration FROM timings"
+        parameters = ()
+        if maya_file_path:
+            sql += " WHERE maya_file_path=?"
+            parameters = (maya_file_path,)
+
+        try:
+            with self._lock:
+                rows = self._connect().execute(sql, parameters).fetchall()
+
+        except sqlite3.Error as err:
+            LOGGER.warning("job store unavailable: {}".format(err))
+            return []
+
+        columns = ["maya_file_path", "reference_count", "status", "started", "finished", "duration"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def clear_history(self, max_age_days=config.JOB_HISTORY_MAX_AGE_DAYS):
+        """
+        remove done jobs and transitions and timings older than max_age_days.
+        """
+        before = time.time() - max_age_days * 24 * 60 * 60
+        self._execute([
+            ("DELETE FROM jobs WHERE status=?", (core.Job.DONE,)),
+            ("DELETE FROM transitions WHERE time<? OR job_key NOT IN (SELECT job_key FROM jobs)", (before,)),
+            ("DELETE FROM timings WHERE finished<?", (before,)),
+        ])
+
+
+def make_key(job):
+    """
+    :type job: core.Job
+    :rtype: str
+    """
+    file_path, references = job.key
+    return json.dumps([file_path, sorted(references)])
+
+
+def get_nodes(references):
+    if references is None:
+        return None
+
+    return [ref.reference_node for ref in references]
+
+
+def restore_job(stored, maya_file=None):
+    """
+    core.Job of a stored row with its status, failed and retry references,
+    None if the maya file or every selected reference is gone.
+
+    :type stored: dict
+    :param maya_file: maya file of the row with its references already loaded, such like by core.ReferencePrefetcher
+    :type maya_file: core.MayaFile
+    :rtype: core.Job
+    """
+    maya_file = maya_file or core.MayaFile(stored["project"], stored["episode"], stored["maya_file_path"])
+    try:
+        references = maya_file.references
+    except (IOError, OSError) as err:
+        LOGGER.warning("unable to restore job of {}: {}".format(stored["maya_file_path"], err))
+        return None
+
+    def select(nodes):
+        if nodes is None:
+            return None
+        return [ref for ref in references if ref.reference_node in nodes]
+
+    selected_reference = select(stored["reference_nodes"])
+    if selected_reference == []:
+        LOGGER.warning("unable to restore job of {}: its references are gone".format(stored["maya_file_path"]))
+        return None
+
+    job = core.Job(stored["project"], stored["episode"], maya_file,
+                   core.Job.ALL_REFERENCE if selected_reference is None else selected_reference,
+                   bool(stored["force"]), bool(stored["sharded"]))
+    job.status = stored["status"]
+    job.failed_references = select(stored["failed_nodes"]) or []
+    job.retry_references = select(stored["retry_nodes"])
+    return job
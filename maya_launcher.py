@@ -1,59 +1,625 @@
 import subprocess
 import config
 import os
+import json
+import socket
+import signal
+import time
+import atexit
+import tempfile
+import threading
 import app_logger
+import metrics
+import publisher
 
 
 LOGGER = app_logger.get_logger(__name__)
 
+_IDLE_WORKERS = []
+_WORKERS_LOCK = threading.Lock()
+_WORKER_COUNTER = [0]
 
-def execute_cache_job(project, epsoide, maya_file_path, reference_nodes, is_camera_cache):
-    maya_log_name = os.path.basename(os.path.splitext(maya_file_path)[0])
+# connects on the first recorded run
+_METRICS_STORE = metrics.MetricsStore()
+# threads start with the first published cache
+_PUBLISHER = publisher.Publisher()
 
-    maya_log_path = config.MAYA_LOG_PATH.format(**{
-        config.FormatterKeys.NAME: maya_log_name,
-        config.FormatterKeys.EPI: epsoide,
-    }).replace("\\", "/")
 
-    log_dir = os.path.dirname(maya_log_path)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+def get_process_environment():
+    module_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+
+    if env.get("PYTHONPATH"):
+        env["PYTHONPATH"] = "{};{}".format(env["PYTHONPATH"], module_path)
+
+    else:
+        env["PYTHONPATH"] = module_path
 
-    command = '\"{app}\" -log \"{log}\" -command \"python(\\"from cacheManager import maya_operations;maya_operations.main(\\\\\\"{project}\\\\\\", \\\\\\"{epsoide}\\\\\\", \\\\\\"{file}\\\\\\", \\\\\\"{rnodes}\\\\\\", \\\\\\"{cam}\\\\\\")\\")\"'.format(
+    # maya resolves ~ to the documents folder, scratch files have to be where the cache manager cleans them up
+    env["CACHE_MANAGER_LOCAL_SCRATCH"] = config.LOCAL_SCRATCH
+    return env
+
+
+def build_maya_command(log_path, function, *args):
+    """
+    mayabatch command line calling given maya_operations function with string arguments.
+    """
+    arguments = ", ".join(['\\\\\\"{}\\\\\\"'.format(arg) for arg in args])
+    return '\"{app}\" -log \"{log}\" -command \"python(\\"from cacheManager import maya_operations;maya_operations.{function}({arguments})\\")\"'.format(
         app=config.MAYA_BATCH,
-        log=maya_log_path,
-        file=maya_file_path.replace("\\", "/"),
-        rnodes=",".join(reference_nodes),
-        project=project,
-        epsoide=epsoide,
-        cam="1" if is_camera_cache else "0"
+        log=log_path,
+        function=function,
+        arguments=arguments,
     )
 
-    module_path = os.path.dirname(os.path.dirname(__file__))
 
-    if os.environ.get("PYTHONPATH"):
-        os.environ["PYTHONPATH"] = "{};{}".format(os.environ["PYTHONPATH"], module_path)
+def ensure_log_dir(log_path):
+    log_dir = os.path.dirname(log_path)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+
+class CacheResult(object):
+    """
+    outcome of one maya process, read from the json result file written by maya_operations.
+    references maps every reference node, and "Camera", to its own result:
+    {"status": "done" or "error", "output_path": str, "scratch_path": str, "size": int, "duration": float, "error": str}
+    a scratch_path is set while the cache waits in the local scratch folder to be published to output_path.
+    timings holds the phase timings of CacheExporter: {"started_at": float, "phases": dict, "output_bytes": int}
+    """
+
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(self, success=False, references=None, error="", expected_error=False, timings=None):
+        self.success = success
+        self.references = references or {}
+        self.error = error
+        self.expected_error = expected_error
+        self.timings = timings or {}
 
+    def __bool__(self):
+        return self.success
+
+    __nonzero__ = __bool__
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("success", False),
+                   data.get("references", {}),
+                   data.get("error", ""),
+                   data.get("expected_error", False),
+                   data.get("timings", {}))
+
+    def to_dict(self):
+        return {
+            "success": self.success,
+            "references": self.references,
+            "error": self.error,
+            "expected_error": self.expected_error,
+            "timings": self.timings,
+        }
+
+    @classmethod
+    def failed(cls, reference_nodes, is_camera_cache, error):
+        """
+        result of a process that did not report back, such like a maya crash, every reference failed.
+        """
+        nodes = list(reference_nodes) + (["Camera"] if is_camera_cache else [])
+        references = dict((node, {"status": cls.ERROR, "output_path": "", "size": 0, "duration": 0.0, "error": error})
+                          for node in nodes)
+        return cls(False, references, error)
+
+    @property
+    def failed_references(self):
+        """
+        :rtype: list[str]
+        """
+        return [node for node, result in self.references.items() if result.get("status") != self.DONE]
+
+    def merge(self, other):
+        """
+        combine results of processes that shared one job, such like shards.
+        """
+        references = dict(self.references)
+        references.update(other.references)
+        return CacheResult(self.success and other.success,
+                           references,
+                           "; ".join(error for error in (self.error, other.error) if error),
+                           self.expected_error or other.expected_error,
+                           self.timings or other.timings)
+
+
+def read_result(result_path, reference_nodes, is_camera_cache):
+    """
+    :rtype: CacheResult
+    """
+    if not os.path.exists(result_path):
+        return CacheResult.failed(reference_nodes, is_camera_cache, "no result written")
+
+    try:
+        with open(result_path, "r") as fr:
+            return CacheResult.from_dict(json.load(fr))
+
+    except ValueError as err:
+        LOGGER.critical("unreadable result file {}: {}".format(result_path, err))
+        return CacheResult.failed(reference_nodes, is_camera_cache, "unreadable result file")
+
+    finally:
+        os.remove(result_path)
+
+
+def execute_cache_job(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, log_suffix="", on_progress=None,
+                      on_published=None):
+    """
+    run the cache export of given maya file, on_progress(event) receives the frame progress events of maya_operations.
+    without on_published the caches are published before the result is returned. with it the result is returned once
+    maya is done and on_published(result) is called from a publisher thread once the caches are published.
+
+    :rtype: CacheResult
+    """
+    launched = time.time()
+    if config.USE_PERSISTENT_WORKERS:
+        result = execute_on_worker(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, on_progress)
     else:
-        os.environ["PYTHONPATH"] = module_path
+        result = execute_in_process(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, log_suffix,
+                                    on_progress)
+
+    def on_result_published(published):
+        if config.METRICS_ENABLED:
+            try:
+                _METRICS_STORE.record(project, epsoide, maya_file_path,
+                                      "worker" if config.USE_PERSISTENT_WORKERS else "process",
+                                      published, launched, time.time())
+            except Exception as err:
+                LOGGER.warning("unable to record metrics of {}: {}".format(maya_file_path, err))
+
+        if on_published:
+            on_published(published)
+
+    publish_result(result, on_result_published, wait=on_published is None)
+    return result
 
-    os.environ["CACHE_MANAGER_PROCESS_EXPECTED_ERROR"] = "0"
+
+def publish_result(result, on_published, wait=True):
+    """
+    publish the scratch caches of a result to the network share, references failing to publish are failed.
+    scratch files of failed references are removed. on_published(result) is called once the caches are published,
+    before returning if wait is set, from a publisher thread otherwise.
+
+    :type result: CacheResult
+    """
+    files = []
+    for reference in result.references.values():
+        scratch_path = reference.get("scratch_path")
+        if not scratch_path:
+            continue
+
+        if reference.get("status") == CacheResult.DONE:
+            files.append((scratch_path, reference["output_path"]))
+        else:
+            publisher.discard(scratch_path)
+
+    if not files:
+        on_published(result)
+        return
+
+    start = time.time()
+
+    def apply_errors(errors):
+        for reference in result.references.values():
+            if reference.get("scratch_path"):
+                reference["scratch_path"] = ""
+                if reference["output_path"] in errors:
+                    reference.update({"status": CacheResult.ERROR, "error": errors[reference["output_path"]]})
+
+        if errors:
+            result.success = False
+            result.error = "; ".join(error for error in [result.error, "{} caches not published".format(len(errors))] if error)
+
+        phases = result.timings.setdefault("phases", {})
+        phases["publish"] = round(time.time() - start, 3)
+        on_published(result)
+
+    if wait:
+        apply_errors(_PUBLISHER.publish(files))
+    else:
+        _PUBLISHER.publish_async(files, apply_errors)
+
+
+def recover_scratch(result, events):
+    """
+    caches maya reported in scratch which its result is missing, such like after a maya crash.
+    finished caches are added to the result to be published instead of exported again, partial ones are removed.
+
+    :type result: CacheResult
+    :param events: {reference node: last scratch event of maya_operations.report_scratch}
+    :rtype: CacheResult
+    """
+    for node, event in events.items():
+        reference = result.references.get(node, {})
+        if reference.get("status") == CacheResult.DONE or reference.get("scratch_path"):
+            continue
+
+        if event["status"] == CacheResult.DONE and os.path.exists(event["scratch_path"]):
+            LOGGER.info("{} was exported before maya stopped, publishing {}".format(node, event["output_path"]))
+            result.references[node] = {"status": CacheResult.DONE, "output_path": event["output_path"],
+                                       "scratch_path": event["scratch_path"], "size": event.get("size", 0),
+                                       "duration": None, "error": ""}
+        else:
+            publisher.discard(event["scratch_path"])
+
+    return result
+
+
+def execute_in_process(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, log_suffix="", on_progress=None):
+    """
+    run the cache export in a new maya process.
+
+    :rtype: CacheResult
+    """
+    maya_log_name = os.path.basename(os.path.splitext(maya_file_path)[0]) + log_suffix
+
+    maya_log_path = config.MAYA_LOG_PATH.format(**{
+        config.FormatterKeys.NAME: maya_log_name,
+        config.FormatterKeys.EPI: epsoide,
+    }).replace("\\", "/")
+
+    ensure_log_dir(maya_log_path)
+
+    handle, result_path = tempfile.mkstemp(prefix="{}_".format(maya_log_name), suffix=".json")
+    os.close(handle)
+    os.remove(result_path)
+
+    command = build_maya_command(maya_log_path,
+                                 "main",
+                                 project,
+                                 epsoide,
+                                 maya_file_path.replace("\\", "/"),
+                                 ",".join(reference_nodes),
+                                 "1" if is_camera_cache else "0",
+                                 result_path.replace("\\", "/"))
 
     LOGGER.info("command: {}".format(command))
-    result, error = subprocess.Popen(command, shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE).communicate()
+    process = subprocess.Popen(command,
+                               shell=True,
+                               stderr=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               env=get_process_environment(),
+                               **get_process_group_options())
+    monitor = OutputMonitor(process, maya_log_name, on_progress)
+    monitor.start()
+    monitor.wait()
+
+    result = read_result(result_path, reference_nodes, is_camera_cache)
 
-    if error:
-        LOGGER.critical("error running subprocess error is below:\n{}".format(error))
-        return False
+    if monitor.fatal_error:
+        LOGGER.critical("maya process stopped on error: {}".format(monitor.fatal_error))
+        result.success = False
 
-    if config.SUCCESS_CODE not in result:
-        if os.environ["CACHE_MANAGER_PROCESS_EXPECTED_ERROR"] == "0":
+    elif not result.references or (not monitor.is_successful and not result.failed_references):
+        if not result.expected_error:
             LOGGER.critical("Unexpected error came, such like maya crash etc.")
+        return recover_scratch(CacheResult.failed(reference_nodes, is_camera_cache, result.error or "maya exited without result"),
+                               monitor.scratch)
+
+    recover_scratch(result, monitor.scratch)
+    if result.failed_references:
+        LOGGER.critical("cache failed for {}: {}".format(", ".join(sorted(result.failed_references)), result.error))
+
+    return result
+
+
+def kill_process(process):
+    """
+    kill the process with its children, commands run through the shell so on windows
+    mayabatch is a child of cmd.exe.
+    """
+    if process.poll() is not None:
+        return
+
+    if os.name == "nt":
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+
+
+def get_process_group_options():
+    """
+    Popen options starting the process in its own group, so kill_process reaches every child.
+    """
+    if os.name == "nt":
+        return {}
+
+    return {"preexec_fn": os.setsid}
+
+
+class OutputMonitor(object):
+    """
+    Reads stdout and stderr of a maya process line by line while it runs.
+    lines go to the log as they arrive, the success marker and error tags are detected on the fly
+    and the process is killed as soon as a fatal error shows up.
+    scratch holds the last scratch event of every reference, see recover_scratch.
+    """
+
+    def __init__(self, process, name, on_progress=None):
+        self.process = process
+        self.name = name
+        self.on_progress = on_progress
+
+        self.is_successful = False
+        self.has_error_output = False
+        self.fatal_error = None
+        self.scratch = {}
+
+        self._threads = []
+
+    def start(self):
+        streams = [(self.process.stdout, False)]
+        if self.process.stderr is not None:
+            streams.append((self.process.stderr, True))
+
+        for stream, is_error in streams:
+            thread = threading.Thread(target=self._read, args=(stream, is_error))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self):
+        for thread in self._threads:
+            thread.join()
+
+        return self.process.wait()
+
+    def _read(self, stream, is_error):
+        for line in iter(stream.readline, b""):
+            if not isinstance(line, str):
+                line = line.decode("utf-8", "replace")
+
+            self.on_line(line.rstrip(), is_error)
+
+        stream.close()
+
+    def on_line(self, line, is_error):
+        if not line:
+            return
+
+        if line.startswith(config.PROGRESS_TRACKER):
+            self.on_progress_line(line[len(config.PROGRESS_TRACKER):])
+            return
+
+        if line.startswith(config.SCRATCH_TRACKER):
+            self.on_scratch_line(line[len(config.SCRATCH_TRACKER):])
+            return
+
+        if is_error:
+            self.has_error_output = True
+            LOGGER.warning("{} [stderr]: {}".format(self.name, line))
+        else:
+            LOGGER.info("{}: {}".format(self.name, line))
+
+        if config.SUCCESS_CODE in line:
+            self.is_successful = True
+
+        if self.fatal_error is None:
+            if config.TRACEBACK_TRACKER in line:
+                self.fatal_error = line.replace(config.TRACEBACK_TRACKER, "").strip() or "error tag without message"
+
+            elif any(marker in line for marker in config.FATAL_OUTPUT_MARKERS):
+                self.fatal_error = line
+
+            if self.fatal_error is not None:
+                LOGGER.critical("{}: fatal error detected, stopping maya: {}".format(self.name, self.fatal_error))
+                kill_process(self.process)
+
+    def on_progress_line(self, data):
+        if not self.on_progress:
+            return
+
+        try:
+            event = json.loads(data)
+        except ValueError:
+            LOGGER.warning("{}: unreadable progress event: {}".format(self.name, data))
+            return
+
+        try:
+            self.on_progress(event)
+        except Exception as err:
+            LOGGER.warning("{}: progress callback failed: {}".format(self.name, err))
+
+    def on_scratch_line(self, data):
+        try:
+            event = json.loads(data)
+        except ValueError:
+            LOGGER.warning("{}: unreadable scratch event: {}".format(self.name, data))
+            return
+
+        self.scratch[event["reference"]] = event
+
+
+def execute_on_worker(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, on_progress=None):
+    try:
+        worker = acquire_worker()
+    except Exception as err:
+        LOGGER.critical("unable to start maya worker: {}".format(err))
+        return CacheResult.failed(reference_nodes, is_camera_cache, "unable to start maya worker")
+
+    try:
+        return worker.run_job(project, epsoide, maya_file_path, reference_nodes, is_camera_cache, on_progress)
+    finally:
+        release_worker(worker)
+
+
+def acquire_worker():
+    """
+    reuse an idle maya worker or start a new one.
+
+    :rtype: MayaWorker
+    """
+    with _WORKERS_LOCK:
+        while _IDLE_WORKERS:
+            worker = _IDLE_WORKERS.pop()
+            if worker.is_alive:
+                return worker
+
+        _WORKER_COUNTER[0] += 1
+        name = "cache_worker_{}".format(_WORKER_COUNTER[0])
+
+    worker = MayaWorker(name)
+    worker.start()
+    return worker
+
+
+def release_worker(worker):
+    if worker.is_alive and worker.jobs_done < worker.max_jobs:
+        with _WORKERS_LOCK:
+            _IDLE_WORKERS.append(worker)
+
+    else:
+        worker.stop()
+
+
+@atexit.register
+def shutdown_publisher():
+    _PUBLISHER.shutdown()
+
+
+@atexit.register
+def shutdown_workers():
+    with _WORKERS_LOCK:
+        workers = list(_IDLE_WORKERS)
+        del _IDLE_WORKERS[:]
+
+    for worker in workers:
+        worker.stop()
+
+
+class MayaWorker(object):
+    """
+    Long lived mayabatch session running maya_operations.serve().
+    the worker connects back to a local socket opened here and receives one json request per job.
+    """
+
+    def __init__(self, name, max_jobs=config.WORKER_MAX_JOBS):
+        self.name = name
+        self.max_jobs = max_jobs
+        self.jobs_done = 0
+
+        self.process = None
+        self.monitor = None
+        self.connection = None
+        self.reader = None
+
+    @property
+    def is_alive(self):
+        return self.connection is not None and self.process is not None and self.process.poll() is None
+
+    def start(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        server.settimeout(config.WORKER_START_TIMEOUT)
+        port = server.getsockname()[1]
+
+        log_path = config.MAYA_WORKER_LOG_PATH.format(**{config.FormatterKeys.NAME: self.name}).replace("\\", "/")
+        ensure_log_dir(log_path)
+
+        command = build_maya_command(log_path, "serve", port, self.max_jobs)
+        LOGGER.info("starting {}, command: {}".format(self.name, command))
+        self.process = subprocess.Popen(command,
+                                        shell=True,
+                                        stderr=subprocess.STDOUT,
+                                        stdout=subprocess.PIPE,
+                                        env=get_process_environment(),
+                                        **get_process_group_options())
+
+        self.monitor = OutputMonitor(self.process, self.name)
+        self.monitor.start()
+
+        try:
+            self.connection, _ = server.accept()
+        except socket.timeout:
+            self.stop(kill=True)
+            raise RuntimeError("{} did not connect within {} seconds".format(self.name, config.WORKER_START_TIMEOUT))
+        finally:
+            server.close()
+
+        self.connection.settimeout(None)
+        self.reader = self.connection.makefile("rb")
+        LOGGER.info("{} connected".format(self.name))
+
+    def run_job(self, project, epsoide, maya_file_path, reference_nodes, is_camera_cache, on_progress=None):
+        request = {
+            "project": project,
+            "episode": epsoide,
+            "maya_file_path": maya_file_path.replace("\\", "/"),
+            "reference_nodes": list(reference_nodes),
+            "is_camera_cache": bool(is_camera_cache),
+        }
+        LOGGER.info("{} running job: {}".format(self.name, request))
+
+        self.monitor.on_progress = on_progress
+        self.monitor.scratch = {}
+        try:
+            self.connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            line = self.reader.readline()
+        except socket.error as err:
+            LOGGER.critical("{} connection lost: {}".format(self.name, err))
+            self.stop(kill=True)
+            return recover_scratch(CacheResult.failed(reference_nodes, is_camera_cache, "worker connection lost"),
+                                   self.monitor.scratch)
+
+        finally:
+            self.monitor.on_progress = None
+
+        self.jobs_done += 1
+
+        if not line:
+            if self.monitor.fatal_error:
+                LOGGER.critical("{} stopped on error: {}".format(self.name, self.monitor.fatal_error))
+            else:
+                LOGGER.critical("{} exited while running job, such like maya crash etc.".format(self.name))
+            self.stop(kill=True)
+            return recover_scratch(CacheResult.failed(reference_nodes, is_camera_cache,
+                                                      self.monitor.fatal_error or "maya worker exited"),
+                                   self.monitor.scratch)
+
+        response = json.loads(line.decode("utf-8"))
+        if not response["status"]:
+            LOGGER.critical("{} job failed: {}".format(self.name, response["error"]))
+
+        return CacheResult.from_dict(response["result"])
+
+    def stop(self, kill=False):
+        if self.connection is not None:
+            if not kill:
+                try:
+                    self.connection.sendall((json.dumps({"command": "quit"}) + "\n").encode("utf-8"))
+                except socket.error:
+                    kill = True
+
+            self.reader.close()
+            self.connection.close()
+            self.connection = None
+
+        else:
+            kill = True
+
+        if self.process is not None and self.process.poll() is None:
+            if kill:
+                kill_process(self.process)
+            self.process.wait()
 
-        return False
+        if self.monitor is not None:
+            # the output of a stopped worker is read to the end, its last scratch events included
+            self.monitor.wait()
 
-    return True
+        LOGGER.info("{} stopped after {} jobs".format(self.name, self.jobs_done))
 
 
 if __name__ == '__main__':
-    execute_cache_job("C:/Users/VIRU/Downloads/Project/Project/Ep101/Ep101/IFD/Sh020/pta_ep101_sh020_cl01_v00.ma", ["nodeRN", "node2RN"])
\ No newline at end of file
+    execute_cache_job("C:/Users/VIRU/Downloads/Project/Project/Ep101/Ep101/IFD/Sh020/pta_ep101_sh020_cl01_v00.ma", ["nodeRN", "node2RN"])
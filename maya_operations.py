@@ -1,7 +1,19 @@
 import os
+import sys
+import re
+import json
+import time
+import fnmatch
+import collections
+import __main__
+import socket
+import traceback
 import maya.cmds as cmds
 import config
 import app_logger
+import cache_manifest
+import file_parser
+import publisher
 import utils
 
 
@@ -12,6 +24,29 @@ LOGGER.info("-----------------------------------------------")
 
 
 CACHE_NODE = "GEO"
+RESULT_DONE = "done"
+RESULT_ERROR = "error"
+REQUIRED_PLUGINS = ["fbxmaya", "AbcImport", "AbcExport"]
+
+PROGRESS_CALLBACK = "cache_manager_report_progress"
+_PROGRESS_CONTEXT = {"label": "", "start": 0, "offset": 0, "total": 0}
+
+# python 2 has no time.monotonic, time.clock is the high resolution wall clock on windows
+clock = getattr(time, "monotonic", None) or (time.clock if os.name == "nt" else time.time)
+
+# phase of a single pass AbcExport, timed inside export_caches
+SINGLE_PASS_PHASE = "single_pass_alembic"
+
+# status of a scratch cache still being written, see report_scratch
+SCRATCH_WRITING = "writing"
+
+OPEN_FULL = "full"
+OPEN_DEFERRED = "deferred"
+# quoted nodes, plugs and values of a reference edit
+EDIT_ARGUMENT_PATTERN = re.compile(r'"([^"]+)"')
+
+# write_path is the local scratch path of output_path when caches are published by the cache manager
+ExportTarget = collections.namedtuple("ExportTarget", ["reference_node", "reference_path", "root", "output_path", "write_path"])
 
 
 class CacheExporter(object):
@@ -25,58 +60,253 @@ class CacheExporter(object):
 
         self.camera_name = "{}{}_camCt".format(self.episode, self.shot).lower()
 
+        self.results = {}
+        self.expected_error = False
+        self.error = ""
+
+        # wall clock start for the maya startup time measured by maya_launcher, phases are monotonic seconds
+        self.started_at = time.time()
+        self.phases = collections.OrderedDict()
+        self.open_mode = OPEN_FULL
+        self.loaded_references = []
+        self.skipped_references = []
+        # reference nodes saved unloaded, a deferred open leaves them unloaded like a full open does
+        self.unloaded_references = set()
+
+    def set_result(self, reference_node, status, output_path="", duration=0.0, error="", write_path=""):
+        """
+        record the outcome of one reference, the camera is recorded as "Camera".
+        write_path is the scratch file still to be published to output_path.
+        duration is None for references exported together, see SINGLE_PASS_PHASE.
+        """
+        write_path = write_path or output_path
+        size = os.path.getsize(write_path) if write_path and os.path.exists(write_path) else 0
+        if write_path != output_path:
+            report_scratch(reference_node, output_path, write_path, status, size)
+        self.results[reference_node] = {
+            "status": status,
+            "output_path": output_path,
+            "scratch_path": write_path if write_path != output_path else "",
+            "size": size,
+            "duration": round(duration, 3) if duration is not None else None,
+            "error": error,
+        }
+        if error:
+            LOGGER.critical("{}: {}".format(reference_node, error))
+
+    def timed(self, phase, function, *args):
+        """
+        call function and add its run time to given phase.
+        """
+        start = clock()
+        try:
+            return function(*args)
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + clock() - start
+
+    def get_result(self):
+        """
+        machine readable outcome of the whole job, read back by maya_launcher.
+
+        :rtype: dict
+        """
+        expected = list(self.reference_nodes) + (["Camera"] if self.is_camera_cache else [])
+        references = dict(self.results)
+        for reference_node in expected:
+            if reference_node not in references:
+                references[reference_node] = {"status": RESULT_ERROR, "output_path": "", "size": 0, "duration": 0.0,
+                                              "error": self.error or "not exported"}
+
+        return {
+            "success": all(result["status"] == RESULT_DONE for result in references.values()) and not self.error,
+            "expected_error": self.expected_error,
+            "error": self.error,
+            "maya_file_path": self.maya_file_path,
+            "references": references,
+            "timings": {
+                "started_at": self.started_at,
+                "phases": dict((phase, round(seconds, 3)) for phase, seconds in self.phases.items()),
+                "output_bytes": sum(result["size"] for result in references.values()),
+                "open_mode": self.open_mode,
+                "skipped_references": len(self.skipped_references),
+            },
+        }
+
+    def write_result(self, path):
+        with open(path, "w") as fw:
+            json.dump(self.get_result(), fw, indent=4, sort_keys=True)
+
     def create_error_tag(self, message):
         print "{0}{1}{0}".format(config.TRACEBACK_TRACKER, message)
+        sys.stdout.flush()
 
     def open_maya_file(self):
         if os.path.exists(self.maya_file_path):
-            pass
+            self.open_mode = OPEN_DEFERRED if config.DEFERRED_REFERENCE_LOADING and self.reference_nodes else OPEN_FULL
+            if self.open_mode == OPEN_DEFERRED:
+                try:
+                    self.unloaded_references = set(reference["refnode"] for reference in
+                                                   file_parser.get_reference_info_from_file(self.maya_file_path)
+                                                   if not reference["loaded"])
+                except Exception:
+                    LOGGER.warning("unable to read saved reference states, opening every reference:\n{}".format(
+                        traceback.format_exc()))
+                    self.open_mode = OPEN_FULL
+
             try:
-                LOGGER.info("opening maya file: {}".format(self.maya_file_path))
-                cmds.file(self.maya_file_path, o=True, f=True)
+                LOGGER.info("opening maya file: {}, references: {}".format(self.maya_file_path, self.open_mode))
+                if self.open_mode == OPEN_DEFERRED:
+                    cmds.file(self.maya_file_path, o=True, f=True, loadReferenceDepth="none")
+                else:
+                    cmds.file(self.maya_file_path, o=True, f=True)
                 LOGGER.info("file opened")
             except:
                 LOGGER.info("file opened with error")
 
         else:
             message = "Unable to open maya file, file not found: {}".format(self.maya_file_path)
-            os.environ["CACHE_MANAGER_PROCESS_EXPECTED_ERROR"] = "1"
+            self.expected_error = True
             raise Exception(message)
 
-    def check_file(self):
-        is_ready_for_cache = True
-        unloaded_reference = []
-        cache_node_missing_reference = []
+    def get_top_level_references(self):
+        """
+        {namespace: reference node} of the references of the shot itself.
+
+        :rtype: dict
+        """
+        references = {}
+        for path in cmds.file(q=True, reference=True) or []:
+            reference_node = cmds.referenceQuery(path, referenceNode=True)
+            references[cmds.referenceQuery(reference_node, namespace=True).strip(":")] = reference_node
+
+        return references
+
+    def get_reference_dependencies(self, references, reference_nodes):
+        """
+        reference nodes given reference nodes depend on through reference edits, followed through the nodes of the
+        shot itself such like constraints. connectAttr edits depend on their source, parent edits on the new parent
+        and any other edit naming nodes of several references ties those references together.
+        raises ValueError for a dependency on a node of neither the shot nor a reference.
+
+        :param references: {namespace: reference node} of the top level references
+        :rtype: set[str]
+        """
+        def get_owner(name):
+            # reference namespace of the node, or the node itself for nodes of the shot
+            node = name.split(".")[0].split("|")[-1]
+            namespace = node.rpartition(":")[0]
+            while namespace and namespace not in references:
+                namespace = namespace.rpartition(":")[0]
+            return namespace or node
+
+        sources = collections.defaultdict(set)
+        for reference_node in references.values():
+            edits = cmds.referenceQuery(reference_node, editStrings=True, successfulEdits=True, failedEdits=True) or []
+            for edit in edits:
+                command = edit.split(None, 1)[0] if edit.strip() else ""
+                arguments = EDIT_ARGUMENT_PATTERN.findall(edit)
+                if command == "connectAttr" and len(arguments) >= 2:
+                    sources[get_owner(arguments[1])].add(get_owner(arguments[0]))
+                elif command == "parent" and len(arguments) >= 2:
+                    sources[get_owner(arguments[0])].add(get_owner(arguments[-1]))
+                else:
+                    # values are quoted too, only names of a reference count
+                    owners = set(get_owner(argument) for argument in arguments) & set(references)
+                    for owner in owners:
+                        sources[owner].update(owners - {owner})
+
+        namespaces = dict((reference_node, namespace) for namespace, reference_node in references.items())
+        pending = [namespaces.get(node) or cmds.referenceQuery(node, namespace=True).strip(":") for node in reference_nodes]
+        visited = set(pending)
+        while pending:
+            owner = pending.pop()
+            upstream = set(sources.get(owner, ()))
+            if owner not in references:
+                if not cmds.objExists(owner):
+                    raise ValueError("{} is neither a node of the shot nor of a reference".format(owner))
+
+                upstream.update(get_owner(node) for node in
+                                cmds.listConnections(owner, source=True, destination=False, skipConversionNodes=True) or [])
+                upstream.update(get_owner(node) for node in cmds.listRelatives(owner, allParents=True, fullPath=True) or [])
+
+            for source in upstream - visited:
+                visited.add(source)
+                pending.append(source)
+
+        return set(references[owner] for owner in visited if owner in references) - set(reference_nodes)
+
+    def load_references(self):
+        """
+        after a deferred open load the cached references, the references they depend on and the allow-listed ones.
+        every reference is loaded if the dependencies can not be resolved or the camera is still missing.
+        references saved unloaded are never loaded, check_file reports them as with a full open.
+        """
+        if self.open_mode != OPEN_DEFERRED:
+            return
+
+        references = self.get_top_level_references()
+        to_load = set(self.reference_nodes)
+        try:
+            dependencies = self.get_reference_dependencies(references, self.reference_nodes)
+        except Exception:
+            LOGGER.warning("unable to resolve reference dependencies, loading every reference:\n{}".format(
+                traceback.format_exc()))
+            dependencies = set(references.values())
+
+        for namespace, reference_node in references.items():
+            path = cmds.referenceQuery(reference_node, f=True, withoutCopyNumber=True)
+            if any(fnmatch.fnmatch(namespace, pattern) or fnmatch.fnmatch(path, pattern)
+                   for pattern in config.DEFERRED_REFERENCE_ALLOW_LIST):
+                dependencies.add(reference_node)
+
+        if dependencies - to_load:
+            LOGGER.info("loading dependencies: {}".format(", ".join(sorted(dependencies - to_load))))
+        to_load.update(dependencies)
+        if to_load & self.unloaded_references:
+            LOGGER.info("keeping references saved unloaded: {}".format(", ".join(sorted(to_load & self.unloaded_references))))
+        self.load_reference_nodes(to_load - self.unloaded_references)
+
+        if self.is_camera_cache and not cmds.objExists(self.camera_name):
+            LOGGER.warning("camera '{}' not found, loading every reference".format(self.camera_name))
+            self.load_reference_nodes(set(references.values()) - self.unloaded_references)
+
+        self.skipped_references = sorted(set(references.values()) - set(self.loaded_references))
+        LOGGER.info("loaded {} references, skipped {}".format(len(self.loaded_references), len(self.skipped_references)))
+
+    def load_reference_nodes(self, reference_nodes):
+        for reference_node in sorted(reference_nodes):
+            if reference_node in self.loaded_references:
+                continue
+
+            self.loaded_references.append(reference_node)
+            try:
+                cmds.file(loadReference=reference_node, loadReferenceDepth="all")
+            except Exception as err:
+                # reference errors are reported by check_file
+                LOGGER.warning("{} loaded with error: {}".format(reference_node, err))
 
+    def check_file(self):
+        """
+        record an error result for every unloaded reference, reference without cache group and missing camera.
+        returns False if nothing is left to export.
+        """
         for reference_node in self.reference_nodes:
             if not cmds.referenceQuery(reference_node, il=True):
-                unloaded_reference.append(reference_node)
+                self.set_result(reference_node, RESULT_ERROR, error="unloaded reference")
+                continue
 
-        for reference_node in self.reference_nodes:
-            if cmds.referenceQuery(reference_node, il=True):
-                namespace = cmds.referenceQuery(reference_node, namespace=True).strip(":")
-                node_name = "{}:{}".format(namespace, CACHE_NODE)
-                if not cmds.objExists(node_name):
-                    cache_node_missing_reference.append(node_name)
-
-        if unloaded_reference:
-            LOGGER.critical("unable to process cache process, unloaded reference found:{}\n\t".format(
-                "\n\t".join(unloaded_reference)
-            ))
-            is_ready_for_cache = False
-
-        if cache_node_missing_reference:
-            LOGGER.critical("unable to process cache process, cache group not found:{}\n\t".format(
-                "\n\t".join(cache_node_missing_reference)
-            ))
-            is_ready_for_cache = False
+            namespace = cmds.referenceQuery(reference_node, namespace=True).strip(":")
+            node_name = "{}:{}".format(namespace, CACHE_NODE)
+            if not cmds.objExists(node_name):
+                self.set_result(reference_node, RESULT_ERROR, error="cache group not found: {}".format(node_name))
 
         if self.is_camera_cache:
-            if not cmds.objExists(CAMERA_NAME):
-                LOGGER.critical("unable to process cache process, camera '{}' not found.".format(CAMERA_NAME))
-                is_ready_for_cache = False
+            if not cmds.objExists(self.camera_name):
+                self.set_result("Camera", RESULT_ERROR, error="camera '{}' not found.".format(self.camera_name))
 
-        return is_ready_for_cache
+        pending = [node for node in self.reference_nodes if node not in self.results]
+        is_camera_pending = self.is_camera_cache and "Camera" not in self.results
+        return bool(pending or is_camera_pending)
 
     def get_asset_type(self, path):
         if "/char/" in path.lower():
@@ -84,10 +314,13 @@ class CacheExporter(object):
         else:
             return "Prop"
 
-    def export_cache(self, reference_node):
+    def get_export_target(self, reference_node):
+        """
+        cache root node and output path of given reference node, None if it has no cache group.
+
+        :rtype: ExportTarget
+        """
         namespace = cmds.referenceQuery(reference_node, namespace=True).strip(":")
-        start_frame = cmds.playbackOptions(q=True, ast=True)
-        end_frame = cmds.playbackOptions(q=True, aet=True)
         reference_path = cmds.referenceQuery(reference_node, f=True)
 
         asset_type = self.get_asset_type(reference_path)
@@ -103,25 +336,97 @@ class CacheExporter(object):
 
         output_path = config.CACHE_OUTPUT.format(**formatter).replace("\\", "/")
 
-        node_to_export = cmds.ls("{}:{}".format(namespace, "GEO"), l=True)
-
-        if node_to_export:
-            LOGGER.info("exporting cache at {}".format(output_path))
-            dirname = os.path.dirname(output_path)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-
-            self.export_alembic(node_to_export[0], output_path, start_frame, end_frame)
+        node_to_export = cmds.ls("{}:{}".format(namespace, CACHE_NODE), l=True)
+        if not node_to_export:
+            LOGGER.warning("{} has no {} group, skipping".format(reference_node, CACHE_NODE))
+            return None
 
-    def export_alembic(self, meshes, path, start_frame, end_frame):
-        cmd = "j=frameRange {s_frame} {e_frame} -uvWrite -writeFaceSets -writeVisibility -dataFormat ogawa {root} -file {path}".format(
-            root="-root ".join(meshes), path=path, s_frame=start_frame, e_frame=end_frame
+        write_path = get_write_path(output_path)
+        dirname = os.path.dirname(write_path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if write_path != output_path:
+            report_scratch(reference_node, output_path, write_path, SCRATCH_WRITING)
+
+        return ExportTarget(reference_node, reference_path, node_to_export[0], output_path, write_path)
+
+    def export_caches(self):
+        """
+        export every reference in a single AbcExport call, the timeline is evaluated once for all of them.
+        falls back to one AbcExport call per reference if the combined export fails.
+        references already failed in check_file are left out.
+        """
+        targets = []
+        for reference_node in [node for node in self.reference_nodes if node not in self.results]:
+            target = self.get_export_target(reference_node)
+            if target:
+                targets.append(target)
+            else:
+                self.set_result(reference_node, RESULT_ERROR, error="cache group not found")
+
+        if not targets:
+            return
+
+        start_frame, end_frame = self.get_frame_range()
+        frame_count = int(end_frame - start_frame) + 1
+        exported = False
+        if config.SINGLE_PASS_ALEMBIC and len(targets) > 1:
+            start = clock()
+            set_progress_context("{} references".format(len(targets)), start_frame, 0, frame_count)
+            try:
+                # per frame callback on the first job only, all jobs are evaluated on the same frame
+                cmds.AbcExport(j=[self.build_alembic_job(target.root, target.write_path, start_frame, end_frame, index == 0)
+                                  for index, target in enumerate(targets)])
+                exported = True
+                duration = clock() - start
+                self.phases[SINGLE_PASS_PHASE] = duration
+                LOGGER.info("single pass export of {} references took {:.2f} seconds".format(len(targets), duration))
+                for target in targets:
+                    cache_manifest.write_manifest(target.write_path, [self.maya_file_path, target.reference_path])
+                    self.set_result(target.reference_node, RESULT_DONE, target.output_path, None,
+                                    write_path=target.write_path)
+
+            except Exception:
+                LOGGER.warning("single pass export failed after {:.2f} seconds, exporting references one by one:\n{}".format(
+                    clock() - start, traceback.format_exc()
+                ))
+
+        if not exported:
+            start = clock()
+            for index, target in enumerate(targets):
+                reference_start = clock()
+                set_progress_context(target.reference_node, start_frame, index * frame_count, len(targets) * frame_count)
+                try:
+                    self.export_alembic(target.root, target.write_path, start_frame, end_frame)
+                    cache_manifest.write_manifest(target.write_path, [self.maya_file_path, target.reference_path])
+                except Exception as err:
+                    self.set_result(target.reference_node, RESULT_ERROR, target.output_path, clock() - reference_start, str(err),
+                                    target.write_path)
+                    continue
+
+                self.set_result(target.reference_node, RESULT_DONE, target.output_path, clock() - reference_start,
+                                write_path=target.write_path)
+                LOGGER.info("{} exported in {:.2f} seconds".format(target.reference_node, clock() - reference_start))
+            LOGGER.info("per reference export of {} references took {:.2f} seconds".format(len(targets), clock() - start))
+
+    def get_frame_range(self):
+        return cmds.playbackOptions(q=True, ast=True), cmds.playbackOptions(q=True, aet=True)
+
+    def build_alembic_job(self, root, path, start_frame, end_frame, report_progress=True):
+        job = "-frameRange {s_frame} {e_frame} -uvWrite -writeFaceSets -writeVisibility -dataFormat ogawa -root {root} -file {path}".format(
+            root=root, path=path, s_frame=start_frame, e_frame=end_frame
         )
+        if report_progress:
+            job += " -pythonPerFrameCallback {}(#FRAME#)".format(PROGRESS_CALLBACK)
+
+        return job
 
-        cmds.AbcExport(cmd)
-        LOGGER.info("cache exported.")
+    def export_alembic(self, root, path, start_frame, end_frame):
+        cmds.AbcExport(j=self.build_alembic_job(root, path, start_frame, end_frame))
+        LOGGER.info("cache exported at {}".format(path))
 
     def export_camera_cache(self):
+        start = clock()
         formatter = {
             config.FormatterKeys.PROJ: self.project,
             config.FormatterKeys.EPI: self.episode,
@@ -130,13 +435,23 @@ class CacheExporter(object):
             config.FormatterKeys.NAME: "{}_{}.fbx".format(self.episode, self.shot),
             config.FormatterKeys.STAMP: "",
         }
-        cache_path = config.CACHE_OUTPUT.format(**formatter)
+        cache_path = config.CACHE_OUTPUT.format(**formatter).replace("\\", "/")
+        write_path = get_write_path(cache_path)
+        if write_path != cache_path:
+            report_scratch("Camera", cache_path, write_path, SCRATCH_WRITING)
 
-        dirname = os.path.dirname(cache_path)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        try:
+            dirname = os.path.dirname(write_path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
 
-        self.export_fbx(CAMERA_NAME, cache_path)
+            self.export_fbx(self.camera_name, write_path)
+            cache_manifest.write_manifest(write_path, [self.maya_file_path])
+        except Exception as err:
+            self.set_result("Camera", RESULT_ERROR, cache_path, clock() - start, str(err), write_path)
+            return
+
+        self.set_result("Camera", RESULT_DONE, cache_path, clock() - start, write_path=write_path)
 
     def export_fbx(self, node, path):
         cmds.select(node)
@@ -144,24 +459,30 @@ class CacheExporter(object):
         LOGGER.info("cache exported path: {}".format(path))
 
     def load_required_plugins(self):
-        cmds.loadPlugin("fbxmaya")
-        cmds.loadPlugin("AbcImport")
+        load_required_plugins()
 
     def doit(self):
-        self.load_required_plugins()
-        self.open_maya_file()
+        self.timed("load_required_plugins", self.load_required_plugins)
+        self.timed("open_maya_file", self.open_maya_file)
+        self.timed("load_references", self.load_references)
 
-        if not self.check_file():
-            os.environ["CACHE_MANAGER_PROCESS_EXPECTED_ERROR"] = "1"
-            raise Exception("skipping cache process")
+        if not self.timed("check_file", self.check_file):
+            self.expected_error = True
+            raise Exception("skipping cache process, nothing left to export")
 
-        for reference_node in self.reference_nodes:
-            LOGGER.info("exporting cache for {}".format(reference_node))
-            self.export_cache(reference_node)
+        LOGGER.info("exporting cache for {}".format(", ".join(self.reference_nodes)))
+        self.timed("export_caches", self.export_caches)
 
-        self.export_camera_cache()
+        if self.is_camera_cache and "Camera" not in self.results:
+            self.timed("export_camera_cache", self.export_camera_cache)
 
-        print config.SUCCESS_CODE
+        failed = [node for node, result in self.results.items() if result["status"] != RESULT_DONE]
+        if failed:
+            LOGGER.critical("cache failed for: {}".format(", ".join(failed)))
+
+        else:
+            print config.SUCCESS_CODE
+            sys.stdout.flush()
 
         LOGGER.info("-----------------------------------------------")
         LOGGER.info("-------------- MAYA PROCESS DONE --------------")
@@ -169,8 +490,8 @@ class CacheExporter(object):
 
 
 @utils.safe_run
-def main(project, episode, maya_file_path, reference_nodes, is_camera_cache):
-    reference_nodes = reference_nodes.split(",")
+def main(project, episode, maya_file_path, reference_nodes, is_camera_cache, result_path=""):
+    reference_nodes = [node for node in reference_nodes.split(",") if node]
     is_camera_cache = bool(int(is_camera_cache))
     LOGGER.info("argument get in maya\n\tproject:{}\n\tepisode:{}\n\tmaya_file_path:{}\n\treference_nodes:{}\n\tis_camera_cache:{}".format(
         project, episode, maya_file_path, reference_nodes, is_camera_cache
@@ -183,6 +504,128 @@ def main(project, episode, maya_file_path, reference_nodes, is_camera_cache):
     print "is_camera_cache:", is_camera_cache
 
     instance = CacheExporter(project, episode, maya_file_path, reference_nodes, is_camera_cache)
-    instance.doit()
-
-
+    try:
+        instance.doit()
+    except Exception as err:
+        instance.error = str(err)
+        if result_path:
+            instance.write_result(result_path)
+        instance.create_error_tag(instance.error.replace("\n", " "))
+        raise
+
+    if result_path:
+        instance.write_result(result_path)
+
+
+def get_write_path(output_path):
+    """
+    path the cache of output_path is exported to, its local scratch path if caches are published by the cache manager.
+    """
+    return publisher.get_scratch_path(output_path) if config.USE_LOCAL_SCRATCH else output_path
+
+
+def set_progress_context(label, start_frame, offset, total):
+    """
+    what the following frames of report_progress belong to, offset and total are counted in frames of the whole export.
+    """
+    _PROGRESS_CONTEXT.update({"label": label, "start": start_frame, "offset": offset, "total": total})
+
+
+def report_progress(frame):
+    """
+    AbcExport per frame callback, prints a progress event for maya_launcher on stdout.
+    """
+    done = _PROGRESS_CONTEXT["offset"] + int(frame - _PROGRESS_CONTEXT["start"]) + 1
+    print "{}{}".format(config.PROGRESS_TRACKER, json.dumps({
+        "reference": _PROGRESS_CONTEXT["label"],
+        "frame": frame,
+        "done": done,
+        "total": _PROGRESS_CONTEXT["total"],
+    }))
+    sys.stdout.flush()
+
+
+def report_scratch(reference_node, output_path, scratch_path, status, size=0):
+    """
+    prints a scratch event for maya_launcher on stdout, status is SCRATCH_WRITING before the export and the result
+    status after it. caches of a maya process that crashed before writing its result are recovered from them.
+    """
+    print "{}{}".format(config.SCRATCH_TRACKER, json.dumps({
+        "reference": reference_node,
+        "output_path": output_path,
+        "scratch_path": scratch_path,
+        "status": status,
+        "size": size,
+    }))
+    sys.stdout.flush()
+
+
+# AbcExport runs the callback in maya's __main__ namespace
+setattr(__main__, PROGRESS_CALLBACK, report_progress)
+
+
+def load_required_plugins():
+    for plugin in REQUIRED_PLUGINS:
+        if not cmds.pluginInfo(plugin, q=True, loaded=True):
+            cmds.loadPlugin(plugin)
+
+
+def reset_scene():
+    cmds.file(new=True, f=True)
+    cmds.flushUndo()
+
+
+def serve(port, max_jobs):
+    """
+    Worker mode - plugins are loaded once and the session is reused for many cache jobs.
+    requests are received as json lines from the cache manager on given local port,
+    the worker exits after max_jobs requests so maya memory is recycled.
+    """
+    port = int(port)
+    max_jobs = int(max_jobs)
+    LOGGER.info("starting maya worker on port: {}, max jobs: {}".format(port, max_jobs))
+
+    load_required_plugins()
+
+    connection = socket.create_connection(("127.0.0.1", port))
+    reader = connection.makefile("r")
+
+    jobs_done = 0
+    while jobs_done < max_jobs:
+        line = reader.readline()
+        if not line:
+            LOGGER.info("cache manager closed the connection")
+            break
+
+        request = json.loads(line)
+        if request.get("command") == "quit":
+            break
+
+        LOGGER.info("worker request: {}".format(request))
+        instance = CacheExporter(request["project"],
+                                 request["episode"],
+                                 request["maya_file_path"],
+                                 request["reference_nodes"],
+                                 request["is_camera_cache"])
+        try:
+            instance.doit()
+
+        except Exception as err:
+            LOGGER.critical("Traceback:\n{}".format(traceback.format_exc()))
+            instance.error = str(err)
+
+        result = instance.get_result()
+        response = {"status": result["success"], "error": result["error"], "result": result}
+
+        try:
+            reset_scene()
+        except Exception:
+            LOGGER.critical("unable to reset scene, recycling worker:\n{}".format(traceback.format_exc()))
+            jobs_done = max_jobs
+
+        jobs_done += 1
+        connection.sendall(json.dumps(response) + "\n")
+
+    reader.close()
+    connection.close()
+    LOGGER.info("maya worker stopped after {} jobs".format(jobs_done))
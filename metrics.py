@@ -0,0 +1,255 @@
+"""
+local store of the phase timings reported by maya_operations for every maya process.
+
+    python metrics.py report [--episode Ep101] [--days 7]
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import collections
+import config
+if __name__ == '__main__':
+    # the command line logs next to the database, maya_launcher keeps the log of the cache manager
+    os.environ.setdefault(config.LOG_PATH_ENV, os.path.join(os.path.dirname(config.METRICS_PATH), "metrics.log"))
+import app_logger
+import utils
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+# maya startup and reference exports are stored next to the phases of CacheExporter
+STARTUP_PHASE = "maya_startup"
+REFERENCE_PHASE = "reference_export"
+# phases timed inside other phases, left out of the share of an episode's time
+NESTED_PHASES = (REFERENCE_PHASE, "single_pass_alembic")
+# phases making up the time to a scene ready for export, compared between the open modes of maya_operations
+OPEN_PHASES = ("open_maya_file", "load_references")
+
+# columns added after the first release of the runs table
+RUN_COLUMNS = [("open_mode", "TEXT DEFAULT 'full'"), ("skipped_references", "INTEGER DEFAULT 0")]
+
+
+def percentile(values, fraction):
+    """
+    nearest rank percentile of given values, fraction between 0 and 1.
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class MetricsStore(object):
+    """
+    runs hold one row per maya process, phases its timed phases and references every exported reference.
+    """
+
+    def __init__(self, path=config.METRICS_PATH):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = utils.connect_sqlite(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, project TEXT, "
+                "episode TEXT, maya_file_path TEXT, mode TEXT, success INTEGER, total REAL, output_bytes INTEGER, "
+                "reference_count INTEGER)"
+            )
+            self._connection.execute("CREATE TABLE IF NOT EXISTS phases (run_id INTEGER, phase TEXT, seconds REAL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reference_exports (run_id INTEGER, reference_node TEXT, status TEXT, "
+                "seconds REAL, bytes INTEGER)"
+            )
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(runs)")]
+            for column, definition in RUN_COLUMNS:
+                if column not in columns:
+                    self._connection.execute("ALTER TABLE runs ADD COLUMN {} {}".format(column, definition))
+            self._connection.execute("CREATE INDEX IF NOT EXISTS runs_time ON runs (time)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS phases_run ON phases (run_id)")
+            self._connection.commit()
+
+        return self._connection
+
+    def record(self, project, episode, maya_file_path, mode, result, launched, finished):
+        """
+        store the timings of one maya process.
+
+        :type result: maya_launcher.CacheResult
+        :param launched: wall clock time the process was launched or the job was sent to a worker
+        :param finished: wall clock time the result was read back
+        """
+        timings = result.timings or {}
+        phases = dict(timings.get("phases", {}))
+        if timings.get("started_at"):
+            phases[STARTUP_PHASE] = max(0.0, timings["started_at"] - launched)
+
+        try:
+            with self._lock:
+                connection = self._connect()
+                cursor = connection.execute(
+                    "INSERT INTO runs (time, project, episode, maya_file_path, mode, success, total, output_bytes, "
+                    "reference_count, open_mode, skipped_references) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (finished, project, episode, maya_file_path, mode, int(result.success), finished - launched,
+                     timings.get("output_bytes", 0), len(result.references), timings.get("open_mode", "full"),
+                     timings.get("skipped_references", 0))
+                )
+                run_id = cursor.lastrowid
+                connection.executemany("INSERT INTO phases VALUES (?, ?, ?)",
+                                       [(run_id, phase, seconds) for phase, seconds in phases.items()])
+                connection.executemany("INSERT INTO reference_exports VALUES (?, ?, ?, ?, ?)",
+                                       [(run_id, node, reference.get("status"), reference.get("duration", 0.0),
+                                         reference.get("size", 0)) for node, reference in result.references.items()])
+                connection.commit()
+
+        except sqlite3.Error as err:
+            LOGGER.warning("unable to store metrics: {}".format(err))
+
+    def get_phase_timings(self, episode=None, since=None):
+        """
+        [(episode, phase, seconds)] of every stored run, reference exports as REFERENCE_PHASE.
+        references exported in a single pass have no time of their own and are left out.
+
+        :rtype: list[tuple]
+        """
+        conditions, parameters = ["1"], []
+        if episode:
+            conditions.append("runs.episode=?")
+            parameters.append(episode)
+        if since:
+            conditions.append("runs.time>=?")
+            parameters.append(since)
+
+        where = " AND ".join(conditions)
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute("SELECT runs.episode, phase, seconds FROM phases JOIN runs ON runs.id=run_id "
+                                      "WHERE {}".format(where), parameters).fetchall()
+            rows += connection.execute("SELECT runs.episode, ?, seconds FROM reference_exports JOIN runs ON runs.id=run_id "
+                                       "WHERE status='done' AND seconds IS NOT NULL AND {}".format(where), [REFERENCE_PHASE] + parameters).fetchall()
+
+        return rows
+
+    def get_summary(self, episode=None, since=None):
+        """
+        count, p50, p95 and total seconds of every phase.
+
+        :rtype: dict
+        """
+        by_phase = collections.defaultdict(list)
+        for _, phase, seconds in self.get_phase_timings(episode, since):
+            by_phase[phase].append(seconds)
+
+        return dict((phase, {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "total": sum(values),
+        }) for phase, values in by_phase.items())
+
+    def get_open_summary(self, episode=None, since=None):
+        """
+        runs, p50 and p95 seconds until the scene is ready for export and mean skipped references of every open mode.
+
+        :rtype: dict
+        """
+        conditions, parameters = ["phase IN ({})".format(", ".join("?" * len(OPEN_PHASES)))], list(OPEN_PHASES)
+        if episode:
+            conditions.append("runs.episode=?")
+            parameters.append(episode)
+        if since:
+            conditions.append("runs.time>=?")
+            parameters.append(since)
+
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT open_mode, SUM(seconds), skipped_references FROM phases JOIN runs ON runs.id=run_id "
+                "WHERE {} GROUP BY run_id".format(" AND ".join(conditions)), parameters
+            ).fetchall()
+
+        by_mode = collections.defaultdict(list)
+        for open_mode, seconds, skipped in rows:
+            by_mode[open_mode].append((seconds, skipped))
+
+        return dict((open_mode, {
+            "count": len(values),
+            "p50": percentile([seconds for seconds, _ in values], 0.5),
+            "p95": percentile([seconds for seconds, _ in values], 0.95),
+            "skipped": sum(skipped for _, skipped in values) / float(len(values)),
+        }) for open_mode, values in by_mode.items())
+
+    def get_slowest_phases(self, since=None, limit=3):
+        """
+        phases taking most of the time of every episode, (phase, total seconds, share of the episode) each.
+
+        :rtype: dict
+        """
+        totals = collections.defaultdict(lambda: collections.defaultdict(float))
+        for episode, phase, seconds in self.get_phase_timings(since=since):
+            # exports are timed as a phase and per reference, only the phase counts towards the share
+            if phase not in NESTED_PHASES:
+                totals[episode][phase] += seconds
+
+        slowest = {}
+        for episode, phases in totals.items():
+            episode_total = sum(phases.values()) or 1.0
+            ordered = sorted(phases.items(), key=lambda item: item[1], reverse=True)[:limit]
+            slowest[episode] = [(phase, seconds, seconds / episode_total) for phase, seconds in ordered]
+
+        return slowest
+
+
+def print_report(store, episode=None, days=None):
+    since = time.time() - days * 24 * 60 * 60 if days else None
+
+    sys.stdout.write("{:<24} {:>8} {:>10} {:>10} {:>12}\n".format("phase", "count", "p50 s", "p95 s", "total s"))
+    summary = store.get_summary(episode, since)
+    for phase, values in sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True):
+        sys.stdout.write("{:<24} {count:>8} {p50:>10.2f} {p95:>10.2f} {total:>12.1f}\n".format(phase, **values))
+
+    open_summary = store.get_open_summary(episode, since)
+    if open_summary:
+        sys.stdout.write("\n{:<24} {:>8} {:>10} {:>10} {:>12}\n".format("open mode", "count", "p50 s", "p95 s", "skipped refs"))
+        for open_mode, values in sorted(open_summary.items()):
+            sys.stdout.write("{:<24} {count:>8} {p50:>10.2f} {p95:>10.2f} {skipped:>12.1f}\n".format(open_mode, **values))
+
+        if len(open_summary) > 1 and "full" in open_summary:
+            for open_mode, values in sorted(open_summary.items()):
+                if open_mode != "full":
+                    sys.stdout.write("{} open saves {:.2f}s per file at p50\n".format(
+                        open_mode, open_summary["full"]["p50"] - values["p50"]))
+
+    sys.stdout.write("\nslowest phases by episode\n")
+    for each_episode, phases in sorted(store.get_slowest_phases(since).items()):
+        if episode and each_episode != episode:
+            continue
+
+        sys.stdout.write("{:<12} {}\n".format(each_episode, ", ".join(
+            "{} {:.0f}s ({:.0%})".format(phase, seconds, share) for phase, seconds, share in phases
+        )))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="maya process phase timings")
+    parser.add_argument("--metrics", default=config.METRICS_PATH, help="metrics database, default: %(default)s")
+    commands = parser.add_subparsers(dest="command")
+    report_parser = commands.add_parser("report", help="p50/p95 per phase and slowest phases by episode")
+    report_parser.add_argument("--episode")
+    report_parser.add_argument("--days", type=float, help="only runs of the last given days")
+
+    args = parser.parse_args(argv)
+    if args.command == "report":
+        print_report(MetricsStore(args.metrics), args.episode, args.days)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
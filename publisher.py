@@ -0,0 +1,320 @@
+"""
+copies caches from the local scratch folder, where maya exports them, to the network share.
+
+    publish_file(scratch_path, output_path)
+
+a cache is copied next to its output path with large sequential writes, checked for size and checksum
+and renamed into place, its manifest follows it so a published manifest always describes a complete cache.
+"""
+import os
+import sys
+import time
+import ctypes
+import hashlib
+import tempfile
+import threading
+import config
+import app_logger
+import cache_manifest
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+PARTIAL_SUFFIX = ".publishing"
+
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+_STOP = object()
+
+
+class PublishError(Exception):
+    pass
+
+
+def get_scratch_path(output_path, scratch_root=None):
+    """
+    local scratch path of given network output path, W:/a/b.abc is written to <scratch>/W/a/b.abc.
+    """
+    relative = output_path.replace("\\", "/").replace(":", "").lstrip("/")
+    return os.path.join(scratch_root or config.LOCAL_SCRATCH, relative).replace("\\", "/")
+
+
+def replace_file(source, destination):
+    """
+    rename source over destination in one step, python 2 has no os.replace.
+    """
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+
+    elif os.name == "nt":
+        encoding = sys.getfilesystemencoding()
+        source, destination = [path.decode(encoding) if isinstance(path, bytes) else path for path in (source, destination)]
+        if not ctypes.windll.kernel32.MoveFileExW(source, destination, MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+
+    else:
+        os.rename(source, destination)
+
+
+def get_checksum(path, buffer_size=config.PUBLISH_BUFFER_SIZE):
+    checksum = hashlib.md5()
+    with open(path, "rb") as fr:
+        for chunk in iter(lambda: fr.read(buffer_size), b""):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def copy_file(source, destination, buffer_size=config.PUBLISH_BUFFER_SIZE, verify=config.PUBLISH_VERIFY_CHECKSUM):
+    """
+    copy source to a partial file next to destination, check it and rename it over destination.
+    """
+    dirname = os.path.dirname(destination)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # created by another publisher in the meantime
+            if not os.path.isdir(dirname):
+                raise
+
+    handle, partial_path = tempfile.mkstemp(prefix=os.path.basename(destination) + ".", suffix=PARTIAL_SUFFIX, dir=dirname)
+    try:
+        checksum = hashlib.md5()
+        with open(source, "rb") as fr:
+            with os.fdopen(handle, "wb") as fw:
+                for chunk in iter(lambda: fr.read(buffer_size), b""):
+                    checksum.update(chunk)
+                    fw.write(chunk)
+
+                fw.flush()
+                os.fsync(fw.fileno())
+
+        source_size, partial_size = os.path.getsize(source), os.path.getsize(partial_path)
+        if source_size != partial_size:
+            raise PublishError("size mismatch, {} bytes written of {}".format(partial_size, source_size))
+
+        if verify and get_checksum(partial_path, buffer_size) != checksum.hexdigest():
+            raise PublishError("checksum mismatch")
+
+        replace_file(partial_path, destination)
+
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+
+def publish_manifest(scratch_path, output_path):
+    """
+    write the manifest of the scratch cache next to the published cache, with the fingerprint of the published file.
+    """
+    manifest = cache_manifest.read_manifest(scratch_path)
+    if manifest is None:
+        return
+
+    manifest["output"] = cache_manifest.get_fingerprint(output_path)
+    scratch_manifest = cache_manifest.get_manifest_path(scratch_path)
+    cache_manifest.write_manifest_data(scratch_manifest, manifest)
+    copy_file(scratch_manifest, cache_manifest.get_manifest_path(output_path))
+
+
+def publish_file(scratch_path, output_path, retries=config.PUBLISH_RETRIES):
+    """
+    publish a cache and its manifest, the scratch files are removed once published.
+    """
+    for attempt in range(retries + 1):
+        try:
+            start = time.time()
+            copy_file(scratch_path, output_path)
+            publish_manifest(scratch_path, output_path)
+            LOGGER.info("published {} in {:.2f} seconds".format(output_path, time.time() - start))
+            break
+
+        except (IOError, OSError, PublishError) as err:
+            if attempt == retries:
+                raise PublishError("unable to publish {}: {}".format(output_path, err))
+
+            LOGGER.warning("publishing {} failed, retrying: {}".format(output_path, err))
+            time.sleep(2 ** attempt)
+
+    discard(scratch_path)
+
+
+def discard(scratch_path):
+    """
+    remove a scratch cache, its manifest and the folders left empty.
+    """
+    for path in (scratch_path, cache_manifest.get_manifest_path(scratch_path)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    remove_empty_dirs(os.path.dirname(scratch_path))
+
+
+def remove_empty_dirs(dirname, scratch_root=None):
+    root = os.path.normpath(scratch_root or config.LOCAL_SCRATCH)
+    dirname = os.path.normpath(dirname)
+    while dirname != root and dirname.startswith(root):
+        try:
+            os.rmdir(dirname)
+        except OSError:
+            return
+        dirname = os.path.dirname(dirname)
+
+
+def remove_stale_files(scratch_root=None, max_age_hours=config.SCRATCH_MAX_AGE_HOURS):
+    """
+    remove scratch files older than max_age_hours, left behind when the cache manager stopped before publishing them.
+    caches of maya processes which crashed are published or removed right away, see maya_launcher.recover_scratch.
+    """
+    scratch_root = scratch_root or config.LOCAL_SCRATCH
+    oldest = time.time() - max_age_hours * 60 * 60
+    for dirname, _, filenames in os.walk(scratch_root, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirname, filename)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+                    LOGGER.info("removed stale scratch file: {}".format(path))
+            except OSError:
+                pass
+
+        remove_empty_dirs(dirname, scratch_root)
+
+
+class PublishTask(object):
+    """
+    one cache to publish, on_done(task) is called from the publisher thread once it is published or failed.
+    """
+
+    def __init__(self, scratch_path, output_path, on_done=None):
+        self.scratch_path = scratch_path
+        self.output_path = output_path
+        self.on_done = on_done
+        self.error = ""
+        self.duration = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        start = time.time()
+        try:
+            publish_file(self.scratch_path, self.output_path)
+        except Exception as err:
+            self.error = str(err)
+            LOGGER.critical(self.error)
+            discard(self.scratch_path)
+        finally:
+            self.duration = time.time() - start
+            self._done.set()
+
+        if self.on_done:
+            try:
+                self.on_done(self)
+            except Exception as err:
+                LOGGER.warning("publish callback of {} failed: {}".format(self.output_path, err))
+
+    def wait(self):
+        """
+        :return: error message, empty if published
+        :rtype: str
+        """
+        self._done.wait()
+        return self.error
+
+
+class Publisher(object):
+    """
+    Background threads publishing scratch caches, at most `workers` files are written to the share at the same time
+    however many jobs run in parallel.
+    """
+
+    def __init__(self, workers=config.PUBLISH_WORKERS):
+        self.workers = max(1, int(workers))
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+
+            remove_stale_files()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name="publisher_{}".format(index))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is _STOP:
+                return
+            task.run()
+
+    def submit(self, scratch_path, output_path, on_done=None):
+        """
+        :rtype: PublishTask
+        """
+        self.start()
+        task = PublishTask(scratch_path, output_path, on_done)
+        self._queue.put(task)
+        return task
+
+    def publish(self, files):
+        """
+        publish (scratch path, output path) pairs and wait for them.
+
+        :return: error message of every failed output path
+        :rtype: dict
+        """
+        tasks = [self.submit(scratch_path, output_path) for scratch_path, output_path in files]
+        return dict((task.output_path, task.wait()) for task in tasks if task.wait())
+
+    def publish_async(self, files, on_published):
+        """
+        publish (scratch path, output path) pairs without waiting, on_published(errors) is called from a publisher
+        thread once all of them are done, errors as returned by publish.
+        """
+        files = list(files)
+        if not files:
+            on_published({})
+            return
+
+        remaining = [len(files)]
+        errors = {}
+        lock = threading.Lock()
+
+        def on_done(task):
+            with lock:
+                if task.error:
+                    errors[task.output_path] = task.error
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+
+            on_published(errors)
+
+        for scratch_path, output_path in files:
+            self.submit(scratch_path, output_path, on_done)
+
+    def shutdown(self):
+        with self._lock:
+            threads = list(self._threads)
+            del self._threads[:]
+
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join()
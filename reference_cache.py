@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import config
+import app_logger
+import file_parser
+import utils
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+# bump when file_parser output changes, older cache rows are dropped.
+SCHEMA_VERSION = 2
+
+
+class ReferenceCache(object):
+    """
+    Persistent cache of parsed .ma reference headers.
+    a row is valid only while path, mtime and size of the maya file are unchanged,
+    least recently used rows are evicted once the cache grows over max_entries.
+    """
+
+    def __init__(self, path=config.REFERENCE_CACHE_PATH, max_entries=config.REFERENCE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = utils.connect_sqlite(self.path)
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self._connection.execute("DROP TABLE IF EXISTS reference_info")
+                self._connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reference_info "
+                "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, data TEXT, accessed REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS reference_info_accessed ON reference_info (accessed)")
+            self._connection.commit()
+
+        return self._connection
+
+    def get_reference_info(self, maya_file_path):
+        """
+        same result as file_parser.get_reference_info_from_file, parsing only files changed since last call.
+
+        :param maya_file_path:
+        :type maya_file_path: str
+        :rtype: list[dict]
+        """
+        stat = os.stat(maya_file_path)
+        try:
+            with self._lock:
+                connection = self._connect()
+                row = connection.execute("SELECT mtime, size, data FROM reference_info WHERE path=?",
+                                         (maya_file_path,)).fetchone()
+                if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+                    self.hits += 1
+                    connection.execute("UPDATE reference_info SET accessed=? WHERE path=?", (time.time(), maya_file_path))
+                    connection.commit()
+                    return json.loads(row[2])
+
+        except sqlite3.Error as err:
+            LOGGER.warning("reference cache unavailable, parsing file: {}".format(err))
+            return file_parser.get_reference_info_from_file(maya_file_path)
+
+        reference_data = file_parser.get_reference_info_from_file(maya_file_path)
+        try:
+            with self._lock:
+                self.misses += 1
+                connection = self._connect()
+                connection.execute("INSERT OR REPLACE INTO reference_info VALUES (?, ?, ?, ?, ?)",
+                                   (maya_file_path, stat.st_mtime, stat.st_size, json.dumps(reference_data), time.time()))
+                connection.commit()
+
+        except sqlite3.Error as err:
+            LOGGER.warning("unable to write reference cache: {}".format(err))
+
+        return reference_data
+
+    def evict(self):
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute("SELECT COUNT(*) FROM reference_info").fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+
+            connection.execute(
+                "DELETE FROM reference_info WHERE path IN "
+                "(SELECT path FROM reference_info ORDER BY accessed LIMIT ?)", (count - self.max_entries,)
+            )
+            connection.commit()
+            return count - self.max_entries
+
+    def log_stats(self):
+        """
+        log hit/miss counters since last call and evict rows over the size cap.
+        """
+        try:
+            evicted = self.evict()
+        except sqlite3.Error as err:
+            LOGGER.warning("unable to evict reference cache: {}".format(err))
+            evicted = 0
+
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+
+        LOGGER.info("reference cache hits: {}, misses: {}, evicted: {}".format(hits, misses, evicted))
+
+
+REFERENCE_CACHE = ReferenceCache()
+
+
+def get_reference_info(maya_file_path):
+    if not config.REFERENCE_CACHE_PATH:
+        return file_parser.get_reference_info_from_file(maya_file_path)
+
+    return REFERENCE_CACHE.get_reference_info(maya_file_path)
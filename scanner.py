@@ -0,0 +1,117 @@
+import os
+import sys
+import fnmatch
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+_STOP = object()
+
+
+class _DirEntry(object):
+    """
+    os.DirEntry stand-in for pythons without scandir, is_dir() costs one stat call here.
+    """
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def iter_dir(directory):
+    """
+    yield directory entries, with scandir the type of each entry comes with the listing itself
+    so no extra round trip to the network share is needed.
+    """
+    if scandir is None:
+        for name in os.listdir(directory):
+            yield _DirEntry(directory, name)
+        return
+
+    for entry in scandir(directory):
+        yield entry
+
+
+def stat_matching_files(directory, pattern):
+    """
+    (mtime, size) of files in given directory with name matching the glob pattern, keyed by path.
+    on windows scandir returns the stat data with the listing, no extra call per file.
+
+    :rtype: dict
+    """
+    files = {}
+    for entry in iter_dir(directory):
+        if fnmatch.fnmatch(entry.name, pattern):
+            stat = entry.stat()
+            files[entry.path.replace("\\", "/")] = (stat.st_mtime, stat.st_size)
+
+    return files
+
+
+def parallel_imap(function, iterable, workers):
+    """
+    yield function(item) for each item of iterable as soon as it is finished, in completion order.
+    items are consumed lazily so parallel_imap calls can be chained into a pipeline.
+    an exception raised by function or iterable is raised again here.
+    """
+    workers = max(1, int(workers))
+    inputs = queue.Queue()
+    outputs = queue.Queue()
+
+    def feed():
+        try:
+            for item in iterable:
+                inputs.put(item)
+        except Exception:
+            outputs.put((False, sys.exc_info()[1]))
+        finally:
+            for _ in range(workers):
+                inputs.put(_STOP)
+
+    def work():
+        while True:
+            item = inputs.get()
+            if item is _STOP:
+                outputs.put(_STOP)
+                return
+
+            try:
+                outputs.put((True, function(item)))
+            except Exception:
+                outputs.put((False, sys.exc_info()[1]))
+
+    threads = [threading.Thread(target=feed)] + [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    finished = 0
+    while finished < workers:
+        result = outputs.get()
+        if result is _STOP:
+            finished += 1
+            continue
+
+        is_success, value = result
+        if not is_success:
+            raise value
+
+        yield value
@@ -0,0 +1,179 @@
+import os
+import time
+import threading
+import config
+import app_logger
+import core
+import file_parser
+import scanner
+
+
+LOGGER = app_logger.get_logger(__name__)
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+class Scheduler(object):
+    """
+    Shortest job first ordering of job groups, pinned jobs run first.
+    the cost of a launch is the median past duration of its file in the job store scaled to its reference count,
+    or, for a file without history, estimated from its reference count, frame range and file size:
+
+        launch overhead + file size * seconds per megabyte + references * frames * seconds per reference frame
+
+    seconds per reference frame is calibrated from the history of the scheduled files and every finished launch.
+    """
+
+    def __init__(self, store=None, pool_size=config.JOB_POOL_SIZE):
+        self.store = store  # type: job_store.JobStore
+        self.pool_size = max(1, int(pool_size))
+        self.launch_overhead = config.SCHEDULER_LAUNCH_OVERHEAD
+        self.seconds_per_megabyte = config.SCHEDULER_SECONDS_PER_MEGABYTE
+        self.seconds_per_reference_frame = config.SCHEDULER_SECONDS_PER_REFERENCE_FRAME
+
+        self._features = {}
+        self._history = {}
+        self._rate_samples = []
+        self._lock = threading.Lock()
+
+    def get_features(self, maya_file_path):
+        """
+        (frame count, file size in megabytes) of given maya file, read once per file.
+
+        :rtype: (float, float)
+        """
+        if maya_file_path not in self._features:
+            try:
+                size = os.path.getsize(maya_file_path) / (1024.0 * 1024.0)
+                frame_range = file_parser.get_frame_range_from_file(maya_file_path)
+            except (IOError, OSError) as err:
+                LOGGER.warning("unable to read {}: {}".format(maya_file_path, err))
+                size, frame_range = 0.0, None
+
+            frame_count = frame_range[1] - frame_range[0] + 1 if frame_range else config.SCHEDULER_DEFAULT_FRAME_COUNT
+            self._features[maya_file_path] = (max(1.0, frame_count), size)
+
+        return self._features[maya_file_path]
+
+    def prepare(self, groups):
+        """
+        read features of the scheduled files in parallel and calibrate the cost model from their history.
+
+        :type groups: list[core.JobGroup]
+        """
+        file_paths = [group.file_path for group in groups if group.file_path not in self._features]
+        list(scanner.parallel_imap(self.get_features, file_paths, config.SCAN_WORKERS))
+
+        if self.store is None:
+            return
+
+        for group in groups:
+            if group.file_path in self._history:
+                continue
+
+            timings = [timing for timing in self.store.get_timings(group.file_path) if timing["status"] == core.Job.DONE]
+            self._history[group.file_path] = [(timing["duration"], timing["reference_count"]) for timing in timings]
+            for duration, reference_count in self._history[group.file_path]:
+                self.add_rate_sample(group.file_path, duration, reference_count)
+
+    def add_rate_sample(self, maya_file_path, duration, reference_count):
+        frame_count, size = self.get_features(maya_file_path)
+        work = reference_count * frame_count
+        if work <= 0:
+            return
+
+        rate = (duration - self.launch_overhead - size * self.seconds_per_megabyte) / work
+        if rate > 0:
+            with self._lock:
+                self._rate_samples.append(rate)
+                del self._rate_samples[:-config.SCHEDULER_RATE_SAMPLES]
+                self.seconds_per_reference_frame = median(self._rate_samples)
+
+    def estimate(self, maya_file_path, reference_count):
+        """
+        estimated seconds of one launch exporting reference_count references of given file.
+
+        :rtype: float
+        """
+        history = self._history.get(maya_file_path)
+        if history:
+            # past durations of the file scaled to the reference count of this launch
+            return median([duration * reference_count / max(1, count) for duration, count in history])
+
+        frame_count, size = self.get_features(maya_file_path)
+        return (self.launch_overhead
+                + size * self.seconds_per_megabyte
+                + reference_count * frame_count * self.seconds_per_reference_frame)
+
+    def estimate_group(self, group):
+        """
+        :type group: core.JobGroup
+        :rtype: float
+        """
+        reference_keys = set()
+        for job in group.jobs:
+            references = job.reference_to_cache if job.retry_references is None else job.retry_references
+            reference_keys.update(core.get_result_key(ref) for ref in references)
+
+        return self.estimate(group.file_path, len(reference_keys))
+
+    def order(self, groups):
+        """
+        groups with pinned jobs first, highest priority first, then the cheapest first.
+
+        :type groups: list[core.JobGroup]
+        :rtype: list[core.JobGroup]
+        """
+        self.prepare(groups)
+        costs = dict((id(group), self.estimate_group(group)) for group in groups)
+        return sorted(groups, key=lambda group: (-max(job.priority for job in group.jobs), costs[id(group)]))
+
+    def record(self, group, duration):
+        """
+        recalibrate with a finished launch.
+
+        :type group: core.JobGroup
+        """
+        if not all(job.status == core.Job.DONE for job in group.jobs):
+            return
+
+        reference_count = len(set(core.get_result_key(ref) for job in group.jobs for ref in job.sent_references))
+        if not reference_count:
+            return
+
+        self._history.setdefault(group.file_path, []).append((duration, reference_count))
+        self.add_rate_sample(group.file_path, duration, reference_count)
+
+    def update_etas(self, pending, running=None):
+        """
+        simulate the pool running given groups in order, every job gets its estimate and seconds until it is done.
+        running maps running groups to their start time.
+
+        :type pending: list[core.JobGroup]
+        :type running: dict
+        :return: seconds until the whole queue is done
+        :rtype: float
+        """
+        now = time.time()
+        workers = []
+        for group, started in (running or {}).items():
+            remaining = max(0.0, self.estimate_group(group) - (now - started))
+            etas = [job.eta for job in group.jobs if job.eta >= 0]
+            workers.append(min(etas) if etas else remaining)
+
+        workers.extend([0.0] * max(0, self.pool_size - len(workers)))
+        for group in pending:
+            cost = self.estimate_group(group)
+            index = workers.index(min(workers))
+            workers[index] += cost
+            for job in group.jobs:
+                job.set_estimate(cost, workers[index])
+
+        return max(workers) if workers else 0.0
@@ -1,4 +1,5 @@
 import os
+import sqlite3
 from functools import wraps
 import app_logger
 import traceback
@@ -20,3 +21,19 @@ def safe_run(function):
             raise Exception(str(err))
 
     return wrapper
+
+
+def connect_sqlite(path, journal_mode="WAL"):
+    """
+    sqlite connection shared between threads, callers guard it with their own lock.
+    write-ahead logging keeps readers from blocking on writers, it needs every client on the same machine,
+    databases on a network share use journal_mode="DELETE".
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode={}".format(journal_mode))
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
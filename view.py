@@ -5,11 +5,16 @@ from functools import partial
 import datetime
 import subprocess
 import threading
+import multiprocessing
 import config
 LOG_PATH = config.LOGGING_PATH.format(**{config.FormatterKeys.STAMP: datetime.datetime.now().strftime("%Y_%m_%d__%H_%M_%S")})
 os.environ[config.LOG_PATH_ENV] = LOG_PATH
 from ui import cache_manager_ui
 import core
+import job_broker
+import job_store
+import scheduler
+import maya_launcher
 import app_logger
 import utils
 
@@ -25,8 +30,11 @@ class CustomFileView(QtWidgets.QListWidgetItem):
         super(CustomFileView, self).__init__()
         self.maya_file = maya_file
 
-        self.setText(self.maya_file.display)
         self.setToolTip(self.maya_file.file_path)
+        self.refresh()
+
+    def refresh(self):
+        self.setText(self.maya_file.display)
 
 
 class CustomReferencesView(QtWidgets.QListWidgetItem):
@@ -51,6 +59,7 @@ class SortType(object):
     DEFAULT = "default"
     STATUS = "status"
     FILE_NAME = "file_name"
+    ESTIMATE = "estimate"
 
 
 class CustomJobView(QtWidgets.QListWidgetItem):
@@ -65,10 +74,37 @@ class CustomJobView(QtWidgets.QListWidgetItem):
 
         self.change_color(self.job_instance.status)
         self.job_instance.SIGNAL.connect(self.change_color)
+        self.job_instance.PROGRESS_SIGNAL.connect(self.update_progress)
+        self.job_instance.ESTIMATE_SIGNAL.connect(self.update_estimate)
+        if self.job_instance.estimate >= 0:
+            self.update_estimate(self.job_instance.estimate, self.job_instance.queue_eta)
+
+    def update_progress(self, progress, eta):
+        text = "{} | {:.0f}%".format(self.job_instance.display_name, progress * 100)
+        if eta >= 0:
+            text += " | ETA {}".format(datetime.timedelta(seconds=int(eta)))
+
+        self.setText(text)
+
+    def update_estimate(self, estimate, queue_eta):
+        if self.job_instance.status != core.Job.IN_QUEUE:
+            return
+
+        self.setText("{}{} | est {} | done in {}".format(self.job_instance.display_name,
+                                                        " | pinned" if self.job_instance.priority else "",
+                                                        datetime.timedelta(seconds=int(estimate)),
+                                                        datetime.timedelta(seconds=int(queue_eta))))
 
     def change_color(self, status):
+        if status != core.Job.IP:
+            self.setText(self.job_instance.display_name)
+
+        self.setToolTip(self.job_instance.tool_tip)
+
         if status == core.Job.IP:
             self.setBackgroundColor("#e8e846")
+        elif status == core.Job.PUBLISHING:
+            self.setBackgroundColor("#9ee846")
         elif status == core.Job.DONE:
             self.setBackgroundColor("#4fdb58")
         elif status == core.Job.ERROR:
@@ -78,20 +114,34 @@ class CustomJobView(QtWidgets.QListWidgetItem):
 
 
 class JobRunner(threading.Thread):
-    def __init__(self, job_signal):
+    def __init__(self, job_signal, count_signal, pool_size=config.JOB_POOL_SIZE, job_scheduler=None, eta_signal=None):
         super(JobRunner, self).__init__()
         self.job_signal = job_signal
+        self.count_signal = count_signal
+        self.pool_size = pool_size
+        self.job_scheduler = job_scheduler
+        self.eta_signal = eta_signal
         self.jobs_to_run = []
 
     def run(self):
         self.job_signal.emit(True)
-        for job in self.jobs_to_run:
-            job.execute()
+        pool = core.JobPool(self.pool_size,
+                            self.count_signal.emit,
+                            self.job_scheduler,
+                            self.eta_signal.emit if self.eta_signal else None)
+        pool.run(self.jobs_to_run)
         self.job_signal.emit(False)
 
 
 class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
     IS_JOB_RUNNING = QtCore.Signal(bool)
+    JOB_COUNT_CHANGED = QtCore.Signal(int, int)
+    QUEUE_ETA_CHANGED = QtCore.Signal(float)
+    REFERENCES_LOADED = QtCore.Signal(object)
+    FILES_CHANGED = QtCore.Signal(object, object)
+    BROKER_POLLED = QtCore.Signal(object)
+    JOBS_RESTORED = QtCore.Signal(object, object)
+    JOBS_ORDERED = QtCore.Signal(object, float)
 
     @utils.safe_run
     def __init__(self):
@@ -99,18 +149,75 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         self.setupUi(self)
 
         self.setWindowTitle("Cache Manager")
+        self.setup_status_bar()
 
         self.populate_projects()
         self.on_project_change()
         self.connect_events()
 
-        self.all_jobs_queue = []
+        self.all_jobs_queue = core.JobQueue()
+        self.file_items = {}
+        self.episode_index = None  # type: core.Episode
+        self.prefetchers = []
+        self.is_refreshing = False
+        self.broker = None  # type: job_broker.Broker
+        self.broker_jobs = {}
+        self.is_polling_broker = False
+        self.broker_timer = QtCore.QTimer(self)
+        self.broker_timer.timeout.connect(self.poll_broker)
+        self.job_store = job_store.JobStore()
+        self.job_scheduler = scheduler.Scheduler(self.job_store)
+        self.restore_jobs()
         LOGGER.info("cache manager open successfully")
 
         if not os.path.exists(config.MAYA_BATCH):
             QtWidgets.QMessageBox.warning(self, "Maya Not Found", "Maya 2020 not found, Tool can't run.")
             self.close()
 
+    def setup_status_bar(self):
+        self.queue_count_label = QtWidgets.QLabel()
+        self.queue_eta_label = QtWidgets.QLabel()
+        self.update_queue_count(0, 0)
+
+        self.pool_size_spin = QtWidgets.QSpinBox()
+        self.pool_size_spin.setRange(1, max(multiprocessing.cpu_count(), config.JOB_POOL_SIZE))
+        self.pool_size_spin.setValue(config.JOB_POOL_SIZE)
+        self.pool_size_spin.setToolTip("number of maya processes run at once")
+
+        self.auto_refresh_check = QtWidgets.QCheckBox("Auto refresh every")
+        self.auto_refresh_check.setChecked(config.AUTO_RESCAN)
+        self.refresh_interval_spin = QtWidgets.QSpinBox()
+        self.refresh_interval_spin.setRange(10, 3600)
+        self.refresh_interval_spin.setSuffix(" s")
+        self.refresh_interval_spin.setValue(config.RESCAN_INTERVAL)
+
+        self.rescan_timer = QtCore.QTimer(self)
+        self.rescan_timer.timeout.connect(partial(self.refresh_files, False))
+        self.update_rescan_timer()
+
+        self.all_versions_check = QtWidgets.QCheckBox("All versions")
+        self.all_versions_check.setChecked(config.SHOW_ALL_VERSIONS)
+        self.all_versions_check.setToolTip("list superseded versions too, only the latest version is listed by default")
+
+        self.statusBar().addWidget(self.queue_count_label)
+        self.statusBar().addWidget(self.queue_eta_label)
+        self.statusBar().addPermanentWidget(self.all_versions_check)
+        self.statusBar().addPermanentWidget(self.auto_refresh_check)
+        self.statusBar().addPermanentWidget(self.refresh_interval_spin)
+        self.statusBar().addPermanentWidget(QtWidgets.QLabel("Parallel jobs:"))
+        self.statusBar().addPermanentWidget(self.pool_size_spin)
+
+    def update_rescan_timer(self, *args):
+        self.rescan_timer.stop()
+        if self.auto_refresh_check.isChecked():
+            self.rescan_timer.start(self.refresh_interval_spin.value() * 1000)
+
+    def update_queue_count(self, running, waiting):
+        self.queue_count_label.setText("running: {} | waiting: {}".format(running, waiting))
+
+    def update_queue_eta(self, queue_eta):
+        self.queue_eta_label.setText("queue ETA: {}".format(datetime.timedelta(seconds=int(queue_eta))) if queue_eta > 0 else "")
+
     def connect_events(self):
         self.project_combo.currentTextChanged.connect(self.on_project_change)
         self.epsoide_combo.currentTextChanged.connect(self.on_epsoide_change)
@@ -134,6 +241,16 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         self.jobs_queue_list_w.customContextMenuRequested.connect(self.jobs_context_menu)
 
         self.IS_JOB_RUNNING.connect(self.switch_job_mode)
+        self.JOB_COUNT_CHANGED.connect(self.update_queue_count)
+        self.QUEUE_ETA_CHANGED.connect(self.update_queue_eta)
+        self.REFERENCES_LOADED.connect(self.on_references_loaded)
+        self.FILES_CHANGED.connect(self.on_files_changed)
+        self.BROKER_POLLED.connect(self.on_broker_polled)
+        self.JOBS_RESTORED.connect(self.on_jobs_restored)
+        self.JOBS_ORDERED.connect(self.on_jobs_ordered)
+        self.auto_refresh_check.toggled.connect(self.update_rescan_timer)
+        self.refresh_interval_spin.valueChanged.connect(self.update_rescan_timer)
+        self.all_versions_check.toggled.connect(self.on_all_versions_toggled)
 
     def switch_job_mode(self, is_job_running):
         if is_job_running:
@@ -147,23 +264,36 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         self.epsoide_combo.setEnabled(False)
         self.files_list_w.setEnabled(False)
         self.reference_list_w.setEnabled(False)
+        self.pool_size_spin.setEnabled(False)
 
     def disable_job_mode(self):
         self.project_combo.setEnabled(True)
         self.epsoide_combo.setEnabled(True)
         self.files_list_w.setEnabled(True)
         self.reference_list_w.setEnabled(True)
+        self.pool_size_spin.setEnabled(True)
 
     def files_context_menu(self, point):
         self.files_popup_menu = QtWidgets.QMenu(self)
         action = self.files_popup_menu.addAction("Add to Queue")
         action.triggered.connect(self.create_job)
+        force_action = self.files_popup_menu.addAction("Add to Queue (force re-cache)")
+        force_action.triggered.connect(partial(self.create_job, force=True))
+        sharded_action = self.files_popup_menu.addAction("Add to Queue (split across processes)")
+        sharded_action.triggered.connect(partial(self.create_job, sharded=True))
+        self.files_popup_menu.addSeparator()
+        refresh = self.files_popup_menu.addAction("Refresh")
+        refresh.triggered.connect(partial(self.refresh_files, True))
         self.files_popup_menu.exec_(self.files_list_w.mapToGlobal(point))
 
     def reference_context_menu(self, point):
         self.referecne_popup_menu = QtWidgets.QMenu(self)
         action = self.referecne_popup_menu.addAction("Create Job from selected")
         action.triggered.connect(self.create_job)
+        force_action = self.referecne_popup_menu.addAction("Create Job from selected (force re-cache)")
+        force_action.triggered.connect(partial(self.create_job, force=True))
+        sharded_action = self.referecne_popup_menu.addAction("Create Job from selected (split across processes)")
+        sharded_action.triggered.connect(partial(self.create_job, sharded=True))
         self.referecne_popup_menu.exec_(self.reference_list_w.mapToGlobal(point))
 
     def jobs_context_menu(self, point):
@@ -174,6 +304,8 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         sort_by_status = self.jobs_popup_menu.addAction("by status")
         sort_by_default = self.jobs_popup_menu.addAction("by default")
         sort_by_name = self.jobs_popup_menu.addAction("by file name")
+        sort_by_estimate = self.jobs_popup_menu.addAction("by estimated time (run order)")
+        sort_by_estimate.triggered.connect(partial(self.sort_jobs, SortType.ESTIMATE))
         sort_by_status.triggered.connect(partial(self.sort_jobs, SortType.STATUS))
         sort_by_default.triggered.connect(partial(self.sort_jobs, SortType.DEFAULT))
         sort_by_name.triggered.connect(partial(self.sort_jobs, SortType.FILE_NAME))
@@ -184,9 +316,17 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         job_options.setEnabled(False)
         delete_job = self.jobs_popup_menu.addAction("Delete")
         re_queue = self.jobs_popup_menu.addAction("Re-Queue")
+        pin = self.jobs_popup_menu.addAction("Pin to Top")
+        unpin = self.jobs_popup_menu.addAction("Unpin")
+        pin.triggered.connect(partial(self.pin_jobs, True))
+        unpin.triggered.connect(partial(self.pin_jobs, False))
+        submit = self.jobs_popup_menu.addAction("Submit to Farm")
+        clear_history = self.jobs_popup_menu.addAction("Clear History")
 
         delete_job.triggered.connect(self.delete_jobs)
         re_queue.triggered.connect(self.re_queue_jobs)
+        submit.triggered.connect(self.submit_jobs)
+        clear_history.triggered.connect(self.clear_history)
 
         self.jobs_popup_menu.addSeparator()
         log_options = self.jobs_popup_menu.addAction("Log options")
@@ -207,14 +347,65 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         elif sort_type == SortType.FILE_NAME:
             jobs_list = sorted(self.all_jobs_queue, key=lambda x: x.maya_file_instance.file_name)
 
+        elif sort_type == SortType.ESTIMATE:
+            self.sort_jobs_by_estimate()
+            return
+
         else:
             jobs_list = sorted(self.all_jobs_queue, key=lambda x: x.status)
 
+        self.populate_jobs(jobs_list)
+
+    def populate_jobs(self, jobs_list):
         self.jobs_queue_list_w.clear()
         for job in jobs_list:
             item = CustomJobView(job)
             self.jobs_queue_list_w.addItem(item)
 
+    def sort_jobs_by_estimate(self):
+        """
+        order the queue in background, the scheduler reads file sizes, frame ranges and history from the share.
+        """
+        jobs = list(self.all_jobs_queue)
+        pool_size = self.pool_size_spin.value()
+
+        def order():
+            try:
+                groups = self.job_scheduler.order(core.coalesce_jobs(jobs))
+                self.job_scheduler.pool_size = pool_size
+                queue_eta = self.job_scheduler.update_etas(groups)
+            except Exception as err:
+                LOGGER.critical("unable to order jobs by estimate: {}".format(err))
+                return
+
+            jobs_list = [job for group in groups for job in group.jobs]
+            jobs_list.extend([job for job in jobs if job.status != core.Job.IN_QUEUE])
+            self.JOBS_ORDERED.emit(jobs_list, queue_eta)
+
+        thread = threading.Thread(target=order)
+        thread.daemon = True
+        thread.start()
+
+    def on_jobs_ordered(self, jobs_list, queue_eta):
+        # jobs added or removed while ordering keep their place at the end or are left out
+        jobs_list = [job for job in jobs_list if job in self.all_jobs_queue]
+        listed = set(id(job) for job in jobs_list)
+        jobs_list.extend([job for job in self.all_jobs_queue if id(job) not in listed])
+
+        self.populate_jobs(jobs_list)
+        self.update_queue_eta(queue_eta)
+
+    def pin_jobs(self, is_pinned):
+        """
+        pinned jobs run before the rest of the queue, the last pinned first.
+        """
+        priority = max([job.priority for job in self.all_jobs_queue] + [0]) + 1
+        for item in self.jobs_queue_list_w.selectedItems():  # type: CustomJobView
+            item.job_instance.priority = priority if is_pinned else 0
+            LOGGER.info("{} {}".format(item.job_instance, "pinned" if is_pinned else "unpinned"))
+
+        self.sort_jobs(SortType.ESTIMATE)
+
     def populate_projects(self):
         self.project_combo.addItem("Pirate Academy")
         self.project_combo.setEnabled(False)
@@ -240,17 +431,106 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         project = str(self.project_combo.currentText())
         episode = str(self.epsoide_combo.currentText())
 
+        for prefetcher in self.prefetchers:
+            prefetcher.cancel()
+        self.prefetchers = []
+
         LOGGER.info("getting maya files for project: {}, episode: {}".format(project, episode))
-        maya_files = core.get_maya_files(project, episode)
+        self.episode_index = core.Episode(project, episode)
+        maya_files = self.episode_index.scan(self.all_versions_check.isChecked())
         LOGGER.info("got total files: {}".format(len(maya_files)))
         self.files_list_w.clear()
         self.reference_list_w.clear()
+        self.file_items = {}
 
         for maya_file in maya_files:
             item = CustomFileView(maya_file)
             self.files_list_w.addItem(item)
+            self.file_items[maya_file.file_path] = item
 
         LOGGER.info("files populated")
+        self.prefetch_references(maya_files)
+
+    def prefetch_references(self, maya_files):
+        self.prefetchers = [prefetcher for prefetcher in self.prefetchers if prefetcher.is_alive()]
+        prefetcher = core.ReferencePrefetcher(maya_files, self.REFERENCES_LOADED.emit)
+        prefetcher.start()
+        self.prefetchers.append(prefetcher)
+
+    def refresh_files(self, deep=False):
+        """
+        incremental rescan of the current episode in background, the file list is updated in place.
+        """
+        if self.episode_index is None or self.is_refreshing:
+            return
+
+        self.is_refreshing = True
+        episode_index = self.episode_index
+
+        def refresh():
+            try:
+                self.FILES_CHANGED.emit(episode_index, episode_index.refresh(deep))
+            except Exception as err:
+                LOGGER.critical("unable to refresh {}: {}".format(episode_index.episode, err))
+                self.FILES_CHANGED.emit(episode_index, ([], [], []))
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def on_files_changed(self, episode_index, changes):
+        self.is_refreshing = False
+        if episode_index is not self.episode_index:
+            return
+
+        self.sync_file_items()
+
+    def on_all_versions_toggled(self, *args):
+        if self.episode_index is not None:
+            self.sync_file_items()
+
+    def sync_file_items(self):
+        """
+        update files_list_w in place to the current maya files of the episode,
+        references of new items are prefetched in background.
+        """
+        maya_files = self.episode_index.get_maya_files(self.all_versions_check.isChecked())
+        visible = dict((maya_file.file_path, maya_file) for maya_file in maya_files)
+
+        for file_path in [file_path for file_path in self.file_items if file_path not in visible]:
+            item = self.file_items.pop(file_path)
+            self.files_list_w.takeItem(self.files_list_w.row(item))
+
+        to_prefetch = []
+        selection_changed = False
+        for row, maya_file in enumerate(maya_files):
+            item = self.file_items.get(maya_file.file_path)
+            if item is None:
+                item = CustomFileView(maya_file)
+                self.files_list_w.insertItem(row, item)
+                self.file_items[maya_file.file_path] = item
+
+            elif item.maya_file is not maya_file:
+                item.maya_file = maya_file
+                item.refresh()
+                selection_changed = selection_changed or item.isSelected()
+
+            else:
+                continue
+
+            if not maya_file.is_loaded:
+                to_prefetch.append(maya_file)
+
+        if to_prefetch:
+            self.prefetch_references(to_prefetch)
+
+        if selection_changed:
+            self.update_reference()
+
+    def on_references_loaded(self, maya_file):
+        item = self.file_items.get(maya_file.file_path)
+        if item and item.maya_file is maya_file:
+            item.refresh()
 
     @utils.safe_run
     def update_reference(self, *args):
@@ -262,6 +542,7 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
             for reference in selected_file[0].maya_file.references:
                 item = CustomReferencesView(reference)
                 self.reference_list_w.addItem(item)
+            selected_file[0].refresh()
         LOGGER.info("references populated")
 
     def filter_reference(self, filter_type):
@@ -285,7 +566,13 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
                 self.reference_list_w.addItem(item)
 
     @utils.safe_run
-    def create_job(self, *args):
+    def create_job(self, *args, **kwargs):
+        """
+        queue jobs for selected files, references with an up to date cache are skipped at run time unless forced.
+        sharded jobs split their references across several maya processes.
+        """
+        force = kwargs.get("force", False)
+        sharded = kwargs.get("sharded", False)
         LOGGER.info("creating job")
         selected_files = self.files_list_w.selectedItems()  # type: list[CustomFileView]
         if selected_files and len(selected_files) < 2:
@@ -296,34 +583,175 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
         project = str(self.project_combo.currentText())
         episode = str(self.epsoide_combo.currentText())
 
+        duplicates = []
         for selected_file in selected_files:
-            job = core.Job(project, episode, selected_file.maya_file, selected_reference)
-            if self.check_if_job_exists(job):
-                message = "Job you wanted to create, already exists in job queue. skipping:\n\tFile: {}\n\tselected reference: {}".format(
-                    job.maya_file_instance.file_name, selected_reference if isinstance(selected_reference, str) else "\n\t\t".join([s.reference_node for s in selected_reference])
-                )
-                LOGGER.warning(message)
-                QtWidgets.QMessageBox.warning(self, "Job already exists", message)
-                return
+            job = core.Job(project, episode, selected_file.maya_file, selected_reference, force, sharded)
+            if not self.all_jobs_queue.add(job):
+                duplicates.append(job)
+                continue
+
+            self.job_store.save(job)
+            self.add_job_item(job)
+
+        if duplicates:
+            message = "Job you wanted to create, already exists in job queue. skipping:\n\tFile: {}\n\tselected reference: {}".format(
+                "\n\t\t".join([job.maya_file_instance.file_name for job in duplicates]),
+                selected_reference if isinstance(selected_reference, str) else "\n\t\t".join([s.reference_node for s in selected_reference])
+            )
+            LOGGER.warning(message)
+            QtWidgets.QMessageBox.warning(self, "Job already exists", message)
 
-            item = CustomJobView(job)
-            self.jobs_queue_list_w.addItem(item)
-            self.all_jobs_queue.append(job)
         LOGGER.info("job created.")
 
+    def add_job_item(self, job):
+        job.SIGNAL.connect(partial(self.job_store.record_transition, job))
+        item = CustomJobView(job)
+        self.jobs_queue_list_w.addItem(item)
+
+    def restore_jobs(self):
+        """
+        reload the queue of the last session, done jobs are kept and jobs interrupted while running are queued again.
+        headers of the maya files are parsed in background, the jobs are listed once all of them are read.
+        """
+        stored_jobs = self.job_store.load()
+        if not stored_jobs:
+            return
+
+        maya_files = {}
+        for stored in stored_jobs:
+            if stored["maya_file_path"] not in maya_files:
+                maya_files[stored["maya_file_path"]] = core.MayaFile(stored["project"], stored["episode"],
+                                                                     stored["maya_file_path"])
+
+        prefetcher = core.ReferencePrefetcher(list(maya_files.values()),
+                                              on_finished=partial(self.JOBS_RESTORED.emit, stored_jobs, maya_files))
+        prefetcher.start()
+
+    def on_jobs_restored(self, stored_jobs, maya_files):
+        for stored in stored_jobs:
+            maya_file = maya_files[stored["maya_file_path"]]
+            job = job_store.restore_job(stored, maya_file) if maya_file.is_loaded else None
+            if job is None:
+                LOGGER.warning("unable to restore job of {}".format(stored["maya_file_path"]))
+                self.job_store.remove_key(stored["job_key"])
+                continue
+
+            if job_store.make_key(job) != stored["job_key"]:
+                # references of the maya file changed since the job was queued
+                self.job_store.remove_key(stored["job_key"])
+                self.job_store.save(job)
+
+            if self.all_jobs_queue.add(job):
+                self.add_job_item(job)
+
+        if stored_jobs:
+            LOGGER.info("restored {} of {} jobs from the last session".format(len(self.all_jobs_queue), len(stored_jobs)))
+
+    def clear_history(self):
+        self.job_store.clear_history()
+        for row in reversed(range(self.jobs_queue_list_w.count())):
+            item = self.jobs_queue_list_w.item(row)  # type: CustomJobView
+            if item.job_instance.status == core.Job.DONE:
+                self.all_jobs_queue.remove(item.job_instance)
+                self.jobs_queue_list_w.takeItem(row)
+
+        LOGGER.info("job history cleared")
+
     def delete_jobs(self):
-        for item in self.jobs_queue_list_w.selectedItems():
+        for item in self.jobs_queue_list_w.selectedItems():  # type: CustomJobView
+            self.all_jobs_queue.remove(item.job_instance)
+            self.job_store.remove(item.job_instance)
+            for job_id, job in list(self.broker_jobs.items()):
+                if job is item.job_instance:
+                    LOGGER.warning("{} stays on the farm as job {}, only removed from the list".format(job, job_id))
+                    del self.broker_jobs[job_id]
             self.jobs_queue_list_w.takeItem(self.jobs_queue_list_w.row(item))
 
     def re_queue_jobs(self):
         for item in self.jobs_queue_list_w.selectedItems():  # type: CustomJobView
             if item.job_instance.status == core.Job.ERROR:
-                item.job_instance.status = core.Job.IN_QUEUE
-                item.change_color(core.Job.IN_QUEUE)
-                LOGGER.info("{} is re-queued".format(item.job_instance))
+                failed_count = len(item.job_instance.failed_references)
+                item.job_instance.requeue()
+                LOGGER.info("{} is re-queued, retrying {} failed references".format(item.job_instance, failed_count))
             else:
                 LOGGER.warning("only error jobs can be re-queue, skipping job: {}".format(item.job_instance))
 
+    def submit_jobs(self):
+        """
+        queue selected jobs on the farm broker, their status is polled from the broker until they finish.
+        """
+        if self.broker is None:
+            self.broker = job_broker.Broker()
+
+        remote_jobs = set(self.broker_jobs.values())
+        for item in self.jobs_queue_list_w.selectedItems():  # type: CustomJobView
+            job = item.job_instance
+            if job.status != core.Job.IN_QUEUE or job in remote_jobs:
+                LOGGER.warning("only queued jobs can be submitted, skipping job: {}".format(job))
+                continue
+
+            try:
+                job_id = self.broker.submit(job)
+            except Exception as err:
+                LOGGER.critical("unable to submit {} to the farm: {}".format(job, err))
+                QtWidgets.QMessageBox.warning(self, "Farm unavailable", "Unable to submit jobs to the farm:\n{}".format(err))
+                return
+
+            self.broker_jobs[job_id] = job
+            LOGGER.info("{} submitted to the farm as job {}".format(job, job_id))
+
+        if self.broker_jobs and not self.broker_timer.isActive():
+            self.broker_timer.start(config.BROKER_POLL_INTERVAL * 1000)
+
+    def poll_broker(self):
+        """
+        read the status of submitted jobs in background, the broker database is on the network share.
+        """
+        if self.is_polling_broker or not self.broker_jobs:
+            return
+
+        self.is_polling_broker = True
+        job_ids = list(self.broker_jobs.keys())
+
+        def poll():
+            try:
+                self.BROKER_POLLED.emit(self.broker.get_status(job_ids))
+            except Exception as err:
+                LOGGER.warning("unable to poll the farm: {}".format(err))
+                self.BROKER_POLLED.emit({})
+
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+
+    def on_broker_polled(self, rows):
+        self.is_polling_broker = False
+        for job_id, row in rows.items():
+            job = self.broker_jobs.get(job_id)  # type: core.Job
+            if job is None:
+                continue
+
+            if row["status"] == job_broker.LEASED:
+                if job.status != core.Job.IP:
+                    job.set_status(core.Job.IP)
+                job.update_progress(row["progress"] or 0.0)
+
+            elif row["status"] in (job_broker.DONE, job_broker.ERROR):
+                result = maya_launcher.CacheResult.from_dict(row["result"] or {})
+                references = job.reference_to_cache if job.retry_references is None else job.retry_references
+                if result.references:
+                    # references the farm found up to date were not exported and are not in its result
+                    references = [ref for ref in references if core.get_result_key(ref) in result.references]
+                job.set_result(result, references)
+                del self.broker_jobs[job_id]
+                LOGGER.info("{} finished on {}: {}".format(job, row["worker"], job.status))
+
+            elif job.status != core.Job.IN_QUEUE:
+                job.set_status(core.Job.IN_QUEUE)
+
+        if not self.broker_jobs:
+            self.broker_timer.stop()
+
     @staticmethod
     def open_log():
         subprocess.Popen("{} file:///{}".format(config.LOG_VIEWER, LOG_PATH.replace("\\", "/")))
@@ -341,12 +769,6 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
             else:
                 LOGGER.warning("maya log path don't exists, {}".format(log_path))
 
-    def check_if_job_exists(self, job):
-        all_jobs = [self.jobs_queue_list_w.item(i).job_instance for i in range(self.jobs_queue_list_w.count())]
-        for each_job in all_jobs:  # type: core.Job
-            if each_job == job:
-                return True
-
     def select_all_reference(self):
         self.reference_list_w.selectAll()
 
@@ -356,10 +778,16 @@ class Main(QtWidgets.QMainWindow, cache_manager_ui.Ui_MainWindow):
     @utils.safe_run
     def start_process_jobs(self, *args):
         LOGGER.info("creating job runner")
-        runner = JobRunner(self.IS_JOB_RUNNING)
+        runner = JobRunner(self.IS_JOB_RUNNING,
+                           self.JOB_COUNT_CHANGED,
+                           self.pool_size_spin.value(),
+                           self.job_scheduler,
+                           self.QUEUE_ETA_CHANGED)
+        remote_jobs = set(self.broker_jobs.values())
         for i in range(self.jobs_queue_list_w.count()):
             item = self.jobs_queue_list_w.item(i)  # type: CustomJobView
-            runner.jobs_to_run.append(item.job_instance)
+            if item.job_instance not in remote_jobs:
+                runner.jobs_to_run.append(item.job_instance)
 
         LOGGER.info("runner crated")
         runner.start()